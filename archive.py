@@ -0,0 +1,69 @@
+import gzip, json, os, threading
+from datetime import date
+
+ARCHIVE_KINDS = ("training_booking", "locker_booking", "order", "daypass")
+
+# one lock per archive file for the whole process. branches archive side by side and every branch has its own
+# store, but they can share a directory (and the daypass / guest files in it), and two gzip appends to the same
+# file must not interleave
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def file_lock(path):
+    path = os.path.abspath(path)
+    with _file_locks_guard:
+        lock = _file_locks.get(path)
+        if lock is None:
+            lock = _file_locks[path] = threading.Lock()
+        return lock
+
+class ArchiveStore:
+    # cold tier: one gzip'd json-lines file per member and record kind, appended as extra gzip members
+    def __init__(self, root = "archive"):
+        self.__root = root
+
+    @property
+    def root(self):
+        return self.__root
+
+    def __getstate__(self):
+        return {"root": self.__root}
+
+    def __setstate__(self, state):
+        self.__root = state["root"]
+
+    def __path(self, owner_id, kind):
+        return os.path.join(self.__root, owner_id, f"{kind}.jsonl.gz")
+
+    def append(self, owner_id, kind, records):
+        if kind not in ARCHIVE_KINDS:
+            raise Exception(f"Invalid archive kind: {kind}. Valid: {', '.join(ARCHIVE_KINDS)}")
+        if not records:
+            return 0
+        path = self.__path(owner_id, kind)
+        with file_lock(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, "at", encoding="utf-8") as file:
+                for record in records:
+                    file.write(json.dumps(record, default=str) + "\n")
+        return len(records)
+
+    def query(self, owner_id, kind = None, since = None, until = None):
+        kinds = [kind] if kind else ARCHIVE_KINDS
+        results = []
+        for record_kind in kinds:
+            path = self.__path(owner_id, record_kind)
+            if not os.path.exists(path):
+                continue
+            # an append half way through would read as a truncated gzip member
+            with file_lock(path), gzip.open(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    record = json.loads(line)
+                    record_date = date.fromisoformat(record["date"])
+                    if since and record_date < since:
+                        continue
+                    if until and record_date > until:
+                        continue
+                    results.append(record)
+        results.sort(key=lambda record: record["date"])
+        return results
@@ -0,0 +1,72 @@
+import itertools, random
+from datetime import datetime, date, time, timedelta
+from functools import lru_cache
+
+import pytest
+
+from benchmarks.datagen import generate_gym
+
+# members per dataset, classes and history scale along with it so the complexity curve shows up per method
+SIZES = [100, 1000, 5000]
+
+@lru_cache(maxsize=None)
+def dataset(size):
+    return generate_gym(members=size, classes=max(4, size // 50), years=1, orders_per_member_per_year=6, rooms=max(2, size // 250))
+
+@pytest.fixture(params=SIZES, ids=lambda size: f"members={size}")
+def gym_data(request):
+    gym, data = dataset(request.param)
+    return gym, data, random.Random(request.param)
+
+def test_get_member_by_id(benchmark, gym_data):
+    gym, data, rng = gym_data
+    member_id = data["member_ids"][-1]
+    benchmark(gym.get_member_by_id, member_id)
+
+def test_get_session_by_id(benchmark, gym_data):
+    gym, data, rng = gym_data
+    session_id = data["future_session_ids"][-1]
+    benchmark(gym.get_session_by_id, session_id)
+
+def test_reserve_locker(benchmark, gym_data):
+    gym, data, rng = gym_data
+    base = datetime.combine(date.today(), time(6, 0))
+
+    def setup():
+        start = base + timedelta(days=rng.randint(0, 365), hours=rng.randint(0, 14))
+        return (rng.choice(data["member_ids"]), rng.random() < 0.2, start, 2), {}
+
+    benchmark.pedantic(gym.reserve_locker, setup=setup, rounds=200)
+
+def test_enroll_member_by_id(benchmark, gym_data):
+    gym, data, rng = gym_data
+    # every round uses a new (member, session) pair the member is free for, double bookings are refused
+    member_ids = list(data["member_ids"])
+    rng.shuffle(member_ids)
+    pairs = itertools.product(data["future_session_ids"], member_ids)
+
+    def setup():
+        for session_id, member_id in pairs:
+            if not gym.get_member_by_id(member_id).get_booking_conflict(gym.get_session_by_id(session_id)):
+                return (member_id, session_id), {}
+        raise Exception("ran out of free (member, session) pairs")
+
+    benchmark.pedantic(gym.enroll_member_by_id, setup=setup, rounds=200)
+
+def test_gather_report(benchmark, gym_data):
+    gym, data, rng = gym_data
+    last_month = date.today().replace(day=1) - timedelta(days=1)
+    benchmark(gym.gather_report, last_month.month, last_month.year)
+
+def test_get_available_classes(benchmark, gym_data):
+    gym, data, rng = gym_data
+    benchmark(gym.get_available_classes)
+
+def test_cancel_session(benchmark, gym_data):
+    gym, data, rng = gym_data
+    session_ids = iter(data["future_session_ids"][::-1])
+
+    def setup():
+        return (next(session_ids),), {}
+
+    benchmark.pedantic(gym.cancel_session, setup=setup, rounds=min(50, len(data["future_session_ids"])))
@@ -0,0 +1,67 @@
+import argparse, json, random, sys, time
+from datetime import date, timedelta
+
+from benchmarks.datagen import generate_gym
+
+def timetable_request(dataset, sessions, seed = 0):
+    # the generated classes asked again, a few sessions a week each, some only for senior trainers
+    rng = random.Random(seed)
+    classes = []
+    class_ids = dataset["class_ids"]
+    while sessions > 0:
+        count = min(sessions, rng.randint(2, 5))
+        classes.append({
+            "class_id": class_ids[len(classes) % len(class_ids)],
+            "sessions": count,
+            "duration": rng.choice([45, 60, 90]),
+            "max_participants": rng.choice([8, 12, 20]),
+            "tiers": rng.choice([None, ["Senior", "Master"]])
+        })
+        sessions -= count
+    return classes
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Plan a weekly timetable for a generated branch and report how good it got within the budget")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--trainers", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=300, help="sessions a week to place")
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--budget", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    # datagen gives one trainer per two classes and a year of weekly sessions as history / things to work around
+    gym, dataset = generate_gym(args.members, args.trainers * 2, rooms=args.rooms, seed=args.seed)
+    dataset["class_ids"] = [gym_class["Class id"] for gym_class in gym.get_catalog("classes")]
+    classes = timetable_request(dataset, args.sessions, args.seed)
+    week_start = date.today() + timedelta(days=7 - date.today().weekday())
+
+    start = time.perf_counter()
+    problem = gym.build_timetable_problem(classes, week_start)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    plan = gym.plan_timetable(classes, week_start, budget=args.budget, workers=args.workers)
+    plan_time = time.perf_counter() - start
+
+    text = json.dumps({
+        "rooms": len(problem.rooms),
+        "trainers": len(problem.trainers),
+        "sessions": len(plan["sessions"]),
+        "budget_s": args.budget,
+        "workers": plan["restarts"],
+        "build_time_s": round(build_time, 3),
+        "plan_time_s": round(plan_time, 3),
+        "conflicts": plan["conflicts"],
+        "cost": plan["cost"],
+        "iterations": plan["iterations"]
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,118 @@
+import argparse, json, os, random, subprocess, sys, threading, time
+
+import httpx
+
+from benchmarks.load_test import percentile
+
+# the catalog views are answered from each worker's own copies, the rest is forwarded to the state owner
+CATALOG_PATHS = [
+    "/member/showclass",
+    "/member/showprivate",
+    "/manager/getstockinfo",
+]
+FORWARDED_PATHS = [
+    "/member/showbooking/MEM-001",
+    "/member/checkselfinfo/MEM-002",
+]
+READ_PATHS = {
+    "all": CATALOG_PATHS + FORWARDED_PATHS,
+    "catalog": CATALOG_PATHS,
+    "forwarded": FORWARDED_PATHS
+}
+
+def wait_until_up(base_url, timeout = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise Exception(f"server at {base_url} didn't come up within {timeout}s")
+
+def drive(base_url, seconds, concurrency, write_ratio, seed, read_paths = READ_PATHS["all"]):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client_loop(index):
+        rng = random.Random(seed + index)
+        own = []
+        with httpx.Client(base_url=base_url, timeout=10) as client:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                if rng.random() < write_ratio:
+                    response = client.post("/receptionist/sellproduct", json={"product_id": "PRD-002", "amount": 1})
+                else:
+                    response = client.get(rng.choice(read_paths))
+                own.append(time.perf_counter() - start)
+                if response.status_code >= 500:
+                    with lock:
+                        errors[0] += 1
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / wall_time, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3)
+    }
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Compare api throughput from 1 to N uvicorn workers sharing one state owner")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    parser.add_argument("--reads", choices=READ_PATHS, default="all", help="which reads to drive: the catalog views workers answer themselves, the ones forwarded to the owner, or both")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--profile", default="demo")
+    parser.add_argument("--path")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    for workers in range(1, args.max_workers + 1):
+        command = [sys.executable, "main.py", "--profile", args.profile, "--no-mcp", "--workers", str(workers), "--port", str(args.port)]
+        if args.path:
+            command += ["--path", args.path]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(base_url)
+            result = drive(base_url, args.seconds, args.concurrency, args.write_ratio, args.seed, READ_PATHS[args.reads])
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        result["workers"] = workers
+        results.append(result)
+        print(f"workers={workers} {result['throughput_rps']} req/s p50={result['p50_ms']}ms p99={result['p99_ms']}ms", file=sys.stderr)
+
+    text = json.dumps({
+        "seconds": args.seconds,
+        "concurrency": args.concurrency,
+        "write_ratio": args.write_ratio,
+        "reads": args.reads,
+        "cpu_count": os.cpu_count(),
+        "results": results
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
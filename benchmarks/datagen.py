@@ -0,0 +1,105 @@
+import random
+from datetime import datetime, date, time, timedelta
+
+from project import Gym, Session, CashPayment, ProductAmount
+
+MEMBERSHIPS = ["Monthly", "Annual", "Student"]
+TIERS = ["Junior", "Senior", "Master"]
+
+def pay_order(order, paid_at = None):
+    # goes through the real payment flow, then backdates the payment so reports see years of history
+    order.set_payment(CashPayment())
+    order.process()
+    order.verify_and_update_all_info()
+    if paid_at:
+        order.payment.set_timestamp(paid_at)
+
+def materialize(sessions, index):
+    # series occurrences only become real sessions once something gets booked on them
+    if not isinstance(sessions[index], Session):
+        sessions[index] = sessions[index].materialize()
+    return sessions[index]
+
+def generate_gym(members = 500, classes = 20, years = 1, orders_per_member_per_year = 12, rooms = 5, products = 20, seed = 0):
+    rng = random.Random(seed)
+    gym = Gym(f"bench gym {members}x{classes}x{years}", "benchmark street")
+    today = date.today()
+    history_start = today - timedelta(days=365 * years)
+
+    product_list = [gym.create_product(f"product {i}", 10 ** 6, rng.choice([15, 40, 90, 250, 1500])) for i in range(products)]
+
+    room_list = []
+    for i in range(rooms):
+        room = gym.create_room(f"studio {i}", 20)
+        room.create_lockers(20, 5)
+        room_list.append(room)
+
+    manager = gym.create_manager("100000000", "bench manager", date(1980, 1, 1))
+    receptionist = gym.create_receptionist("100000001", "bench receptionist", date(1990, 1, 1))
+    trainer_list = [gym.create_trainer(f"2{i:08d}", f"trainer {i}", date(1990, 1, 1), rng.choice(TIERS), "general") for i in range(max(1, classes // 2))]
+
+    past_sessions = []
+    future_sessions = []
+    today_sessions = []
+    for i in range(classes):
+        gym_class = gym.create_class(f"class {i}", "generated class")
+        room = room_list[i % rooms]
+        hour = 6 + (i // rooms) % 14
+        if i == 0:
+            # a daily class so there is always something to check in to today
+            start_date, interval, count = today - timedelta(days=30), 1, 60
+        else:
+            start_date, interval, count = history_start + timedelta(days=i % 7), 7, 52 * years + 8
+        # trainers take turns, one already teaching at that hour is skipped
+        for offset in range(len(trainer_list)):
+            trainer = trainer_list[(i + offset) % len(trainer_list)]
+            try:
+                gym_class.create_repeating_session(time(hour, 0), time(hour + 1, 0), start_date, interval, count, 20, room, trainer)
+                break
+            except Exception:
+                continue
+        for session in gym_class.get_sessions():
+            if session.date < today:
+                past_sessions.append(session)
+            elif session.date == today:
+                today_sessions.append(session)
+            else:
+                future_sessions.append(session)
+
+    member_list = [gym.create_member(f"3{i:08d}", f"member {i}", date(1995, 1, 1), membership=rng.choice(MEMBERSHIPS), status="Active") for i in range(members)]
+
+    # historical paid orders, each with a training booking and sometimes a product
+    for member in member_list:
+        for _ in range(orders_per_member_per_year * years):
+            if not past_sessions:
+                break
+            session = materialize(past_sessions, rng.randrange(len(past_sessions)))
+            if not session.has_free_seat() or member.get_booking_conflict(session):
+                continue
+            order = gym.create_order(member)
+            booking = session.enroll_member(member)
+            order.add_order_item(booking)
+            if rng.random() < 0.3:
+                order.add_order_item(ProductAmount(rng.choice(product_list), rng.randint(1, 3)))
+            pay_order(order, datetime.combine(session.date, time(9, 0)) - timedelta(days=1))
+
+    # paid bookings today so check-ins have something to find
+    for member in rng.sample(member_list, min(len(member_list), 20 * len(today_sessions))):
+        session = materialize(today_sessions, rng.randrange(len(today_sessions)))
+        if not session.has_free_seat() or member.get_booking_conflict(session):
+            continue
+        order = gym.create_order(member)
+        order.add_order_item(session.enroll_member(member))
+        pay_order(order)
+
+    return gym, {
+        "member_ids": [member.member_id for member in member_list],
+        "future_session_ids": [session.session_id for session in future_sessions],
+        "today_session_ids": [session.session_id for session in today_sessions],
+        "product_ids": [product.product_id for product in product_list],
+        "manager_id": manager.staff_id,
+        "receptionist_id": receptionist.staff_id,
+        "trainer_ids": [trainer.staff_id for trainer in trainer_list],
+        "room_ids": [room.room_id for room in room_list],
+        "sessions": len(past_sessions) + len(today_sessions) + len(future_sessions)
+    }
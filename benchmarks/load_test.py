@@ -0,0 +1,164 @@
+import argparse, json, random, sys, time
+from datetime import date
+
+from fastapi.testclient import TestClient
+
+from database import get_gym
+from main import create_app
+from benchmarks.datagen import generate_gym
+
+# (scenario, weight) - roughly what the front desk and the member app do during a busy day
+DEFAULT_MIX = {
+    "browse_classes": 30,
+    "browse_private": 10,
+    "show_bookings": 15,
+    "show_orders": 10,
+    "enroll": 15,
+    "pay": 10,
+    "check_in": 5,
+    "report": 3,
+    "stock": 2,
+}
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+class LoadTest:
+    def __init__(self, client, dataset, seed = 0):
+        self.__client = client
+        self.__dataset = dataset
+        self.__rng = random.Random(seed)
+        self.__latencies = {}
+        self.__statuses = {}
+
+    def __call(self, name, method, path, **kwargs):
+        start = time.perf_counter()
+        response = self.__client.request(method, path, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.__latencies.setdefault(name, []).append(elapsed)
+        statuses = self.__statuses.setdefault(name, {})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return response
+
+    def __member_id(self):
+        return self.__rng.choice(self.__dataset["member_ids"])
+
+    def browse_classes(self):
+        self.__call("GET /member/showclass", "GET", "/member/showclass")
+
+    def browse_private(self):
+        self.__call("GET /member/showprivate", "GET", "/member/showprivate")
+
+    def show_bookings(self):
+        self.__call("GET /member/showbooking/{member_id}", "GET", f"/member/showbooking/{self.__member_id()}")
+
+    def show_orders(self):
+        self.__call("GET /member/showorder/{member_id}", "GET", f"/member/showorder/{self.__member_id()}")
+
+    def enroll(self):
+        if not self.__dataset["future_session_ids"]:
+            return
+        self.__call("POST /member/enrollsession", "POST", "/member/enrollsession", json={
+            "member_id": self.__member_id(),
+            "session_id": self.__rng.choice(self.__dataset["future_session_ids"])
+        })
+
+    def pay(self):
+        member_id = self.__member_id()
+        self.__call("POST /receptionist/sellproduct", "POST", "/receptionist/sellproduct", json={
+            "product_id": self.__rng.choice(self.__dataset["product_ids"]),
+            "amount": 1,
+            "member_id": member_id
+        })
+        orders = self.__call("GET /member/showorder/{member_id}", "GET", f"/member/showorder/{member_id}").json().get("orders", [])
+        for order in orders:
+            if order["status"] == "Pending":
+                self.__call("POST /receptionist/pay_order/cash", "POST", "/receptionist/pay_order/cash", json={"order_id": order["order_id"]})
+                break
+
+    def check_in(self):
+        self.__call("POST /receptionist/checkinmember", "POST", "/receptionist/checkinmember", json={"member_id": self.__member_id()})
+
+    def report(self):
+        self.__call("GET /manager/getreport", "GET", "/manager/getreport", params={"month": self.__rng.randint(1, date.today().month), "year": date.today().year})
+
+    def stock(self):
+        self.__call("GET /manager/getstockinfo", "GET", "/manager/getstockinfo")
+
+    def run(self, requests, mix):
+        scenarios = list(mix)
+        weights = [mix[name] for name in scenarios]
+        start = time.perf_counter()
+        for _ in range(requests):
+            getattr(self, self.__rng.choices(scenarios, weights)[0])()
+        return time.perf_counter() - start
+
+    def results(self, wall_time):
+        endpoints = {}
+        total = 0
+        for name, latencies in sorted(self.__latencies.items()):
+            total += len(latencies)
+            endpoints[name] = {
+                "count": len(latencies),
+                "statuses": {str(code): count for code, count in sorted(self.__statuses[name].items())},
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+                "throughput_rps": round(len(latencies) / sum(latencies), 1) if sum(latencies) else 0.0
+            }
+        return {
+            "total_requests": total,
+            "wall_time_s": round(wall_time, 3),
+            "throughput_rps": round(total / wall_time, 1) if wall_time else 0.0,
+            "endpoints": endpoints
+        }
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Drive the gym routers in-process with a synthetic dataset and report latency per endpoint")
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--classes", type=int, default=20)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--orders-per-year", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help="json object of scenario -> weight")
+    parser.add_argument("--output", help="write the json results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    gym, dataset = generate_gym(args.members, args.classes, args.years, args.orders_per_year, seed=args.seed)
+    generate_time = time.perf_counter() - start
+
+    app = create_app(mount_mcp=False)
+    app.dependency_overrides[get_gym] = lambda: gym
+    with TestClient(app) as client:
+        load_test = LoadTest(client, dataset, args.seed)
+        wall_time = load_test.run(args.requests, args.mix)
+
+    result = {
+        "dataset": {
+            "members": args.members,
+            "classes": args.classes,
+            "sessions": dataset["sessions"],
+            "years": args.years,
+            "orders_per_year": args.orders_per_year,
+            "generate_time_s": round(generate_time, 3)
+        },
+        "mix": args.mix,
+        "seed": args.seed,
+        **load_test.results(wall_time)
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return result
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,212 @@
+import threading
+
+class GymRegistry:
+    # one Gym per branch, plus global indexes so a member or order can be found from any branch
+    # without scanning every branch's lists
+    def __init__(self, default_branch = "main"):
+        self.__default_branch = default_branch
+        self.__branches = {}
+        self.__member_index = {}
+        self.__citizen_index = {}
+        self.__order_index = {}
+        # booking_id -> booking, written by the members of every branch (see Member.set_booking_index)
+        self.__booking_index = {}
+        self.__lock = threading.RLock()
+        # called with the branch id after a write touched one of its catalog collections
+        self.__on_touch = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_GymRegistry__lock"]
+        state.pop("_GymRegistry__on_touch", None)
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("_GymRegistry__booking_index", {})
+        self.__dict__.update(state)
+        self.__lock = threading.RLock()
+        self.__on_touch = None
+
+    @property
+    def lock(self):
+        return self.__lock
+
+    def set_on_touch(self, callback):
+        self.__on_touch = callback
+
+    def touched(self, branch_id):
+        if self.__on_touch:
+            self.__on_touch(branch_id)
+
+    @property
+    def booking_index(self):
+        return self.__booking_index
+
+    @property
+    def default_branch(self):
+        return self.__default_branch
+
+    @property
+    def branch_ids(self):
+        return list(self.__branches)
+
+    def add_branch(self, branch_id, gym):
+        with self.__lock:
+            if branch_id in self.__branches:
+                raise Exception(f"Branch {branch_id} already exists")
+            self.__branches[branch_id] = gym
+            gym.set_registry(self, branch_id)
+        return gym
+
+    def replace_branch(self, branch_id, gym):
+        with self.__lock:
+            old_gym = self.__branches.pop(branch_id, None)
+            if old_gym:
+                members = {member_id for member_id, value in self.__member_index.items() if value == branch_id}
+                for booking_id in [booking_id for booking_id, booking in self.__booking_index.items() if booking.member.member_id in members]:
+                    del self.__booking_index[booking_id]
+                for index in (self.__member_index, self.__citizen_index, self.__order_index):
+                    for key in [key for key, value in index.items() if value == branch_id]:
+                        del index[key]
+            return self.add_branch(branch_id, gym)
+
+    def create_branch(self, branch_id, name, location):
+        from project import Gym
+        return self.add_branch(branch_id, Gym(name, location))
+
+    def get_gym(self, branch_id = None):
+        branch_id = branch_id or self.__default_branch
+        if branch_id not in self.__branches:
+            raise Exception(f"Branch {branch_id} not found")
+        return self.__branches[branch_id]
+
+    def get_branches(self):
+        return [{
+            "branch_id": branch_id,
+            "name": gym.name,
+            "location": gym.location
+        } for branch_id, gym in self.__branches.items()]
+
+    def index_member(self, branch_id, member):
+        with self.__lock:
+            self.__member_index[member.member_id] = branch_id
+            self.__citizen_index[member.citizen_id] = branch_id
+
+    def index_member_alias(self, branch_id, member_id):
+        # a member id merged into another member of the branch, the branch resolves it
+        with self.__lock:
+            self.__member_index[member_id] = branch_id
+
+    def index_citizen_id(self, branch_id, citizen_id):
+        with self.__lock:
+            self.__citizen_index[citizen_id] = branch_id
+
+    def claim_citizen_id(self, branch_id, citizen_id):
+        # check and insert under the registry lock, so two branches can't sign up the same person at once
+        with self.__lock:
+            holder = self.__citizen_index.get(citizen_id)
+            if holder is not None and holder != branch_id:
+                raise Exception(f"citizen_id {citizen_id} is already registered at branch {holder}")
+            self.__citizen_index[citizen_id] = branch_id
+
+    def index_order(self, branch_id, order):
+        with self.__lock:
+            self.__order_index[order.order_id] = branch_id
+
+    def forget_order(self, order_id):
+        # the order was archived, its branch doesn't hold it anymore
+        with self.__lock:
+            self.__order_index.pop(order_id, None)
+
+    def find_member(self, member_id):
+        branch_id = self.__member_index.get(member_id)
+        member = branch_id and self.__branches[branch_id].find_local_member(member_id)
+        if not member:
+            raise Exception("member not found")
+        return member
+
+    def find_by_citizen_id(self, citizen_id):
+        branch_id = self.__citizen_index.get(citizen_id)
+        user = branch_id and self.__branches[branch_id].find_local_user(citizen_id)
+        if not user:
+            raise Exception("user not found")
+        return user
+
+    def find_order(self, order_id):
+        branch_id = self.__order_index.get(order_id)
+        order = branch_id and self.__branches[branch_id].find_local_order(order_id)
+        if not order:
+            raise Exception("order not found")
+        return order
+
+    def find_booking(self, booking_id):
+        return self.__booking_index.get(booking_id)
+
+    def home_branch(self, member_id):
+        # None for a member id no branch knows
+        return self.__member_index.get(member_id)
+
+    def get_member_branch(self, member_id):
+        if member_id not in self.__member_index:
+            raise Exception("member not found")
+        return self.__member_index[member_id]
+
+    def __map(self, function):
+        # one branch after the other: the work is pure python, threads wouldn't run it any faster, and each
+        # branch is only locked for its own part
+        return {branch_id: function(gym) for branch_id, gym in list(self.__branches.items())}
+
+    def gather_report(self, month, year):
+        reports = self.__map(lambda gym: gym.gather_report(month, year))
+        revenue_data = {}
+        membership_type_count = {}
+        total_revenue = 0.0
+        matched_orders_count = 0
+        for report in reports.values():
+            for key, value in report["revenue"].items():
+                revenue_data[key] = revenue_data.get(key, 0.0) + value
+            for key, value in report["membership_distribution"].items():
+                membership_type_count[key] = membership_type_count.get(key, 0) + value
+            total_revenue += report["total_revenue"]
+            matched_orders_count += report["matched_orders_count"]
+        return {
+            "month": month,
+            "year": year,
+            "matched_orders_count": matched_orders_count,
+            "revenue": revenue_data,
+            "total_revenue": round(total_revenue, 2),
+            "membership_distribution": membership_type_count,
+            "branches": reports
+        }
+
+    def sweep_expired(self, now = None):
+        results = self.__map(lambda gym: gym.sweep_expired(now))
+        expiries = [result["next_expiry"] for result in results.values() if result["next_expiry"]]
+        return {
+            "expired": sum(result["expired"] for result in results.values()),
+            "expired_ids": [item_id for result in results.values() for item_id in result["expired_ids"]],
+            "renewal_orders": [order_id for result in results.values() for order_id in result["renewal_orders"]],
+            "next_expiry": min(expiries) if expiries else None
+        }
+
+    def sweep_memberships(self, now = None):
+        results = self.__map(lambda gym: gym.sweep_memberships(now))
+        checks = [result["next_check"] for result in results.values() if result["next_check"]]
+        return {
+            "expired": sum(result["expired"] for result in results.values()),
+            "expired_ids": [member_id for result in results.values() for member_id in result["expired_ids"]],
+            "renewal_orders": [order_id for result in results.values() for order_id in result["renewal_orders"]],
+            "next_check": min(checks) if checks else None
+        }
+
+    def archive_before(self, cutoff = None):
+        results = self.__map(lambda gym: gym.archive_before(cutoff))
+        archived = {}
+        for result in results.values():
+            for kind, count in result["archived"].items():
+                archived[kind] = archived.get(kind, 0) + count
+        return {
+            "cutoff": cutoff or min(result["cutoff"] for result in results.values()),
+            "archived": archived,
+            "branches": results
+        }
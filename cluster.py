@@ -0,0 +1,433 @@
+import itertools, mmap, struct, threading, weakref
+import time as timer
+from collections import OrderedDict, deque
+from contextlib import ExitStack
+from datetime import datetime, date, time, timedelta
+from enum import Enum
+from multiprocessing.connection import Listener, Client
+
+from replica import CatalogEntry
+
+# the state owner keeps the only real Gym. workers answer the catalog views from their own copies (see
+# CatalogCopies), everything else is forwarded: every attribute access / method call on a RemoteObject runs
+# inside the owner under the branch locks, so router code works unchanged
+PLAIN_TYPES = (str, bytes, int, float, bool, type(None), datetime, date, time, timedelta, Enum)
+# a handle nobody used or released for this long is dropped (a worker that died, a finalizer that never ran)
+HANDLE_TTL = 300.0
+# how long a worker trusts a catalog copy without asking, the owner's views move without a write too
+# (sessions passing), same bound as the owner's ReadReplica
+CATALOG_MAX_AGE = 5.0
+EPOCH = struct.Struct("q")
+
+class VersionBoard:
+    # one counter in a small shared file, bumped by the owner after every write that touches a catalog
+    # collection in any branch. workers map the file and read it without a round trip, so a worker knows its
+    # catalog copies are still good without asking the owner
+    def __init__(self, path, create = False):
+        self.__path = path
+        self.__lock = threading.Lock()
+        if create:
+            with open(path, "wb") as file:
+                file.write(bytes(mmap.PAGESIZE))
+        self.__file = open(path, "r+b" if create else "rb")
+        self.__map = mmap.mmap(self.__file.fileno(), mmap.PAGESIZE, access=mmap.ACCESS_WRITE if create else mmap.ACCESS_READ)
+
+    @property
+    def path(self):
+        return self.__path
+
+    def read(self):
+        return EPOCH.unpack_from(self.__map)[0]
+
+    def bump(self, branch_id = None):
+        with self.__lock:
+            EPOCH.pack_into(self.__map, 0, self.read() + 1)
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+class Ref:
+    def __init__(self, handle, type_name):
+        self.handle = handle
+        self.type_name = type_name
+
+class MethodMarker:
+    pass
+
+def is_plain(value):
+    if isinstance(value, PLAIN_TYPES):
+        return True
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(is_plain(item) for item in value)
+    if isinstance(value, dict):
+        return all(is_plain(key) and is_plain(item) for key, item in value.items())
+    return False
+
+class StateServer:
+    def __init__(self, root, address, authkey, handle_ttl = HANDLE_TTL):
+        self.__root = root
+        self.__address = address
+        self.__authkey = authkey
+        # handle -> [object, outstanding refs, last used], oldest use first. handles come from a counter so
+        # one is never reused, a handle is held until every ref sent out for it is released or it times out
+        self.__handles = OrderedDict()
+        # id(object) -> handle, valid as long as the handle holds the object
+        self.__handle_ids = {}
+        self.__next_handle = itertools.count(1)
+        self.__handle_ttl = handle_ttl
+        self.__handle_lock = threading.Lock()
+        self.__listener = None
+
+    @property
+    def handle_count(self):
+        return len(self.__handles)
+
+    @property
+    def address(self):
+        return self.__address
+
+    def start(self):
+        self.__listener = Listener(self.__address, family="AF_UNIX", authkey=self.__authkey)
+        threading.Thread(target=self.__accept_loop, name="state-server", daemon=True).start()
+
+    def close(self):
+        if self.__listener:
+            self.__listener.close()
+
+    def __accept_loop(self):
+        while True:
+            try:
+                connection = self.__listener.accept()
+            except OSError:
+                return
+            except Exception as e:
+                print(f"State server rejected a connection: {e}")
+                continue
+            threading.Thread(target=self.__serve, args=(connection,), daemon=True).start()
+
+    def __serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    op, handle, name, args, kwargs, releases = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    self.__release(releases)
+                    if op == "catalog":
+                        # the replica builds under the branch lock itself and hands out finished entries
+                        result = self.__catalog(name, *args)
+                    else:
+                        # the objects behind the proxies aren't thread safe, reads wait for writes like
+                        # they would in a single process
+                        with self.__locked():
+                            result = self.__execute(op, handle, name, args, kwargs)
+                    connection.send(("ok", result))
+                except Exception as e:
+                    connection.send(("error", str(e)))
+
+    def __locked(self):
+        # every branch lock, always in the same order. gym code only ever takes the registry lock inside a
+        # branch lock, never the other way around, so the registry lock isn't taken here
+        stack = ExitStack()
+        if hasattr(self.__root, "branch_ids"):
+            gyms = [self.__root.get_gym(branch_id) for branch_id in sorted(self.__root.branch_ids)]
+        else:
+            gyms = [self.__root]
+        for gym in gyms:
+            stack.enter_context(gym.lock)
+        return stack
+
+    def __catalog(self, view, branch_id, etag):
+        # None when the worker's copy is still the owner's view, otherwise what a CatalogEntry is made of
+        gym = self.__root.get_gym(branch_id) if hasattr(self.__root, "branch_ids") else self.__root
+        entry = gym.get_catalog_entry(view)
+        if entry.etag == etag:
+            return None
+        return entry.data, entry.etag, entry.last_modified
+
+    def __lookup(self, handle):
+        if handle == 0:
+            return self.__root
+        with self.__handle_lock:
+            entry = self.__handles.get(handle)
+            if entry is None:
+                raise Exception("object no longer exists")
+            entry[2] = timer.monotonic()
+            self.__handles.move_to_end(handle)
+            return entry[0]
+
+    def __register(self, obj):
+        if obj is self.__root:
+            return Ref(0, type(obj).__name__)
+        now = timer.monotonic()
+        with self.__handle_lock:
+            handle = self.__handle_ids.get(id(obj))
+            if handle is None:
+                handle = next(self.__next_handle)
+                self.__handles[handle] = [obj, 0, now]
+                self.__handle_ids[id(obj)] = handle
+            entry = self.__handles[handle]
+            entry[1] += 1
+            entry[2] = now
+            self.__handles.move_to_end(handle)
+            self.__expire(now)
+        return Ref(handle, type(obj).__name__)
+
+    def __drop(self, handle):
+        obj = self.__handles.pop(handle)[0]
+        del self.__handle_ids[id(obj)]
+
+    def __expire(self, now):
+        while self.__handles:
+            handle, entry = next(iter(self.__handles.items()))
+            if now - entry[2] < self.__handle_ttl:
+                return
+            self.__drop(handle)
+
+    def __release(self, releases):
+        if not releases:
+            return
+        with self.__handle_lock:
+            for handle in releases:
+                entry = self.__handles.get(handle)
+                if entry is None:
+                    continue
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    self.__drop(handle)
+
+    def __decode(self, value):
+        if isinstance(value, Ref):
+            return self.__lookup(value.handle)
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.__decode(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self.__decode(item) for key, item in value.items()}
+        return value
+
+    def __encode(self, value):
+        if is_plain(value):
+            return value
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.__encode(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self.__encode(item) for key, item in value.items()}
+        return self.__register(value)
+
+    def __execute(self, op, handle, name, args, kwargs):
+        obj = self.__lookup(handle)
+        if op == "getattr":
+            value = getattr(obj, name)
+            if callable(value) and not is_plain(value):
+                return MethodMarker()
+            return self.__encode(value)
+        if op == "call":
+            result = getattr(obj, name)(*self.__decode(args), **self.__decode(kwargs))
+            return self.__encode(result)
+        raise Exception(f"Invalid operation: {op}")
+
+class StateClient:
+    def __init__(self, address, authkey):
+        self.__address = address
+        self.__authkey = authkey
+        self.__local = threading.local()
+        self.__methods = set()
+        # handles of remote objects that were garbage collected, sent along with the next request.
+        # a deque because finalizers can run in the middle of a request on the same thread
+        self.__releases = deque()
+
+    def __connection(self):
+        # multiprocessing connections aren't thread safe, every threadpool thread gets its own
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection = Client(self.__address, family="AF_UNIX", authkey=self.__authkey)
+            self.__local.connection = connection
+        return connection
+
+    def is_method(self, type_name, name):
+        return (type_name, name) in self.__methods
+
+    def remember_method(self, type_name, name):
+        self.__methods.add((type_name, name))
+
+    def release(self, handle):
+        self.__releases.append(handle)
+
+    def __take_releases(self):
+        releases = []
+        while True:
+            try:
+                releases.append(self.__releases.popleft())
+            except IndexError:
+                return releases
+
+    def request(self, op, handle, name, args = (), kwargs = None):
+        connection = self.__connection()
+        connection.send((op, handle, name, self.__encode(args), self.__encode(kwargs or {}), self.__take_releases()))
+        status, value = connection.recv()
+        if status == "error":
+            raise Exception(value)
+        return self.__decode(value)
+
+    def __encode(self, value):
+        if isinstance(value, WorkerGym):
+            value = value.remote
+        if isinstance(value, RemoteObject):
+            return value._ref
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.__encode(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self.__encode(item) for key, item in value.items()}
+        return value
+
+    def __decode(self, value):
+        if isinstance(value, Ref):
+            remote = RemoteObject(self, value)
+            if value.handle != 0:
+                # every ref the server sent counts once, it is given back when its proxy goes away
+                weakref.finalize(remote, self.release, value.handle)
+            return remote
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.__decode(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self.__decode(item) for key, item in value.items()}
+        return value
+
+    def root(self):
+        return RemoteObject(self, Ref(0, "root"))
+
+class RemoteMethod:
+    def __init__(self, client, owner, name):
+        # holds the proxy, not just its ref, so the handle isn't released while the method is still around
+        self.__client = client
+        self.__owner = owner
+        self.__name = name
+
+    def __call__(self, *args, **kwargs):
+        return self.__client.request("call", self.__owner._ref.handle, self.__name, args, kwargs)
+
+class RemoteObject:
+    def __init__(self, client, ref):
+        object.__setattr__(self, "_client", client)
+        object.__setattr__(self, "_ref", ref)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        client = self._client
+        ref = self._ref
+        if client.is_method(ref.type_name, name):
+            return RemoteMethod(client, self, name)
+        value = client.request("getattr", ref.handle, name)
+        if isinstance(value, MethodMarker):
+            client.remember_method(ref.type_name, name)
+            return RemoteMethod(client, self, name)
+        return value
+
+    def __setattr__(self, name, value):
+        raise AttributeError("remote objects are read only, call their methods instead")
+
+    def __repr__(self):
+        return f"<remote {self._ref.type_name} {self._ref.handle}>"
+
+class CatalogCopies:
+    # a worker's copies of the owner's catalog views, (branch_id, view) -> (entry, epoch, pulled at). a copy
+    # is served as is while the owner's epoch hasn't moved and it's younger than max_age, otherwise the owner
+    # is asked whether its view still has the copy's etag and only sends the view when it doesn't. the entry
+    # is rebuilt here, so serializing and compressing it is the worker's work, not the owner's
+    def __init__(self, client, board, max_age = CATALOG_MAX_AGE):
+        self.__client = client
+        self.__board = board
+        self.__max_age = max_age
+        self.__copies = {}
+        self.__locks = {}
+
+    def __is_fresh(self, copy, epoch):
+        return copy is not None and copy[1] == epoch and timer.monotonic() - copy[2] < self.__max_age
+
+    def entry(self, branch_id, view):
+        key = (branch_id, view)
+        epoch = self.__board.read()
+        copy = self.__copies.get(key)
+        if self.__is_fresh(copy, epoch):
+            return copy[0]
+        lock = self.__locks.setdefault(key, threading.Lock())
+        if not lock.acquire(blocking=copy is None):
+            # another thread is pulling it, the old copy is still within bounds
+            return copy[0]
+        try:
+            copy = self.__copies.get(key)
+            if self.__is_fresh(copy, epoch):
+                return copy[0]
+            # the epoch is read before pulling, a write that lands meanwhile gets pulled next time
+            pulled_at = timer.monotonic()
+            value = self.__client.request("catalog", 0, view, (branch_id, copy[0].etag if copy else None))
+            entry = copy[0] if value is None else CatalogEntry(view, *value)
+            self.__copies[key] = (entry, epoch, pulled_at)
+            return entry
+        finally:
+            lock.release()
+
+class WorkerGym:
+    # a branch as a worker sees it: the catalog views come from the worker's copies, anything else is
+    # forwarded to the branch's gym in the owner
+    def __init__(self, catalogs, registry, branch_id):
+        self.__catalogs = catalogs
+        self.__registry = registry
+        self.__branch_id = branch_id
+        self.__remote = None
+
+    @property
+    def branch_id(self):
+        return self.__branch_id
+
+    def get_catalog_entry(self, view):
+        return self.__catalogs.entry(self.__branch_id, view)
+
+    def get_catalog(self, view):
+        return self.get_catalog_entry(view).data
+
+    def get_catalog_validators(self, view):
+        entry = self.get_catalog_entry(view)
+        return entry.etag, entry.last_modified
+
+    @property
+    def remote(self):
+        if self.__remote is None:
+            self.__remote = self.__registry.get_gym(self.__branch_id)
+        return self.__remote
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.remote, name)
+
+class WorkerRegistry:
+    # what get_registry gives a worker. get_gym is answered here so a catalog read costs no round trip,
+    # the rest of the registry is forwarded
+    def __init__(self, client, board):
+        self.__remote = client.root()
+        self.__catalogs = CatalogCopies(client, board)
+        self.__default_branch = None
+        self.__branch_ids = frozenset()
+
+    def get_gym(self, branch_id = None):
+        if self.__default_branch is None:
+            self.__default_branch = self.__remote.default_branch
+        branch_id = branch_id or self.__default_branch
+        if branch_id not in self.__branch_ids:
+            # branches are only ever added, so a miss is a new branch or one that doesn't exist
+            self.__branch_ids = frozenset(self.__remote.branch_ids)
+            if branch_id not in self.__branch_ids:
+                raise Exception(f"Branch {branch_id} not found")
+        return WorkerGym(self.__catalogs, self.__remote, branch_id)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.__remote, name)
+
+def connect(address, authkey, board_path):
+    return WorkerRegistry(StateClient(address, authkey), VersionBoard(board_path))
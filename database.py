@@ -1,6 +1,24 @@
+from typing import Optional
+
+from branches import GymRegistry
 from project import Gym
 
-gym = Gym("my gym", "1/45 bangkok thailand")
+registry = GymRegistry("main")
+registry.add_branch("main", Gym("my gym", "1/45 bangkok thailand"))
+
+def get_registry():
+    return registry
+
+def set_registry(new_registry):
+    global registry
+    registry = new_registry
+
+def get_gym(branch_id: Optional[str] = None):
+    try:
+        return registry.get_gym(branch_id)
+    except Exception as e:
+        from fastapi import HTTPException
+        raise HTTPException(status_code=404, detail=str(e))
 
-def get_gym():
-    return gym
\ No newline at end of file
+def set_gym(new_gym):
+    registry.replace_branch(registry.default_branch, new_gym)
@@ -0,0 +1,51 @@
+class DaypassLedger:
+    # daypasses by date, then by citizen id, so "does this person have one today" and "how many went out today"
+    # are a dict lookup and a len. days older than the archive cutoff are popped off and go to the archive
+    def __init__(self, daily_limit = None):
+        self.__days = {}
+        self.__daily_limit = daily_limit
+
+    @property
+    def daily_limit(self):
+        return self.__daily_limit
+
+    def set_daily_limit(self, daily_limit):
+        if daily_limit is not None and daily_limit < 0:
+            raise Exception("Daily daypass limit can't be negative")
+        self.__daily_limit = daily_limit
+
+    def __len__(self):
+        return sum(len(passes) for passes in self.__days.values())
+
+    def has(self, day, citizen_id):
+        passes = self.__days.get(day)
+        return passes is not None and citizen_id in passes
+
+    def get(self, day, citizen_id):
+        return self.__days.get(day, {}).get(citizen_id)
+
+    def count(self, day):
+        return len(self.__days.get(day, ()))
+
+    def check(self, day, citizen_id):
+        if self.has(day, citizen_id):
+            raise Exception(f"Daypass for {day} already purchased.")
+        if self.__daily_limit is not None and self.count(day) >= self.__daily_limit:
+            raise Exception(f"No daypasses left for {day}, the limit is {self.__daily_limit} a day")
+
+    def add(self, day, citizen_id, daypass):
+        self.check(day, citizen_id)
+        self.__days.setdefault(day, {})[citizen_id] = daypass
+
+    def release(self, day, citizen_id):
+        passes = self.__days.get(day)
+        if passes is not None and passes.pop(citizen_id, None) is not None and not passes:
+            del self.__days[day]
+
+    def roll_off(self, cutoff, record):
+        # every day before cutoff leaves the ledger, record(day, citizen_id, daypass) builds what gets archived
+        records = []
+        for day in sorted(day for day in self.__days if day < cutoff):
+            for citizen_id, daypass in self.__days.pop(day).items():
+                records.append(record(day, citizen_id, daypass))
+        return records
@@ -1,16 +1,13 @@
 from datetime import datetime, date, time, timedelta
-import uvicorn, pprint
-from fastapi import FastAPI, HTTPException, APIRouter
-from fastapi_mcp import FastApiMCP
-
-from project import Gym, Member, Trainer
-from routers.members import router as member_router
-from routers.trainers import router as trainer_router
-from routers.receptionists import router as receptionist_router
-from routers.managers import router as manager_router
-from database import gym
-
-def create_stuff():
+import argparse, os, pprint
+import time as timer
+
+import database
+from branches import GymRegistry
+from startup import PROFILES, boot, save_snapshot
+
+def create_stuff(gym = None):
+    gym = gym or database.get_gym()
     # create products
     gym.create_product("Energy drink", 50, 40)
     gym.create_product("Water", 100, 15)
@@ -41,7 +38,7 @@ def create_stuff():
 
     # create classes and their sessions
     gaming_class = gym.create_class("gaming", "play e sport")
-    gaming_class.create_repeating_session(time(10,0,0),time(22,30,0),date(2026,11,3),7,10,5,multi_studio,gym_bro)
+    gaming_class.create_repeating_session(time(10,0,0),time(15,0,0),date(2026,11,3),7,10,5,multi_studio,gym_bro)
 
     yoga_class = gym.create_class("yoga", "stretchin dat bodae")
     yoga_class.create_repeating_session(time(10,0,0),time(11,30,0),date(2026,2,7),7,5,10,yoga_studio,gym_bro)
@@ -131,8 +128,34 @@ def create_stuff():
     gym_bro.write_training_plan(night_bike_sched, "we'll be biking for 30 km")
     gym_bro.write_training_plan(bob_membership, "focus on training the lower leg area")
     
-def run_api():
-    app = FastAPI()
+MCP_EXCLUDED_PATHS = {
+    "/member/showclass",
+    "/member/showprivate",
+    "/member/showbooking/{member_id}",
+    "/member/showorder/{member_id}",
+    "/metrics",
+    "/metrics/instrumentation",
+    "/metrics/profile/start",
+    "/metrics/profile/stop",
+    "/metrics/profile"
+}
+
+def create_app(mount_mcp = True):
+    # imported here so booting just to write a snapshot doesn't pay for fastapi / the routers / mcp
+    from fastapi import FastAPI
+    from metrics import MetricsMiddleware
+    from routers.members import router as member_router
+    from routers.trainers import router as trainer_router
+    from routers.receptionists import router as receptionist_router
+    from routers.managers import router as manager_router
+    from routers.metrics import router as metrics_router
+    from routers.agent import router as agent_router
+    from serialization import FastJSONResponse, NegotiatedGZipMiddleware
+
+    app = FastAPI(default_response_class=FastJSONResponse)
+    # catalog routes bring their own precompressed bodies, this covers everything else that's large
+    app.add_middleware(NegotiatedGZipMiddleware, minimum_size=1024)
+    app.add_middleware(MetricsMiddleware)
 
     @app.get("/")
     def home():
@@ -142,12 +165,79 @@ def run_api():
     app.include_router(trainer_router)
     app.include_router(receptionist_router)
     app.include_router(manager_router)
-
-    mcp = FastApiMCP(app)
-    mcp.mount()
-
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    app.include_router(metrics_router)
+    app.include_router(agent_router)
+
+    if mount_mcp:
+        from fastapi_mcp import FastApiMCP
+        # agents get the paginated /agent tools instead of the unbounded lists, and no profiler controls
+        paths = app.openapi()["paths"]
+        excluded = [operation["operationId"] for path in MCP_EXCLUDED_PATHS for operation in paths.get(path, {}).values()]
+        mcp = FastApiMCP(app, exclude_operations=excluded)
+        mcp.mount()
+    return app
+
+def create_worker_app():
+    # uvicorn factory for --workers > 1, every worker talks to the state owner instead of holding its own gym
+    from cluster import connect
+    database.set_registry(connect(os.environ["GYM_STATE_SOCKET"], os.environ["GYM_STATE_AUTHKEY"].encode(), os.environ["GYM_STATE_VERSIONS"]))
+    return create_app(os.environ.get("GYM_MCP", "1") != "0")
+
+def run_api(mount_mcp = True, host = "0.0.0.0", port = 8000, workers = 1):
+    import uvicorn
+    from sweeper import PendingSweeper
+
+    # the registry fans sweeps and archiving out to every branch, including ones added later
+    sweeper = PendingSweeper(database.get_registry())
+    sweeper.start()
+
+    if workers > 1:
+        import atexit, secrets, tempfile
+        from cluster import StateServer, VersionBoard
+
+        address = os.path.join(tempfile.gettempdir(), f"gym-state-{os.getpid()}.sock")
+        authkey = secrets.token_hex(16)
+        # workers keep their own copies of the catalog views, the board tells them when a write made them old
+        board = VersionBoard(os.path.join(tempfile.gettempdir(), f"gym-state-{os.getpid()}.versions"), create=True)
+        database.get_registry().set_on_touch(board.bump)
+        server = StateServer(database.get_registry(), address, authkey.encode())
+        server.start()
+        atexit.register(server.close)
+        atexit.register(os.remove, board.path)
+        os.environ["GYM_STATE_SOCKET"] = address
+        os.environ["GYM_STATE_AUTHKEY"] = authkey
+        os.environ["GYM_STATE_VERSIONS"] = board.path
+        os.environ["GYM_MCP"] = "1" if mount_mcp else "0"
+        print(f"[startup] state owner listening on {address}, starting {workers} workers")
+        uvicorn.run("main:create_worker_app", factory=True, workers=workers, host=host, port=port, log_level="info")
+        return
+
+    start = timer.perf_counter()
+    app = create_app(mount_mcp)
+    print(f"[startup] app built in {(timer.perf_counter() - start) * 1000:.0f} ms (mcp {'on' if mount_mcp else 'off'})")
+
+    uvicorn.run(app, host=host, port=port, log_level="info")
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description="Run the gym api")
+    parser.add_argument("--profile", choices=PROFILES, default=os.environ.get("GYM_STARTUP", "demo"), help="empty, demo seed, load a snapshot or load a fixture file")
+    parser.add_argument("--path", default=os.environ.get("GYM_STARTUP_PATH"), help="snapshot or fixture file for those profiles")
+    parser.add_argument("--no-mcp", action="store_true", default=os.environ.get("GYM_MCP", "1") == "0", help="don't mount the mcp server")
+    parser.add_argument("--save-snapshot", metavar="PATH", help="write a snapshot of the booted gym to PATH and exit")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("GYM_WORKERS", 1)), help="more than 1 runs uvicorn workers that share this process's gym over a unix socket")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    create_stuff()
-    run_api()
\ No newline at end of file
+    args = parse_args()
+    state, boot_time = boot(args.profile, args.path, seed=create_stuff)
+    if isinstance(state, GymRegistry):
+        database.set_registry(state)
+    else:
+        database.set_gym(state)
+    print(f"[startup] profile '{args.profile}' booted in {boot_time * 1000:.0f} ms")
+    if args.save_snapshot:
+        save_snapshot(database.get_registry(), args.save_snapshot)
+        print(f"[startup] snapshot written to {args.save_snapshot}")
+    else:
+        run_api(mount_mcp=not args.no_mcp, port=args.port, workers=args.workers)
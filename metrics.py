@@ -0,0 +1,197 @@
+import os, sys, threading, time
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.__buckets = buckets
+        self.__counts = [0] * (len(buckets) + 1)
+        self.__sum = 0.0
+        self.__count = 0
+
+    def observe(self, value):
+        self.__counts[bisect_left(self.__buckets, value)] += 1
+        self.__sum += value
+        self.__count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.__buckets + (float("inf"),), self.__counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.__sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.__count}")
+        return lines
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+class MetricsRegistry:
+    def __init__(self, enabled = False):
+        self.__lock = threading.Lock()
+        self.__help = {}
+        self.__histograms = {}
+        self.__counters = {}
+        self.__enabled = enabled
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    def set_enabled(self, enabled):
+        self.__enabled = enabled
+
+    def describe(self, name, text):
+        self.__help[name] = text
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                self.__histograms[key] = histogram
+            histogram.observe(value)
+
+    def increment(self, name, labels, amount = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + amount
+
+    def render(self):
+        lines = []
+        with self.__lock:
+            for kind, metrics in (("histogram", self.__histograms), ("counter", self.__counters)):
+                seen = set()
+                for name, labels in sorted(metrics):
+                    if name not in seen:
+                        seen.add(name)
+                        if name in self.__help:
+                            lines.append(f"# HELP {name} {self.__help[name]}")
+                        lines.append(f"# TYPE {name} {kind}")
+                    if kind == "histogram":
+                        lines.extend(metrics[(name, labels)].render(name, labels))
+                    else:
+                        lines.append(f"{name}{format_labels(labels)} {metrics[(name, labels)]}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry(enabled=os.environ.get("GYM_INSTRUMENT", "0") == "1")
+registry.describe("http_request_duration_seconds", "Latency of HTTP requests by route")
+registry.describe("gym_method_duration_seconds", "Time spent in instrumented Gym methods")
+registry.describe("gym_method_errors_total", "Instrumented Gym method calls that raised")
+
+def instrument(name):
+    # opt-in: while the registry is disabled this is just one attribute check per call
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return method(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                registry.increment("gym_method_errors_total", {"method": name})
+                raise
+            finally:
+                registry.observe("gym_method_duration_seconds", {"method": name}, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            registry.observe("http_request_duration_seconds", {
+                "method": scope["method"],
+                "route": getattr(route, "path", "unmatched"),
+                "status": status["code"]
+            }, time.perf_counter() - start)
+
+class SamplingProfiler:
+    # samples every thread's stack at a fixed interval and keeps them as collapsed stacks (flamegraph.pl / speedscope format)
+    def __init__(self, interval = 0.005):
+        self.__interval = interval
+        self.__stacks = Counter()
+        self.__samples = 0
+        self.__stop_event = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    @property
+    def samples(self):
+        return self.__samples
+
+    def start(self, seconds = None, interval = None):
+        if self.is_running:
+            raise Exception("Profiler is already running")
+        if interval:
+            self.__interval = interval
+        with self.__lock:
+            self.__stacks = Counter()
+            self.__samples = 0
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, args=(seconds,), name="sampling-profiler", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__thread:
+            self.__thread.join()
+        self.__thread = None
+        return self.collapsed()
+
+    def collapsed(self):
+        with self.__lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.__stacks.most_common()) + "\n"
+
+    def __run(self, seconds):
+        deadline = time.monotonic() + seconds if seconds else None
+        own_id = threading.get_ident()
+        while not self.__stop_event.wait(self.__interval):
+            if deadline and time.monotonic() >= deadline:
+                break
+            frames = sys._current_frames()
+            with self.__lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    self.__stacks[";".join(reversed(stack))] += 1
+                self.__samples += 1
+
+profiler = SamplingProfiler()
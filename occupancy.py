@@ -0,0 +1,136 @@
+ATTENDED_STATUSES = ("Check-in", "Completed")
+LATE_STATUSES = ("Late Check-in",)
+NO_SHOW_STATUSES = ("No-show",)
+
+class OccupancyBucket:
+    def __init__(self):
+        self.__sessions = 0
+        self.__seats = 0
+        self.__booked = 0
+        self.__attended = 0
+        self.__late = 0
+        self.__no_show = 0
+        self.__room_hours = 0.0
+        self.__seat_hours = 0.0
+        self.__capacity_hours = 0.0
+
+    def apply(self, stats, sign = 1):
+        self.__sessions += sign
+        self.__seats += sign * stats["seats"]
+        self.__booked += sign * stats["booked"]
+        self.__attended += sign * stats["attended"]
+        self.__late += sign * stats["late"]
+        self.__no_show += sign * stats["no_show"]
+        self.__room_hours += sign * stats["hours"]
+        self.__seat_hours += sign * stats["booked"] * stats["hours"]
+        self.__capacity_hours += sign * stats["room_capacity"] * stats["hours"]
+
+    def merge(self, other):
+        self.__sessions += other.__sessions
+        self.__seats += other.__seats
+        self.__booked += other.__booked
+        self.__attended += other.__attended
+        self.__late += other.__late
+        self.__no_show += other.__no_show
+        self.__room_hours += other.__room_hours
+        self.__seat_hours += other.__seat_hours
+        self.__capacity_hours += other.__capacity_hours
+
+    @staticmethod
+    def rate(part, whole):
+        return round(part / whole, 4) if whole else 0.0
+
+    @property
+    def info(self):
+        showed_up = self.__attended + self.__late
+        return {
+            "sessions": self.__sessions,
+            "seats": self.__seats,
+            "booked": self.__booked,
+            "attended": showed_up,
+            "fill_rate": self.rate(self.__booked, self.__seats),
+            "no_show_rate": self.rate(self.__no_show, self.__booked),
+            "late_check_in_rate": self.rate(self.__late, showed_up),
+            "room_hours": round(self.__room_hours, 2),
+            "room_hour_utilisation": self.rate(self.__seat_hours, self.__capacity_hours)
+        }
+
+class OccupancyTracker:
+    # sessions are folded into per month buckets when they get recorded, so queries only ever sum <= 12 buckets per key
+    def __init__(self):
+        self.__buckets = {}
+        self.__recorded = {}
+
+    @staticmethod
+    def session_stats(session):
+        stats = {
+            "seats": session.max_participants,
+            "booked": 0,
+            "attended": 0,
+            "late": 0,
+            "no_show": 0,
+            "hours": (session.end - session.start).total_seconds() / 3600,
+            "room_capacity": session.room.max_people
+        }
+        for booking in session.training_booking_list:
+            if booking.status in ATTENDED_STATUSES:
+                stats["attended"] += 1
+            elif booking.status in LATE_STATUSES:
+                stats["late"] += 1
+            elif booking.status in NO_SHOW_STATUSES:
+                stats["no_show"] += 1
+            else:
+                continue
+            stats["booked"] += 1
+        return stats
+
+    @staticmethod
+    def session_keys(session):
+        period = (session.date.year, session.date.month)
+        gym_class = session.gym_class
+        return [
+            ("all", None) + period,
+            ("room", session.room.room_id) + period,
+            ("trainer", session.trainer.staff_id) + period,
+            ("class", gym_class.class_id if gym_class else "Private") + period
+        ]
+
+    def __apply(self, keys, stats, sign):
+        for key in keys:
+            bucket = self.__buckets.get(key)
+            if bucket is None:
+                bucket = OccupancyBucket()
+                self.__buckets[key] = bucket
+            bucket.apply(stats, sign)
+
+    def record_session(self, session):
+        # recording the same session twice replaces its earlier contribution
+        previous = self.__recorded.get(session.session_id)
+        if previous:
+            self.__apply(*previous, -1)
+        keys = self.session_keys(session)
+        stats = self.session_stats(session)
+        self.__apply(keys, stats, 1)
+        self.__recorded[session.session_id] = (keys, stats)
+
+    def is_recorded(self, session_id):
+        return session_id in self.__recorded
+
+    def summary(self, year, month = None, dimension = "all", key = None):
+        months = [month] if month else range(1, 13)
+        total = OccupancyBucket()
+        by_month = {}
+        for m in months:
+            bucket = self.__buckets.get((dimension, key, year, m))
+            if bucket is None:
+                continue
+            total.merge(bucket)
+            by_month[m] = bucket.info
+        return {
+            "year": year,
+            "month": month,
+            "dimension": dimension,
+            "key": key,
+            "total": total.info,
+            "by_month": by_month
+        }
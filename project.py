@@ -1,10 +1,55 @@
 from abc import ABC, abstractmethod
+from collections import Counter, deque
+from contextlib import ExitStack
 from datetime import datetime, date, time, timedelta
 from enum import Enum
+from functools import wraps
 from os import name
-import textwrap
+import heapq, inspect, itertools, os, textwrap, threading
 
 from paymentgateway import payment_gateway, QRCode
+from occupancy import OccupancyTracker
+from stockledger import StockLedger
+from daypass import DaypassLedger
+from sweeper import ExpiryIndex
+from archive import ArchiveStore
+from replica import ReadReplica
+from timeline import Timeline, free_windows
+from timetable import TimetableProblem, solve
+from serialization import cached_info
+from metrics import instrument
+
+CATALOG_COLLECTIONS = ("classes", "sessions", "products", "rooms", "staff")
+
+def named_member_ids(parameters, args, kwargs):
+    # the member ids a call is given through a member_id or member_ids argument
+    member_ids = []
+    for name in ("member_id", "member_ids"):
+        if name in kwargs:
+            value = kwargs[name]
+        elif name in parameters and parameters.index(name) - 1 < len(args):
+            value = args[parameters.index(name) - 1]
+        else:
+            continue
+        if value:
+            member_ids.extend([value] if name == "member_id" else value)
+    return member_ids
+
+def synchronized(method = None, touches = CATALOG_COLLECTIONS):
+    # touches: the catalog collections a write can change, their version counters get bumped after it.
+    # a write given a member from another branch changes that member too, so it holds their home branch as well
+    if method is None:
+        return lambda method: synchronized(method, touches)
+    parameters = list(inspect.signature(method).parameters)
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.locked_with_members(named_member_ids(parameters, args, kwargs)):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if touches:
+                    self.touch(*touches)
+    return wrapper
 
 class OrderItem(ABC):
     def __init__(self, payment_status = "Pending"):
@@ -14,6 +59,15 @@ class OrderItem(ABC):
     @property
     def price_paid(self):
         return self.__price_paid
+
+    @property
+    def payment_status(self):
+        return self.__payment_status
+
+    @property
+    def info_key(self):
+        # what item_info shows that can still change once the order is closed
+        return (self.__payment_status, self.__price_paid)
     
     def item_info(self, user = None):
         return {
@@ -41,16 +95,37 @@ class OrderItem(ABC):
         return
 
 class DayPass(OrderItem):
-    def __init__(self, payment_status="Pending"):
+    def __init__(self, payment_status="Pending", user = None, day = None):
         super().__init__(payment_status)
-        self.__date = date.today()
+        self.__user = user
+        self.__date = day or date.today()
+
+    def __setstate__(self, state):
+        state.setdefault("_DayPass__user", None)
+        state.setdefault("_DayPass__date", None)
+        self.__dict__.update(state)
+
+    def set_holder(self, user, day):
+        self.__user = user
+        self.__date = day
+
+    @property
+    def user(self):
+        return self.__user
+
+    @property
+    def date(self):
+        return self.__date
     
+    @instrument("DayPass.calculate_price")
     def calculate_price(self, user = None):
         return 500
     
     def set_paid(self, amount):
         self.set_price_paid(amount)
         self.set_payment_status("Paid")
+        if self.__user:
+            self.__user.add_guest_date(self.__date)
 
     def set_refunded(self, amount):
         return
@@ -66,10 +141,15 @@ class NewMembership(OrderItem):
         self.__membership = membership
         self.__member = member
 
+    def __setstate__(self, state):
+        state.setdefault("_NewMembership__member", None)
+        self.__dict__.update(state)
+
     @property
     def membership(self):
         return self.__membership
 
+    @instrument("NewMembership.calculate_price")
     def calculate_price(self, user = None):
         return MembershipPlan[self.__membership.upper()].price
     
@@ -78,6 +158,7 @@ class NewMembership(OrderItem):
         self.set_payment_status("Paid")
         if self.__member:
             self.__member.activate()
+            self.__member.start_term(self.__membership)
 
     def set_refunded(self, amount):
         return
@@ -102,16 +183,23 @@ class Booking(OrderItem):
     def booking_id(self):
         return self.__booking_id
     
+    @property
+    def info_key(self):
+        return super().info_key + (self.__status,)
+
     def set_status(self, status):
         self.__status = status
 
     def confirm(self):
-        self.__status = "Confirmed"
+        self.set_status("Confirmed")
 
     def cancel(self):
-        self.__status = "Cancelled"
+        self.set_status("Cancelled")
 
 class TrainingBooking(Booking):
+    CLOSED_STATUSES = ("Completed", "Cancelled", "No-show")
+    # the member is still expected at (or was at) the session
+    ACTIVE_STATUSES = ("Waitlist", "Pending", "Confirmed", "Check-in", "Late Check-in")
 
     def __init__(self, member, session, status="Pending"):
         super().__init__(status)
@@ -123,6 +211,9 @@ class TrainingBooking(Booking):
     @property
     def member(self):
         return self.__member
+
+    def set_member(self, member):
+        self.__member = member
     
     @property
     def session(self):
@@ -136,10 +227,29 @@ class TrainingBooking(Booking):
     def locker_booking(self):
         return self.__locker_booking
 
+    @property
+    def start(self):
+        return self.__session.start
+
+    @property
+    def end(self):
+        return self.__session.end
+
+    def is_active(self):
+        return self.status in TrainingBooking.ACTIVE_STATUSES and self.__session.status != "Cancelled"
+
     @property
     def info(self):
+        # finished bookings don't change, their info is built once and shared
+        if self.status in TrainingBooking.CLOSED_STATUSES:
+            return cached_info(self, self.status, self.__build_info)
+        return self.__build_info()
+
+    def __build_info(self):
         if self.status == "Pending":
             status_text = "Pending. Please Pay to Confirm Booking"
+        elif self.status == "Waitlist":
+            status_text = "Waitlist. Will be moved to Pending when a seat frees up"
         else:
             status_text = self.status
         return {
@@ -157,6 +267,8 @@ class TrainingBooking(Booking):
             text += f"Session has been cancelled"
         elif self.status == "Pending":
              text += "Pending. Please Pay to Confirm Booking"
+        elif self.status == "Waitlist":
+            text += "On the waitlist. Will be moved to Pending when a seat frees up"
         elif self.status == "Confirmed":
             now = datetime.now(self.__session.start.tzinfo)
             difference = self.__session.start - now
@@ -173,6 +285,7 @@ class TrainingBooking(Booking):
                 text += " days until session"
         return text
         
+    @instrument("TrainingBooking.calculate_price")
     def calculate_price(self, user = None):
         membership_type = self.__member.current_membership
         membership_enum = MembershipPlan[membership_type.upper()]
@@ -185,6 +298,28 @@ class TrainingBooking(Booking):
         discount_price = round(price * (1 - discount), 2)
         return discount_price
     
+    @property
+    def archive_record(self):
+        return {
+            "booking_id": self.booking_id,
+            "session_id": self.__session.session_id,
+            "date": self.__session.date.isoformat(),
+            "status": self.status,
+            "training_log": self.__training_log,
+            "price_paid": self.price_paid,
+            "info": self.info
+        }
+
+    def is_archivable(self, cutoff):
+        # a late check-in still holds the time so it isn't closed, but once the session is past it's done with
+        return (self.status in TrainingBooking.CLOSED_STATUSES or self.status == "Late Check-in") and self.__session.date < cutoff
+    
+    def set_status(self, status):
+        # every status change goes through here so the session's seat counts never need a recount
+        previous = self.status
+        super().set_status(status)
+        self.__session.booking_moved(previous, status)
+
     def set_training_log(self, text):
         self.__training_log = text
     
@@ -218,15 +353,54 @@ class TrainingBooking(Booking):
         text = f"session id: {self.__session.session_id} Citizen id: {self.__member.citizen_id} Class date: {self.__session.date} Status: {status_text}"
         return text
 
+class Waitlist:
+    # FIFO of waiting TrainingBookings, removal only drops the index entry and the stale booking is skipped once it reaches the front
+    def __init__(self):
+        self.__queue = deque()
+        self.__index = {}
+
+    def __len__(self):
+        return len(self.__index)
+
+    def has_member(self, member):
+        return member.member_id in self.__index
+
+    def add(self, booking):
+        member_id = booking.member.member_id
+        if member_id in self.__index:
+            raise Exception("Member is already on the waitlist for this session")
+        self.__queue.append(booking)
+        self.__index[member_id] = booking
+
+    def remove(self, booking):
+        member_id = booking.member.member_id
+        if self.__index.get(member_id) is booking:
+            del self.__index[member_id]
+        if len(self.__queue) > 2 * len(self.__index) + 32:
+            self.__queue = deque(b for b in self.__queue if self.__index.get(b.member.member_id) is b)
+
+    def pop_next(self):
+        while self.__queue:
+            booking = self.__queue.popleft()
+            member_id = booking.member.member_id
+            if self.__index.get(member_id) is booking:
+                del self.__index[member_id]
+                return booking
+        return None
+
 class Session:
+    HELD_SEAT_STATUSES = ("Pending", "Confirmed", "Check-in", "Late Check-in")
 
-    def __init__(self, start, end, date, max_participants, room, trainer, gym_class = None):
-        if gym_class:
+    def __init__(self, start, end, date, max_participants, room, trainer, gym_class = None, session_id = None, series = None):
+        if session_id:
+            self.__session_id = session_id
+        elif gym_class:
             session_len = len(gym_class.session_list)
             self.__session_id = f"{gym_class.class_id}-{session_len+1:03d}"
         else:
             session_len = len(trainer.session_list)
             self.__session_id = f"{trainer.staff_id}-{session_len+1:03d}"
+        self.__series = series
         self.__start = start
         self.__end = end
         self.__date = date
@@ -238,8 +412,17 @@ class Session:
         self.__training_plan = ""
         self.__training_log = ""
         self.__training_booking_list = []
+        # booking status -> how many of this session's bookings are in it, kept up to date by booking_moved
+        self.__status_counts = Counter()
+        self.__waitlist = Waitlist()
         self.__notification = ""
 
+    def __setstate__(self, state):
+        state.setdefault("_Session__series", None)
+        # older snapshots count their bookings on first use, they may not be loaded yet at this point
+        state.setdefault("_Session__status_counts", None)
+        self.__dict__.update(state)
+
     @property
     def start(self):
         return datetime.combine(self.__date, self.__start)
@@ -268,6 +451,14 @@ class Session:
     def trainer(self):
         return self.__trainer
     
+    @property
+    def gym_class(self):
+        return self.__gym_class
+
+    @property
+    def series(self):
+        return self.__series
+    
     @property
     def status(self):
         return self.__status
@@ -276,9 +467,16 @@ class Session:
     def training_booking_list(self):
         return tuple(self.__training_booking_list)
     
+    @property
+    def waitlist(self):
+        return self.__waitlist
+    
     @property
     def notification(self):
         return self.__notification
+
+    def materialize(self):
+        return self
     
     @property
     def info(self):
@@ -294,25 +492,69 @@ class Session:
     def set_training_plan(self, text):
         self.__training_plan = text
 
+    def __counts(self):
+        if self.__status_counts is None:
+            self.__status_counts = Counter(training_booking.status for training_booking in self.__training_booking_list)
+        return self.__status_counts
+
+    def booking_moved(self, previous, status):
+        counts = self.__counts()
+        counts[previous] -= 1
+        counts[status] += 1
+
     def get_enrolled_num(self):
-        participants = 0
+        return self.__counts()["Confirmed"]
+    
+    def get_held_num(self):
+        counts = self.__counts()
+        return sum(counts[status] for status in Session.HELD_SEAT_STATUSES)
+
+    def has_free_seat(self):
+        return self.get_held_num() < self.__max_participants
+
+    def drop_archived(self, cutoff):
+        keep = []
+        counts = self.__counts()
         for training_booking in self.__training_booking_list:
-            if training_booking.status == "Confirmed":
-                participants += 1
-        return participants
+            if training_booking.is_archivable(cutoff):
+                counts[training_booking.status] -= 1
+            else:
+                keep.append(training_booking)
+        self.__training_booking_list = keep
     
     def get_session_type(self):
         return "Class" if self.__gym_class else "Private"
 
+    def cancel(self):
+        self.__status = "Cancelled"
+        # frees the trainer and the room for that time
+        self.__trainer.release_session(self)
+        self.__room.release_session(self)
+
     def enroll_member(self, member):
-        participants = self.get_enrolled_num()
-        if participants >= self.__max_participants:
-            raise Exception("Session is full. Please wait until someone cancels.")
-        
-        booking = TrainingBooking(member, self)
-        self.__training_booking_list.append(booking)
-        member.add_booking(booking)
-        return booking
+        return self.enroll_members([member])[0]
+
+    def enroll_members(self, members):
+        if self.__status == "Cancelled":
+            raise Exception("Session has been cancelled")
+        for member in members:
+            member.check_can_enroll(self)
+        # seats are counted once for the whole group, whoever doesn't fit goes on the waitlist in order
+        free_seats = self.__max_participants - self.get_held_num()
+        bookings = []
+        for member in members:
+            if free_seats > 0:
+                booking = TrainingBooking(member, self)
+                free_seats -= 1
+            else:
+                # session is full, so the member waits in line until someone cancels
+                booking = TrainingBooking(member, self, "Waitlist")
+                self.__waitlist.add(booking)
+            self.__training_booking_list.append(booking)
+            self.__counts()[booking.status] += 1
+            member.add_booking(booking)
+            bookings.append(booking)
+        return bookings
     
     def is_available(self, new_start, new_end, new_date):
         if self.__date != new_date:
@@ -329,6 +571,222 @@ class Session:
         text += f"Enrolled: {self.get_enrolled_num()} Max: {self.__max_participants}"
         return text
 
+class SessionSeries:
+    # a repeating session kept as a rule: every days_interval days from start_date, count times and/or up to until,
+    # minus exception dates. occurrences are worked out on the fly, a real Session is only made for one once
+    # something has to hang off it (a booking, a training plan, a cancel)
+    def __init__(self, owner, series_id, start, end, start_date, days_interval, max_participants, room, trainer, gym_class = None, count = None, until = None):
+        if count is None and until is None:
+            raise Exception("A repeating session needs times or an until date")
+        if days_interval < 1:
+            raise Exception("days_interval must be at least 1")
+        self.__owner = owner
+        self.__series_id = series_id
+        self.__start = start
+        self.__end = end
+        self.__start_date = start_date
+        self.__days_interval = days_interval
+        self.__count = count
+        self.__until = until
+        self.__max_participants = max_participants
+        self.__room = room
+        self.__trainer = trainer
+        self.__gym_class = gym_class
+        self.__exceptions = set()
+        self.__sessions = {}
+
+    @property
+    def series_id(self):
+        return self.__series_id
+
+    @property
+    def start(self):
+        return self.__start
+
+    @property
+    def end(self):
+        return self.__end
+
+    @property
+    def start_date(self):
+        return self.__start_date
+
+    @property
+    def days_interval(self):
+        return self.__days_interval
+
+    @property
+    def max_participants(self):
+        return self.__max_participants
+
+    @property
+    def room(self):
+        return self.__room
+
+    @property
+    def trainer(self):
+        return self.__trainer
+
+    @property
+    def gym_class(self):
+        return self.__gym_class
+
+    @property
+    def last_index(self):
+        last = None if self.__count is None else self.__count - 1
+        if self.__until is not None:
+            until_index = (self.__until - self.__start_date).days // self.__days_interval
+            last = until_index if last is None else min(last, until_index)
+        return last
+
+    @property
+    def info(self):
+        return {
+            "series id": self.__series_id,
+            "time": f"Start: {self.__start} End: {self.__end}",
+            "first date": self.__start_date,
+            "every days": self.__days_interval,
+            "times": self.__count,
+            "until": self.__until,
+            "exceptions": sorted(self.__exceptions),
+            "materialized": len(self.__sessions)
+        }
+
+    def date_of(self, index):
+        return self.__start_date + timedelta(days=self.__days_interval * index)
+
+    def index_of(self, occurrence_date):
+        days = (occurrence_date - self.__start_date).days
+        if days < 0 or days % self.__days_interval:
+            return None
+        index = days // self.__days_interval
+        if index > self.last_index or occurrence_date in self.__exceptions:
+            return None
+        return index
+
+    def session_id_of(self, index):
+        return f"{self.__series_id}-{index + 1:03d}"
+
+    def occurrences(self, since = None, until = None):
+        # jumps straight to since, yields the real Session where there is one and a SessionOccurrence otherwise
+        first = 0
+        if since and since > self.__start_date:
+            first = -(-(since - self.__start_date).days // self.__days_interval)
+        last = self.last_index
+        if until:
+            last = min(last, (until - self.__start_date).days // self.__days_interval)
+        for index in range(first, last + 1):
+            occurrence_date = self.date_of(index)
+            if occurrence_date in self.__exceptions:
+                continue
+            yield self.__sessions.get(index) or SessionOccurrence(self, index)
+
+    def get_session(self, index):
+        return self.__sessions.get(index)
+
+    def materialize(self, index):
+        if index in self.__sessions:
+            return self.__sessions[index]
+        session = Session(self.__start, self.__end, self.date_of(index), self.__max_participants, self.__room, self.__trainer, self.__gym_class, session_id=self.session_id_of(index), series=self)
+        self.__sessions[index] = session
+        self.__owner.add_session(session)
+        return session
+
+    def get_session_by_id(self, session_id):
+        prefix = f"{self.__series_id}-"
+        if not session_id.startswith(prefix) or not session_id[len(prefix):].isdigit():
+            return None
+        index = int(session_id[len(prefix):]) - 1
+        if index < 0 or index > self.last_index or self.date_of(index) in self.__exceptions:
+            return None
+        # a lookup doesn't make a Session, the paths that change one (enroll, plan, cancel) materialize it
+        return self.__sessions.get(index) or SessionOccurrence(self, index)
+
+    def add_exception(self, occurrence_date):
+        index = self.index_of(occurrence_date)
+        if index is None:
+            raise Exception(f"Series {self.__series_id} has no session on {occurrence_date}")
+        if index in self.__sessions:
+            raise Exception(f"Session {self.session_id_of(index)} is already in use, cancel it instead")
+        self.__exceptions.add(occurrence_date)
+
+class SessionOccurrence:
+    # read only stand in for an occurrence of a series nobody touched yet: nothing enrolled, no plan, no log
+    def __init__(self, series, index):
+        self.__series = series
+        self.__index = index
+
+    @property
+    def session_id(self):
+        return self.__series.session_id_of(self.__index)
+
+    @property
+    def date(self):
+        return self.__series.date_of(self.__index)
+
+    @property
+    def start(self):
+        return datetime.combine(self.date, self.__series.start)
+
+    @property
+    def end(self):
+        return datetime.combine(self.date, self.__series.end)
+
+    @property
+    def max_participants(self):
+        return self.__series.max_participants
+
+    @property
+    def room(self):
+        return self.__series.room
+
+    @property
+    def trainer(self):
+        return self.__series.trainer
+
+    @property
+    def gym_class(self):
+        return self.__series.gym_class
+
+    @property
+    def series(self):
+        return self.__series
+
+    @property
+    def status(self):
+        return "Normal"
+
+    @property
+    def training_booking_list(self):
+        return ()
+
+    @property
+    def notification(self):
+        return ""
+
+    @property
+    def info(self):
+        return {
+            "session id": self.session_id,
+            "datetime": f"Start: {self.__series.start} End: {self.__series.end} Date: {self.date}",
+            "room" : f"[{self.room.room_id}] {self.room.name}",
+            "training_plan" : "",
+            "enrolled": 0,
+            "max participants": self.max_participants
+        }
+
+    def get_enrolled_num(self):
+        return 0
+
+    def get_held_num(self):
+        return 0
+
+    def has_free_seat(self):
+        return self.max_participants > 0
+
+    def materialize(self):
+        return self.__series.materialize(self.__index)
+
 class GymClass:
     __next_id = 1
 
@@ -338,6 +796,11 @@ class GymClass:
         self.__name = name
         self.__detail = detail
         self.__session_list = []
+        self.__series_list = []
+
+    def __setstate__(self, state):
+        state.setdefault("_GymClass__series_list", [])
+        self.__dict__.update(state)
 
     @property
     def class_id(self):
@@ -350,7 +813,7 @@ class GymClass:
     @property
     def info(self):
         sessions = []
-        for session in self.session_list:
+        for session in self.get_sessions(since=date.today()):
             # if isinstance(session, Session): pass
             participants = session.get_enrolled_num()
             now = datetime.now(session.start.tzinfo)
@@ -368,6 +831,18 @@ class GymClass:
     @property
     def session_list(self):
         return self.__session_list
+
+    @property
+    def series_list(self):
+        return self.__series_list
+
+    def get_sessions(self, since = None, until = None):
+        # every session in the window by start time, series occurrences nobody touched come as SessionOccurrence
+        sessions = [session for session in self.__session_list if session.series is None and (since is None or session.date >= since) and (until is None or session.date <= until)]
+        for series in self.__series_list:
+            sessions.extend(series.occurrences(since, until))
+        sessions.sort(key=lambda session: session.start)
+        return sessions
     
     # all session related functions are the exact same as trainer's, but got separated since can't "inherit" the same parent since it "is not a ..." for both of them
     def create_session(self, start, end, date, max_participants, room, trainer = None):
@@ -378,31 +853,51 @@ class GymClass:
         if not trainer: trainer = self
         if max_participants > room.max_people:
             raise Exception(f"Room can only accommodate {room.max_people} people")
+        if not isinstance(trainer, Trainer):
+            raise Exception("Staff is not a trainer")
+        conflict = trainer.get_conflict(start, end, date)
+        if conflict:
+            raise Exception(f"Trainer {trainer.staff_id} is already teaching session {conflict.session_id} at that time")
         if isinstance(self, GymClass):
             gym_class = self
         else:
             gym_class = None
         session = Session(start, end, date, max_participants, room, trainer, gym_class)
-        self.__session_list.append(session)
+        self.add_session(session)
         return session
     
-    def create_repeating_session(self, start, end, start_date, days_interval, times, max_participants, room, trainer = None):
+    def create_repeating_session(self, start, end, start_date, days_interval, times, max_participants, room, trainer = None, until = None):
         if not trainer and not isinstance(self, Trainer):
             raise Exception("Trainer not provided")
         if not trainer: trainer = self
         if max_participants > room.max_people:
             raise Exception(f"Room can only accommodate {room.max_people} people")
-        for time in range(times):
-            date = start_date + timedelta(days=days_interval*time)
-            if not room.is_available(start, end, date):
+        if not isinstance(trainer, Trainer):
+            raise Exception("Staff is not a trainer")
+        if isinstance(self, GymClass):
+            gym_class = self
+            series_id = f"{self.class_id}-S{len(self.__series_list)+1}"
+        else:
+            gym_class = None
+            series_id = f"{self.staff_id}-S{len(self.__series_list)+1}"
+        series = SessionSeries(self, series_id, start, end, start_date, days_interval, max_participants, room, trainer, gym_class, count=times, until=until)
+        for occurrence in series.occurrences():
+            if not room.is_available(start, end, occurrence.date):
                 raise Exception("Session is overlapping another previous session")
-            
-            if isinstance(self, GymClass):
-                gym_class = self
-            else:
-                gym_class = None
-            session = Session(start, end, date, max_participants, room, trainer, gym_class)
-            self.__session_list.append(session)
+            conflict = trainer.get_conflict(start, end, occurrence.date)
+            if conflict:
+                raise Exception(f"Trainer {trainer.staff_id} is already teaching session {conflict.session_id} on {occurrence.date}")
+        self.__series_list.append(series)
+        trainer.assign_series(series)
+        room.assign_series(series)
+        return series
+
+    def add_session(self, session):
+        self.__session_list.append(session)
+        if session.series is None:
+            # occurrences of a series are already on the timelines through the series
+            session.trainer.assign_session(session)
+            session.room.assign_session(session)
 
     def view_session(self):
         pass
@@ -411,6 +906,10 @@ class GymClass:
         for session in self.__session_list:
             if session.session_id == session_id:
                 return session
+        for series in self.__series_list:
+            session = series.get_session_by_id(session_id)
+            if session:
+                return session
         return False
     
     def __str__(self):
@@ -435,6 +934,9 @@ class LockerBooking(Booking):
     def member(self):
         return self.__member
 
+    def set_member(self, member):
+        self.__member = member
+
     @property
     def locker(self):
         return self.__locker
@@ -476,6 +978,7 @@ class LockerBooking(Booking):
             "Status": status_text
         }
     
+    @instrument("LockerBooking.calculate_price")
     def calculate_price(self, user = None):
         membership_type = self.__member.current_membership
         membership_enum = MembershipPlan[membership_type.upper()]
@@ -489,6 +992,20 @@ class LockerBooking(Booking):
         discount_price = round(total_price * (1 - discount), 2)
         return discount_price
 
+    @property
+    def archive_record(self):
+        return {
+            "booking_id": self.booking_id,
+            "locker_id": self.__locker.locker_id,
+            "date": self.__start.date().isoformat(),
+            "status": self.status,
+            "price_paid": self.price_paid,
+            "info": self.info
+        }
+
+    def is_archivable(self, cutoff):
+        return self.status in ("Confirmed", "Cancelled") and self.__end.date() < cutoff
+
     def is_time_conflict(self, start, end): # 7-10 9-12 > 7<12 true, 9<10 true
         return self.__start < end and start < self.__end
     
@@ -530,9 +1047,19 @@ class Locker:
         
         # check time conflict
         for locker_booking in self.__locker_booking_list:
+            if locker_booking.status == "Cancelled":
+                continue
             if locker_booking.is_time_conflict(start, end):
                 return False
         return True
+
+    def drop_archived(self, cutoff):
+        self.__locker_booking_list = [locker_booking for locker_booking in self.__locker_booking_list if not locker_booking.is_archivable(cutoff)]
+
+    def release(self, locker_booking):
+        locker_booking.cancel()
+        if locker_booking in self.__locker_booking_list:
+            self.__locker_booking_list.remove(locker_booking)
         
     def reserve_locker(self, member, start, end, status):
         if not self.is_available(start, end):
@@ -556,9 +1083,18 @@ class Room:
         self.__status = "Operating"
         self.__max_people = max_people
         self.__equipment_list = []
-        self.__session_list = []
+        self.__timeline = Timeline()
         self.__locker_list = []
 
+    def __setstate__(self, state):
+        # the room's sessions used to be a plain list, the gym rebuilds the timeline from the owners
+        state.pop("_Room__session_list", None)
+        state.setdefault("_Room__timeline", Timeline())
+        self.__dict__.update(state)
+
+    def reset_timeline(self):
+        self.__timeline = Timeline()
+
     @property
     def locker_list(self):
         return tuple(self.__locker_list)
@@ -594,11 +1130,21 @@ class Room:
         for i in range(amount_vip):
             self.__locker_list.append(Locker(self, "VIP"))
 
+    @property
+    def timeline(self):
+        return self.__timeline
+
     def is_available(self, start, end, date):
-        for session in self.__session_list:
-            if not session.is_available(start, end, date):
-                return False
-        return True
+        return self.__timeline.conflict(datetime.combine(date, start), datetime.combine(date, end)) is None
+
+    def assign_session(self, session):
+        self.__timeline.add(session)
+
+    def assign_series(self, series):
+        self.__timeline.add_series(series)
+
+    def release_session(self, session):
+        self.__timeline.remove(session)
     
     def reserve_locker(self, type, member, start, end, status):
         for locker in self.__locker_list:
@@ -621,6 +1167,14 @@ class Product:
         self.__name = name
         self.__amount = amount
         self.__price = price
+        # held by unpaid orders, still on the shelf but not for sale anymore
+        self.__reserved = 0
+        self.__ledger = None
+
+    def __setstate__(self, state):
+        state.setdefault("_Product__reserved", 0)
+        state.setdefault("_Product__ledger", None)
+        self.__dict__.update(state)
 
     @property
     def product_id(self):
@@ -638,19 +1192,81 @@ class Product:
     def amount(self):
         return self.__amount
 
+    @property
+    def reserved(self):
+        return self.__reserved
+
+    @property
+    def available(self):
+        return self.__amount - self.__reserved
+
+    def set_ledger(self, ledger):
+        # every change to the amount or the reservations goes through the gym's stock ledger from here on
+        self.__ledger = ledger
+        ledger.register(self.__product_id, self.__amount)
+        if self.__reserved:
+            ledger.hold(self.__product_id, self.__reserved)
+
+    def __record(self, kind, delta):
+        if self.__ledger:
+            self.__ledger.record(self.__product_id, kind, delta)
+
+    def __hold(self, delta):
+        if self.__ledger:
+            self.__ledger.hold(self.__product_id, delta)
+
     def add_stock(self, amount):
         self.__amount += amount
+        self.__record("Restock", amount)
 
     def sell_stock(self, amount):
-        if self.__amount < amount:
+        if self.available < amount:
             raise Exception("Not enough stock available")
         self.__amount -= amount
+        self.__record("Removal", -amount)
+
+    def reserve(self, amount):
+        if self.available < amount:
+            raise Exception(f"Not enough stock available for {self.__product_id}, {self.available} left")
+        self.__reserved += amount
+        self.__hold(amount)
+
+    def release(self, amount):
+        self.__reserved -= amount
+        self.__hold(-amount)
+
+    def commit_reserved(self, amount):
+        # the reserved units leave the shelf, they were counted out of available already so this can't fail
+        self.__reserved -= amount
+        self.__amount -= amount
+        self.__hold(-amount)
+        self.__record("Sale", -amount)
 
 class ProductAmount(OrderItem):
     def __init__(self, product, amount):
         super().__init__()
+        if amount <= 0:
+            raise Exception("Amount must be positive")
+        # the stock is held from the moment it's put on an order until it is paid for or released
+        product.reserve(amount)
         self.__product = product
         self.__amount = amount
+        self.__reserved = True
+
+    def __setstate__(self, state):
+        # None: from before stock was reserved, the gym sorts it out with restore_reservations once it's loaded
+        state.setdefault("_ProductAmount__reserved", None)
+        self.__dict__.update(state)
+
+    def restore_reservation(self, pending):
+        # an item on a pending order is held now, as long as the stock is still there (otherwise paying for it
+        # says so). paid or released items have nothing to hold
+        if self.__reserved is not None:
+            return
+        self.__reserved = False
+        if pending and self.__product.available >= self.__amount:
+            self.__product.reserve(self.__amount)
+            self.__reserved = True
     
     @property
     def product(self):
@@ -659,7 +1275,17 @@ class ProductAmount(OrderItem):
     @property
     def amount(self):
         return self.__amount
+
+    @property
+    def is_reserved(self):
+        return self.__reserved
+
+    def release(self):
+        if self.__reserved:
+            self.__product.release(self.__amount)
+            self.__reserved = False
     
+    @instrument("ProductAmount.calculate_price")
     def calculate_price(self, user = None):
         price = self.__product.price * self.__amount
         if isinstance(user, Member):
@@ -670,7 +1296,8 @@ class ProductAmount(OrderItem):
             return price
         
     def set_paid(self, amount):
-        self.__product.sell_stock(self.__amount)
+        self.__product.commit_reserved(self.__amount)
+        self.__reserved = False
         self.set_price_paid(amount)
         self.set_payment_status("Paid")
 
@@ -681,20 +1308,358 @@ class ProductAmount(OrderItem):
         return f"[product_id : {self.product.product_id}] Product: {self.__product.name} Amount: {self.__amount}"
     
 class Gym:
-    def __init__(self, name, location):
+    # view -> (builder, catalog collections it reads)
+    # renewal orders a lapsed member gets in a row before the sweeper stops issuing them
+    RENEWAL_ATTEMPTS = 2
+
+    CATALOG_VIEWS = {
+        "classes": (lambda gym: gym.get_available_classes(), ("classes", "sessions")),
+        "private_sessions": (lambda gym: gym.get_available_private_sessions(), ("staff", "sessions")),
+        "rooms": (lambda gym: gym.get_room_info(), ("rooms",)),
+        "stock": (lambda gym: gym.get_stock_info(), ("products",)),
+        "staff": (lambda gym: gym.get_staff_info(), ("staff",))
+    }
+
+    def __init__(self, name, location, pending_ttl = timedelta(minutes=30), archive_dir = "archive", archive_age = timedelta(days=90), payment_window = timedelta(minutes=15)):
         self.__name = name
         self.__location = location
         self.__user_list = []
+        # citizen_id -> user, one user per person (see __add_user), and member_id -> member
+        # (ids of members folded into another one by merge_duplicate_users point at that one)
+        self.__citizen_index = {}
+        self.__member_index = {}
         self.__room_list = []
         self.__product_list = []
+        self.__product_index = {}
+        self.__stock_ledger = StockLedger()
+        self.__daypass_ledger = DaypassLedger()
         self.__gym_class_list = []
+        # orders that aren't archived yet, and the same by order_id
         self.__order_list = []
+        self.__order_index = {}
+        # (year, month) -> report totals of the archived orders paid in that month, see gather_report
+        self.__archived_reports = {}
+        # booking_id -> booking of this branch's members, filled by the members themselves (see Member.add_booking).
+        # the registry's, shared by every branch, once the gym is in one
+        self.__booking_index = {}
         self.__payment_list = []
+        self.__occupancy = OccupancyTracker()
+        self.__pending_ttl = pending_ttl
+        # how long a started payment (an unvalidated QR, a card attempt that failed) holds a pending order
+        self.__payment_window = payment_window
+        self.__expiry_index = ExpiryIndex()
+        # members by the next moment their membership status can change, see Member.settle_terms
+        self.__membership_index = ExpiryIndex()
+        self.__lock = threading.RLock()
+        self.__archive = ArchiveStore(archive_dir)
+        self.__archive_age = archive_age
+        self.__registry = None
+        self.__branch_id = None
+        self.__version = 0
+        self.__versions = dict.fromkeys(CATALOG_COLLECTIONS, 0)
+        self.__replica = ReadReplica()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_Gym__lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.RLock()
+        # a snapshot from before some of the fields below existed gets them here, indexes are rebuilt from
+        # the lists they cover. everything the gym holds is loaded by the time this runs
+        if "_Gym__payment_window" not in state:
+            self.__payment_window = timedelta(minutes=15)
+        if "_Gym__registry" not in state:
+            self.__registry = None
+            self.__branch_id = None
+        if "_Gym__versions" not in state:
+            self.__version = 0
+            self.__versions = dict.fromkeys(CATALOG_COLLECTIONS, 0)
+        if "_Gym__replica" not in state:
+            self.__replica = ReadReplica()
+        if "_Gym__product_index" not in state:
+            self.__product_index = {product.product_id: product for product in self.__product_list}
+        if "_Gym__order_index" not in state:
+            self.__order_index = {order.order_id: order for order in self.__order_list}
+            self.__archived_reports = {}
+        if "_Gym__stock_ledger" not in state:
+            self.__stock_ledger = StockLedger()
+            for product in self.__product_list:
+                product.set_ledger(self.__stock_ledger)
+        if "_Gym__daypass_ledger" not in state:
+            self.__daypass_ledger = DaypassLedger()
+            self.__index_daypasses()
+        if "_Gym__membership_index" not in state:
+            self.__membership_index = ExpiryIndex()
+            for user in self.__user_list:
+                if isinstance(user, Member):
+                    user.set_term_index(self.__membership_index)
+        if "_Gym__member_index" not in state:
+            self.__index_users()
+            # old enough to predate the timelines too, they're rebuilt from scratch either way
+            self.__index_timelines()
+        if "_Gym__booking_index" not in state:
+            self.__booking_index = {}
+            self.__index_bookings()
+
+    def restore_reservations(self):
+        # runs once the whole snapshot is loaded: orders can still be half built while __setstate__ runs when
+        # the gym hangs off a registry
+        for order in self.__order_list:
+            for item in order.order_item_list:
+                if isinstance(item, ProductAmount):
+                    item.restore_reservation(order.status == "Pending")
+
+    def __index_bookings(self):
+        for user in self.__user_list:
+            if isinstance(user, Member):
+                user.set_booking_index(self.__booking_index)
+
+    def __index_users(self):
+        self.__citizen_index = {}
+        self.__member_index = {}
+        for user in self.__user_list:
+            # duplicates from before citizen ids were unique: the first member / staff record wins over
+            # guests, merge_duplicate_users folds the rest
+            existing = self.__citizen_index.get(user.citizen_id)
+            if existing is None or (isinstance(existing, Guest) and not isinstance(user, Guest)):
+                self.__citizen_index[user.citizen_id] = user
+            if isinstance(user, Member):
+                self.__member_index[user.member_id] = user
+
+    def __index_timelines(self):
+        trainers = [user for user in self.__user_list if isinstance(user, Trainer)]
+        for holder in trainers + self.__room_list:
+            holder.reset_timeline()
+        for owner in self.__gym_class_list + trainers:
+            for session in owner.session_list:
+                if session.series is None and session.status != "Cancelled":
+                    session.trainer.assign_session(session)
+                    session.room.assign_session(session)
+            for series in owner.series_list:
+                series.trainer.assign_series(series)
+                series.room.assign_series(series)
+        for user in self.__user_list:
+            if isinstance(user, Member):
+                user.index_bookings()
+
+    def __index_daypasses(self):
+        for order in self.__order_list:
+            if order.status not in ("Pending", "Paid"):
+                continue
+            for item in order.order_item_list:
+                if not isinstance(item, DayPass):
+                    continue
+                if item.user is None:
+                    item.set_holder(order.user, order.updated_at.date())
+                if not self.__daypass_ledger.has(item.date, item.user.citizen_id):
+                    self.__daypass_ledger.add(item.date, item.user.citizen_id, item)
 
     @property
     def gym_class_list(self):
         return self.__gym_class_list
 
+    @property
+    def lock(self):
+        return self.__lock
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def location(self):
+        return self.__location
+
+    @property
+    def branch_id(self):
+        return self.__branch_id
+
+    @property
+    def version(self):
+        return self.__version
+
+    @property
+    def versions(self):
+        return dict(self.__versions)
+
+    def touch(self, *collections):
+        # bumped after locked writes so catalog views know to rebuild, no collections means all of them
+        self.__version += 1
+        for collection in collections or CATALOG_COLLECTIONS:
+            self.__versions[collection] += 1
+        if self.__registry:
+            self.__registry.touched(self.__branch_id)
+
+    def get_catalog(self, view):
+        return self.get_catalog_entry(view).data
+
+    def __catalog_version(self, view):
+        if view not in Gym.CATALOG_VIEWS:
+            raise Exception(f"Invalid catalog view: {view}. Valid: {', '.join(Gym.CATALOG_VIEWS)}")
+        builder, collections = Gym.CATALOG_VIEWS[view]
+        # the views only list sessions from today on, so a new day is a new version too
+        return builder, tuple(self.__versions[collection] for collection in collections) + (date.today().toordinal(),)
+
+    def get_catalog_entry(self, view):
+        # lock free, at most a few seconds stale, see ReadReplica
+        builder, version = self.__catalog_version(view)
+        return self.__replica.entry(view, version, lambda: self.__build_catalog(builder))
+
+    def get_catalog_validators(self, view):
+        # etag / last-modified of the view as it stands, without building it
+        _, version = self.__catalog_version(view)
+        return self.__replica.validators(view, version)
+
+    def __build_catalog(self, builder):
+        # built under the lock so a view never shows half of a write
+        with self.__lock:
+            return builder(self)
+
+    def locked_with_members(self, member_ids):
+        # this branch's lock, plus the home branch lock of every member from another branch. the locks are
+        # taken in branch order, so two branches working on each other's members can't deadlock
+        gyms = {self.__branch_id: self}
+        if self.__registry:
+            for member_id in member_ids:
+                branch_id = self.__registry.home_branch(member_id)
+                if branch_id is not None and branch_id not in gyms:
+                    gyms[branch_id] = self.__registry.get_gym(branch_id)
+        stack = ExitStack()
+        for branch_id in sorted(gyms, key=str):
+            stack.enter_context(gyms[branch_id].lock)
+        return stack
+
+    def set_registry(self, registry, branch_id):
+        self.__registry = registry
+        self.__branch_id = branch_id
+        self.__booking_index = registry.booking_index
+        self.__index_bookings()
+        for user in self.__user_list:
+            if isinstance(user, Member):
+                registry.index_member(branch_id, user)
+            elif not isinstance(user, Guest):
+                registry.index_citizen_id(branch_id, user.citizen_id)
+        for order in self.__order_list:
+            order.set_branch_id(branch_id)
+            registry.index_order(branch_id, order)
+
+    def __add_user(self, user):
+        # check and insert in one go under the lock, so two requests for the same person can't both get in.
+        # the only user that can be replaced is a guest (a daypass visitor) who signs up or gets hired
+        with self.__lock:
+            citizen_id = user.citizen_id
+            existing = self.check_new_citizen_id(citizen_id, isinstance(user, Guest))
+            if self.__registry and not isinstance(user, Guest):
+                # other branches' members and staff count too
+                self.__registry.claim_citizen_id(self.__branch_id, citizen_id)
+            if existing is not None:
+                self.__user_list[self.__user_list.index(existing)] = user
+                for day in existing.guest_date_list:
+                    user.add_guest_date(day)
+            else:
+                self.__user_list.append(user)
+            self.__citizen_index[citizen_id] = user
+            if isinstance(user, Member):
+                self.__member_index[user.member_id] = user
+                user.set_term_index(self.__membership_index)
+                user.set_booking_index(self.__booking_index)
+                if self.__registry:
+                    self.__registry.index_member(self.__branch_id, user)
+        return user
+
+    def check_new_citizen_id(self, citizen_id, guest = False):
+        # returns the guest a new member / staff record would replace, if any
+        existing = self.__citizen_index.get(citizen_id)
+        if existing is not None and (guest or not isinstance(existing, Guest)):
+            raise Exception(f"citizen_id {citizen_id} is already registered ({self.__user_label(existing)})")
+        return existing
+
+    @staticmethod
+    def __user_label(user):
+        if isinstance(user, Member):
+            return user.member_id
+        if isinstance(user, Staff):
+            return user.staff_id
+        return user.guest_id
+
+    @property
+    def pending_ttl(self):
+        return self.__pending_ttl
+
+    def set_pending_ttl(self, pending_ttl):
+        self.__pending_ttl = pending_ttl
+
+    @property
+    def archive_age(self):
+        return self.__archive_age
+
+    @synchronized(touches=())
+    def archive_before(self, cutoff = None):
+        cutoff = cutoff or date.today() - self.__archive_age
+        archived = {"training_booking": 0, "locker_booking": 0, "order": 0}
+        for user in self.__user_list:
+            if not isinstance(user, Member):
+                continue
+            for kind, records in user.archive_before(cutoff).items():
+                archived[kind] += self.__archive.append(user.member_id, kind, records)
+        daypasses = self.__daypass_ledger.roll_off(cutoff, lambda day, citizen_id, daypass: {
+            "date": day.isoformat(),
+            "branch_id": self.__branch_id,
+            "citizen_id": citizen_id,
+            "payment_status": daypass.payment_status,
+            "price_paid": daypass.price_paid
+        })
+        archived["daypass"] = self.__archive.append("daypass", "daypass", daypasses)
+        archived["order"] += self.__archive.append("guest", "order", self.__drop_archived(cutoff))
+        return {
+            "cutoff": cutoff,
+            "archived": archived
+        }
+
+    def __drop_archived(self, cutoff):
+        # the gym's own lists let go of everything closed before cutoff as well, so nothing here grows with
+        # history. a member's records are written by the member's home branch (wherever they were booked or
+        # bought), orders without a member only live here and are handed back to be written as guest orders.
+        # what an order brought in stays in the report of its month
+        guest_orders = []
+        keep = []
+        for order in self.__order_list:
+            if not order.is_archivable(cutoff):
+                keep.append(order)
+                continue
+            key = self.__report_month(order)
+            if key:
+                self.__add_to_report(self.__archived_reports.setdefault(key, self.__new_report()), order)
+            del self.__order_index[order.order_id]
+            if self.__registry:
+                self.__registry.forget_order(order.order_id)
+            if not isinstance(order.user, Member):
+                guest_orders.append(order.archive_record)
+        self.__order_list = keep
+        trainers = [user for user in self.__user_list if isinstance(user, Trainer)]
+        for owner in self.__gym_class_list + trainers:
+            for session in owner.session_list:
+                if session.date < cutoff:
+                    session.drop_archived(cutoff)
+        for room in self.__room_list:
+            for locker in room.locker_list:
+                locker.drop_archived(cutoff)
+        return guest_orders
+
+    def get_archived_records(self, member_id, kind = None, since = None, until = None):
+        member = self.get_member_by_id(member_id)
+        return self.__archive.query(member.member_id, kind, since, until)
+
+    def track_pending(self, item, order):
+        self.__expiry_index.push(datetime.now() + self.__pending_ttl, item, order)
+
+    def track_payment(self, order):
+        # the order is looked at again when the payment's window runs out, not after another pending_ttl
+        self.__expiry_index.push(order.payment.created_at + self.__payment_window, order, order)
+
     def create_payment_list(self):
         self.__payment_list = []
 
@@ -702,86 +1667,152 @@ class Gym:
             if order.payment:
                 self.__payment_list.append(order.payment)
 
+    @synchronized(touches=("rooms",))
     def create_room(self, name, max_people):
         room = Room(self, name, max_people)
         self.__room_list.append(room)
         return room
 
+    @synchronized(touches=("classes",))
     def create_class(self, name, detail):
         gym_class = GymClass(name, detail)
         self.__gym_class_list.append(gym_class)
         return gym_class
 
+    @synchronized(touches=())
     def create_member(self, citizen_id, name, birth_date, membership="Monthly", status="Pending"):
+        self.check_new_citizen_id(citizen_id)
         member = Member(citizen_id, name, birth_date, membership, status=status)
-        self.__user_list.append(member)
+        self.__add_user(member)
+        if status == "Active":
+            member.start_term(membership)
         return member
     
+    @synchronized(touches=("staff",))
     def create_trainer(self, citizen_id, name, birth_date, tier, specialization):
+        self.check_new_citizen_id(citizen_id)
         trainer = Trainer(citizen_id, name, birth_date, tier, specialization)
-        self.__user_list.append(trainer)
+        self.__add_user(trainer)
         return trainer
     
+    @synchronized(touches=())
     def apply_new_member(self, name, citizen_id, birth_date, membership_type):
+        self.check_new_citizen_id(citizen_id)
         member = Member(citizen_id, name, birth_date)
-        self.__user_list.append(member)
+        self.__add_user(member)
         order = self.create_order(member)
         order.add_order_item(NewMembership(membership_type, member=member))
         return member.member_id
 
+    @synchronized(touches=())
     def approve_daypass(self, citizen_id, name, birth_date):
+        target_date = date.today()
+        # one daypass per person per day, pending ones count until their order expires
+        self.__daypass_ledger.check(target_date, citizen_id)
+
         try:
             user = self.get_user_by_citizen_id(citizen_id)
         except Exception:
-            user = Guest(citizen_id, name, birth_date)
-            self.__user_list.append(user)
-
-        target_date = date.today()
-
-        if target_date in user.guest_date_list:
-            raise Exception(f"Daypass for {target_date} already purchased.")
+            user = self.__add_user(Guest(citizen_id, name, birth_date))
 
         order = self.create_order(user)
-        daypass = DayPass()          
+        daypass = DayPass(user=user, day=target_date)
         order.add_order_item(daypass)
+        self.__daypass_ledger.add(target_date, citizen_id, daypass)
         return order.order_id
 
+    def get_daypass_count(self, day = None):
+        day = day or date.today()
+        with self.__lock:
+            return {
+                "date": day,
+                "daypasses": self.__daypass_ledger.count(day),
+                "daily_limit": self.__daypass_ledger.daily_limit
+            }
+
+    @synchronized(touches=())
+    def set_daypass_limit(self, daily_limit):
+        self.__daypass_ledger.set_daily_limit(daily_limit)
+        return daily_limit
+
+    @synchronized(touches=("products",))
     def create_product(self, name, amount, price):
-        product = Product(name, amount, price)
+        return self.__add_product(Product(name, amount, price))
+
+    def __add_product(self, product):
         self.__product_list.append(product)
+        self.__product_index[product.product_id] = product
+        product.set_ledger(self.__stock_ledger)
+        return product
+
+    def get_product_by_id(self, product_id) -> Product:
+        product = self.__product_index.get(product_id)
+        if product is None:
+            raise Exception(f"Product '{product_id}' not found")
+        return product
 
     def sell_product(self, product_id, amount, member_id = None):
-        for product in self.__product_list:
-            if product.product_id == product_id:
-                # product.sell_stock(amount) NOT YET, WAIT PAYMENT
-                if member_id:
-                    order = self.get_order_by_member_id(member_id)
-                else:
-                    order = self.create_order()
-                order.add_order_item(ProductAmount(product, amount))
-                return order
-        raise Exception(f"Product '{product_id}' not found")
+        return self.sell_products([(product_id, amount)], member_id)
+
+    @synchronized(touches=("products",))
+    def sell_products(self, items, member_id = None):
+        # items: (product_id, amount) pairs. every item is reserved before anything goes on the order,
+        # so either the whole sale is held or nothing is. stock only leaves the shelf once paid
+        # the member and products are looked up before anything is reserved, an unknown id holds nothing
+        member = self.get_member_by_id(member_id) if member_id else None
+        products = [(self.get_product_by_id(product_id), amount) for product_id, amount in items]
+        product_amounts = []
+        try:
+            for product, amount in products:
+                product_amounts.append(ProductAmount(product, amount))
+            order = self.get_order_by_member(member) if member else self.create_order()
+        except Exception:
+            for product_amount in product_amounts:
+                product_amount.release()
+            raise
+        for product_amount in product_amounts:
+            order.add_order_item(product_amount)
+        return order
     
+    @synchronized(touches=("products",))
     def add_stock(self, product_id, amount):
-        for product in self.__product_list:
-            if product.product_id == product_id:
-                product.add_stock(amount)
-                return product.amount
-        raise Exception(f"Product '{product_id}' not found")
+        product = self.get_product_by_id(product_id)
+        product.add_stock(amount)
+        return product.amount
 
+    @synchronized(touches=("products",))
     def remove_stock(self, product_id, amount):
-        for product in self.__product_list:
-            if product.product_id == product_id:
-                product.sell_stock(amount)
-                return product.amount
-        raise Exception(f"Product '{product_id}' not found")
-
+        product = self.get_product_by_id(product_id)
+        product.sell_stock(amount)
+        return product.amount
+
+    @synchronized(touches=("products",))
+    def set_reorder_level(self, product_id, level):
+        product = self.get_product_by_id(product_id)
+        self.__stock_ledger.set_reorder_level(product.product_id, level)
+        return level
+
+    def get_stock_alerts(self):
+        with self.__lock:
+            alerts = self.__stock_ledger.alerts()
+        for alert in alerts:
+            alert["name"] = self.get_product_by_id(alert["product id"]).name
+        return alerts
+
+    def get_stock_movements(self, product_id = None, since = None, limit = 100):
+        if product_id:
+            self.get_product_by_id(product_id)
+        with self.__lock:
+            return self.__stock_ledger.movements(product_id, since, limit)
+
+    @instrument("Gym.get_manager_by_id")
     def get_manager_by_id(self, staff_id):
         for user in self.__user_list:
             if isinstance(user, Manager) and user.staff_id == staff_id:
                 return user
         raise Exception("manager not found")
 
+    @synchronized(touches=())
     def reserve_locker(self, member_id, is_vip, start, hours):
         member = self.get_member_by_id(member_id)
         locker_type = "VIP" if is_vip else "Normal"
@@ -791,6 +1822,7 @@ class Gym:
                 locker_booking = room.reserve_locker(locker_type, member, start, end, "Pending")
                 order = self.get_order_by_member_id(member_id)
                 order.add_order_item(locker_booking)
+                self.track_pending(locker_booking, order)
                 return locker_booking
             except:
                 continue
@@ -800,16 +1832,65 @@ class Gym:
     #     manager = Manager(citizen_id, name, birth_date, tier, specialization)
     #     self.__user_list.append(manager)
     #     return manager
+    @synchronized(touches=("staff",))
     def create_manager(self, citizen_id, name, birth_date):
+        self.check_new_citizen_id(citizen_id)
         manager = Manager(citizen_id, name, birth_date)
         manager.set_gym(self)
-        self.__user_list.append(manager)
+        self.__add_user(manager)
         return manager
     
+    @synchronized(touches=("staff",))
     def create_receptionist(self, citizen_id, name, birth_date):
+        self.check_new_citizen_id(citizen_id)
         receptionist = Receptionist(citizen_id, name, birth_date)
-        self.__user_list.append(receptionist)
+        self.__add_user(receptionist)
         return receptionist
+
+    def load_fixture(self, data):
+        # bulk path for trusted fixture files, skips the per object availability and capacity checks
+        rooms = {}
+        for row in data.get("rooms", []):
+            room = Room(self, row["name"], row["max_people"])
+            room.create_lockers(row.get("normal_lockers", 0), row.get("vip_lockers", 0))
+            self.__room_list.append(room)
+            rooms[row["name"]] = room
+        for row in data.get("products", []):
+            self.__add_product(Product(row["name"], row["amount"], row["price"]))
+
+        trainers = {}
+        for row in data.get("managers", []):
+            manager = Manager(row["citizen_id"], row["name"], date.fromisoformat(row["birth_date"]))
+            manager.set_gym(self)
+            self.__add_user(manager)
+        for row in data.get("receptionists", []):
+            self.__add_user(Receptionist(row["citizen_id"], row["name"], date.fromisoformat(row["birth_date"])))
+        for row in data.get("trainers", []):
+            trainer = Trainer(row["citizen_id"], row["name"], date.fromisoformat(row["birth_date"]), row["tier"], row["specialization"])
+            self.__add_user(trainer)
+            trainers[row["citizen_id"]] = trainer
+            self.__load_sessions(trainer, row.get("sessions", []), rooms, trainers)
+        for row in data.get("classes", []):
+            gym_class = GymClass(row["name"], row["detail"])
+            self.__gym_class_list.append(gym_class)
+            self.__load_sessions(gym_class, row.get("sessions", []), rooms, trainers)
+
+        for row in data.get("members", []):
+            member = Member(row["citizen_id"], row["name"], date.fromisoformat(row["birth_date"]), row.get("membership", "Monthly"), status=row.get("status", "Active"))
+            self.__add_user(member)
+            if member.member_status == "Active":
+                member.start_term(member.current_membership, datetime.fromisoformat(row["term_start"]) if row.get("term_start") else None)
+
+    def __load_sessions(self, owner, rows, rooms, trainers):
+        gym_class = owner if isinstance(owner, GymClass) else None
+        for row in rows:
+            start = time.fromisoformat(row["start"])
+            end = time.fromisoformat(row["end"])
+            first_date = date.fromisoformat(row["date"])
+            trainer = trainers[row["trainer"]] if gym_class else owner
+            for occurrence in range(row.get("times", 1)):
+                session_date = first_date + timedelta(days=row.get("days_interval", 0) * occurrence)
+                owner.add_session(Session(start, end, session_date, row["max_participants"], rooms[row["room"]], trainer, gym_class))
     
     def get_staff_info(self):
         staff_info = []
@@ -823,12 +1904,22 @@ class Gym:
         return staff_info
     
     def get_stock_info(self):
+        forecast = self.__stock_ledger.forecast()
         stock_info = {}
         for product in self.__product_list:
+            figures = forecast[product.product_id]
             stock_info[product.name] = {
                 "ID": product.product_id,
                 "amount": product.amount,
-                "price": product.price
+                "reserved": product.reserved,
+                "available": product.available,
+                "price": product.price,
+                "reorder level": figures["reorder level"],
+                "low stock": figures["low stock"],
+                f"out last {self.__stock_ledger.window_days} days": figures["out last window"],
+                "daily rate": figures["daily rate"],
+                "days until stockout": figures["days until stockout"],
+                "days until reorder": figures["days until reorder"]
             }
         return stock_info
     
@@ -848,12 +1939,14 @@ class Gym:
         for gym_class in self.__gym_class_list:
             print(gym_class)
 
+    @instrument("Gym.get_class_by_id")
     def get_class_by_id(self, class_id) -> GymClass:
         for gym_class in self.__gym_class_list:
             if gym_class.class_id == class_id:
                 return gym_class
         raise Exception("gym class not found")
     
+    @instrument("Gym.get_session_by_id")
     def get_session_by_id(self, session_id) -> Session:
         for gym_class in self.__gym_class_list:
             session = gym_class.get_session_by_id(session_id)
@@ -866,68 +1959,289 @@ class Gym:
                     return session
         raise Exception("session not found")
     
+    def get_series_by_id(self, series_id) -> SessionSeries:
+        owners = self.__gym_class_list + [user for user in self.__user_list if isinstance(user, Trainer)]
+        for owner in owners:
+            for series in owner.series_list:
+                if series.series_id == series_id:
+                    return series
+        raise Exception("session series not found")
+
+    @synchronized(touches=("sessions",))
+    def skip_series_date(self, series_id, skip_date):
+        series = self.get_series_by_id(series_id)
+        series.add_exception(skip_date)
+        return series
+
+    @synchronized(touches=("sessions",))
+    def create_session(self, room_id, staff_id, start, end, session_date, max_participants, class_id = None, days_interval = None, times = None, until = None):
+        # the room / trainer timeline checks and putting the new session on them happen under the one lock,
+        # otherwise two requests can both find the trainer free. a session of a class when class_id is given,
+        # else a private one of the trainer. days_interval makes it a repeating session
+        room = self.get_room_by_id(room_id)
+        staff = self.get_staff_by_id(staff_id)
+        host = self.get_class_by_id(class_id) if class_id else staff
+        trainer = staff if class_id else None
+        if days_interval is None:
+            return host.create_session(start, end, session_date, max_participants, room, trainer)
+        return host.create_repeating_session(start, end, session_date, days_interval, times, max_participants, room, trainer, until=until)
+
+    @instrument("Gym.get_room_by_id")
     def get_room_by_id(self, room_id) -> Room:
         for room in self.__room_list:
             if room.room_id == room_id:
                 return room
         raise Exception(f"Room '{room_id}' not found")
 
+    def find_free_slots(self, since, until, duration, capacity = 1, staff_id = None, room_id = None, opens = time(6, 0), closes = time(22, 0), limit = 50):
+        # earliest free windows first, across every room big enough (or just room_id). with a trainer
+        # the window also has to be free on their timeline. every room is swept once over the whole range
+        # and the rooms are merged lazily, so it stops as soon as limit windows are found
+        if until < since:
+            raise Exception("until can't be before since")
+        if (until - since).days > 366:
+            raise Exception("Search window can be at most a year")
+        if closes <= opens:
+            raise Exception("closes must be after opens")
+        duration = timedelta(minutes=duration)
+        if duration <= timedelta(0):
+            raise Exception("duration must be positive")
+        rooms = [self.get_room_by_id(room_id)] if room_id else self.__room_list
+        rooms = [room for room in rooms if room.max_people >= capacity]
+        trainer_busy = []
+        if staff_id:
+            trainer = self.get_staff_by_id(staff_id)
+            if not isinstance(trainer, Trainer):
+                raise Exception("Staff is not a trainer")
+            trainer_busy = [session for session in trainer.get_schedule(since, until) if session.status != "Cancelled"]
+
+        def room_windows(room):
+            room_busy = [session for session in room.timeline.window(since, until) if session.status != "Cancelled"]
+            busy = heapq.merge(room_busy, trainer_busy, key=lambda session: session.start)
+            for start, end in free_windows(busy, since, until, opens, closes, duration):
+                yield start, end, room
+
+        slots = []
+        for start, end, room in itertools.islice(heapq.merge(*[room_windows(room) for room in rooms], key=lambda slot: slot[0]), limit):
+            slots.append({
+                "room_id": room.room_id,
+                "room": room.name,
+                "max_people": room.max_people,
+                "date": start.date(),
+                "start": start.time(),
+                "end": end.time()
+            })
+        return slots
+
+    def get_weekly_demand(self, since, until = None):
+        # average bookings (waitlist included, cancelled not) per class session by (class_id, weekday, hour),
+        # with (class_id, None, None) per class and (None, weekday, hour) for the whole gym
+        until = until or date.today()
+        totals = {}
+        for gym_class in self.__gym_class_list:
+            for session in gym_class.get_sessions(since, until):
+                booked = sum(1 for booking in session.training_booking_list if booking.status != "Cancelled")
+                day = session.date.weekday()
+                hour = session.start.hour
+                for key in ((gym_class.class_id, day, hour), (gym_class.class_id, None, None), (None, day, hour)):
+                    total = totals.setdefault(key, [0, 0])
+                    total[0] += booked
+                    total[1] += 1
+        return {key: booked / sessions for key, (booked, sessions) in totals.items()}
+
+    def build_timetable_problem(self, classes, week_start, availability = None, max_sessions = None, opens = time(6, 0), closes = time(22, 0), step = 30, history_weeks = 12):
+        # the week from week_start as a TimetableProblem: every room and trainer, what they already
+        # have that week as busy, and the last history_weeks of bookings as demand
+        availability = availability or {}
+        max_sessions = max_sessions or {}
+        week_end = week_start + timedelta(days=6)
+
+        def minutes(moment):
+            return moment.hour * 60 + moment.minute
+
+        def busy(sessions):
+            return [(session.date.weekday(), minutes(session.start), minutes(session.end)) for session in sessions if session.status != "Cancelled"]
+
+        for gym_class in classes:
+            self.get_class_by_id(gym_class["class_id"])
+        rooms = [{
+            "room_id": room.room_id,
+            "max_people": room.max_people,
+            "busy": busy(room.timeline.window(week_start, week_end))
+        } for room in self.__room_list if room.max_people > 0]
+        trainers = []
+        for user in self.__user_list:
+            if isinstance(user, Trainer):
+                windows = availability.get(user.staff_id)
+                trainers.append({
+                    "staff_id": user.staff_id,
+                    "tier": user.tier,
+                    "available": None if windows is None else [(day, minutes(start), minutes(end)) for day, start, end in windows],
+                    "busy": busy(user.get_schedule(week_start, week_end)),
+                    "max_sessions": max_sessions.get(user.staff_id)
+                })
+        for staff_id in list(availability) + list(max_sessions):
+            if not isinstance(self.get_staff_by_id(staff_id), Trainer):
+                raise Exception(f"{staff_id} is not a trainer")
+        demand = self.get_weekly_demand(week_start - timedelta(weeks=history_weeks), week_start - timedelta(days=1))
+        return TimetableProblem(rooms, trainers, classes, demand, opens=minutes(opens), closes=minutes(closes), step=step)
+
+    def plan_timetable(self, classes, week_start, availability = None, max_sessions = None, opens = time(6, 0), closes = time(22, 0), step = 30, budget = 2.0, workers = 1):
+        with self.lock:
+            problem = self.build_timetable_problem(classes, week_start, availability, max_sessions, opens, closes, step)
+        # the search only works on the copied problem, the gym stays unlocked meanwhile
+        plan = solve(problem, budget, workers=workers)
+        plan["week_start"] = week_start
+        return plan
+
+    @synchronized(touches=("classes", "sessions"))
+    def commit_timetable(self, sessions, week_start, weeks = None, until = None):
+        # every session of the plan becomes a weekly series from week_start. everything is checked
+        # before anything is created, so a plan either goes in whole or not at all
+        if weeks is None and until is None:
+            raise Exception("Provide weeks and/or until")
+        planned = []
+        for session in sessions:
+            room = self.get_room_by_id(session["room_id"])
+            trainer = self.get_staff_by_id(session["staff_id"])
+            if not isinstance(trainer, Trainer):
+                raise Exception(f"{session['staff_id']} is not a trainer")
+            if session["end"] <= session["start"]:
+                raise Exception(f"Session of {session['class_id']} on day {session['day']} ends before it starts")
+            if session["max_participants"] > room.max_people:
+                raise Exception(f"Room {room.room_id} can only accommodate {room.max_people} people")
+            first_date = week_start + timedelta(days=(session["day"] - week_start.weekday()) % 7)
+            planned.append((self.get_class_by_id(session["class_id"]), room, trainer, first_date, session))
+        for key in ("room_id", "staff_id"):
+            latest = {}
+            for session in sorted(sessions, key=lambda session: (session["day"], session["start"])):
+                previous = latest.get(session[key])
+                if previous and previous["day"] == session["day"] and previous["end"] > session["start"]:
+                    raise Exception(f"Plan has {session[key]} twice on day {session['day']} at {session['start']}")
+                if not previous or previous["day"] != session["day"] or session["end"] > previous["end"]:
+                    latest[session[key]] = session
+        for gym_class, room, trainer, first_date, session in planned:
+            occurrence = 0
+            session_date = first_date
+            while (weeks is None or occurrence < weeks) and (until is None or session_date <= until):
+                if not room.is_available(session["start"], session["end"], session_date):
+                    raise Exception(f"Room {room.room_id} is taken on {session_date} at {session['start']}")
+                conflict = trainer.get_conflict(session["start"], session["end"], session_date)
+                if conflict:
+                    raise Exception(f"Trainer {trainer.staff_id} is already teaching session {conflict.session_id} on {session_date}")
+                occurrence += 1
+                session_date += timedelta(days=7)
+        series_list = []
+        for gym_class, room, trainer, first_date, session in planned:
+            series = gym_class.create_repeating_session(session["start"], session["end"], first_date, 7, weeks, session["max_participants"], room, trainer, until=until)
+            series_list.append(series.info)
+        return series_list
+
     def get_room_info(self):
             return [room.info for room in self.__room_list]
     
+    def find_local_member(self, member_id):
+        return self.__member_index.get(member_id)
+
+    @instrument("Gym.get_member_by_id")
     def get_member_by_id(self, member_id):
-        for user in self.__user_list:
-            if hasattr(user, "member_id") and user.member_id == member_id:
-                return user
+        member = self.find_local_member(member_id)
+        if member:
+            return member
+        if self.__registry:
+            # members training at a sister branch
+            return self.__registry.find_member(member_id)
         raise Exception("member not found")
     
+    def find_local_order(self, order_id):
+        return self.__order_index.get(order_id)
+
+    @instrument("Gym.get_order_by_id")
     def get_order_by_id(self, order_id):
-        for order in self.__order_list:
-            if order.order_id == order_id:
-                return order
+        order = self.find_local_order(order_id)
+        if order:
+            return order
+        if self.__registry:
+            return self.__registry.find_order(order_id)
         raise Exception("order not found")
     
+    @instrument("Gym.get_order_by_member_id")
     def get_order_by_member_id(self, member_id, refund = False):
-        member = self.get_member_by_id(member_id)
+        return self.get_order_by_member(self.get_member_by_id(member_id), refund)
+
+    def get_order_by_member(self, member, refund = False):
         for order in member.order_list:
-            if order.status == "Pending" and isinstance(order, OrderRefund) == refund:
+            # a visiting member's pending order at their home branch is settled there, not here
+            # renewal orders stand on their own so the cart's ttl doesn't take them down
+            if order.status == "Pending" and isinstance(order, OrderRefund) == refund and order.branch_id == self.__branch_id and order.deadline is None:
                 return order
         order = self.create_order(member, refund)
         return order
     
+    def find_local_booking(self, booking_id):
+        return self.__booking_index.get(booking_id)
+
+    @instrument("Gym.get_booking_by_id")
     def get_booking_by_id(self, booking_id):
-        for user in self.__user_list:
-            if not isinstance(user, Member):
-                continue
-            for training_booking in user.training_booking_list:
-                if training_booking.booking_id == booking_id:
-                    return training_booking
-            for locker_booking in user.locker_booking_list:
-                if locker_booking.booking_id == locker_booking:
-                    return locker_booking
+        # in a registry the index covers every branch's members, so this is one lookup wherever the booking is
+        return self.find_local_booking(booking_id)
+
+    def find_local_user(self, citizen_id):
+        return self.__citizen_index.get(citizen_id)
 
+    @instrument("Gym.get_user_by_citizen_id")
     def get_user_by_citizen_id(self, citizen_id):
-        for user in self.__user_list:
-            if user.citizen_id == citizen_id:
-                return user
+        user = self.find_local_user(citizen_id)
+        if user:
+            return user
+        if self.__registry:
+            return self.__registry.find_by_citizen_id(citizen_id)
         raise Exception("user not found")
     
+    @instrument("Gym.get_staff_by_id")
     def get_staff_by_id(self, staff_id):
         for user in self.__user_list:
             if hasattr(user, "staff_id") and user.staff_id == staff_id:
                 return user
         raise Exception("staff not found")
     
-    def create_order(self, user = None, refund = False):
+    def get_trainer_schedule(self, staff_id, since = None, until = None):
+        trainer = self.get_staff_by_id(staff_id)
+        if not isinstance(trainer, Trainer):
+            raise Exception("Staff is not a trainer")
+        since = since or date.today()
+        until = until or since + timedelta(days=6)
+        if until < since:
+            raise Exception("until can't be before since")
+        if (until - since).days > 366:
+            raise Exception("Schedule window can be at most a year")
+        return [{
+            "type": "Class" if session.gym_class else "Private",
+            "class id": session.gym_class.class_id if session.gym_class else None,
+            "status": session.status,
+            **session.info
+        } for session in trainer.get_schedule(since, until)]
+
+    def create_order(self, user = None, refund = False, deadline = None):
         if refund:
             order = OrderRefund(user)
+        elif deadline:
+            order = Order(user)
+            order.set_deadline(deadline)
+            self.__expiry_index.push(deadline, order, order)
         else:
             order = Order(user)
+            self.track_pending(order, order)
+        order.set_branch_id(self.__branch_id)
         self.__order_list.append(order)
+        self.__order_index[order.order_id] = order
+        if self.__registry:
+            self.__registry.index_order(self.__branch_id, order)
         if isinstance(user, Member):
             user.add_order(order)
         return order
     
+    @synchronized(touches=("sessions",))
     def record_session(self, session_id, training_log, member_training_log):
         session = self.get_session_by_id(session_id)
         for booking in session.training_booking_list:
@@ -939,10 +2253,23 @@ class Gym:
                 log_of_member_id = member_training_log.get(booking_member_id)
                 booking.set_training_log(f"General: {training_log} | Specific: {log_of_member_id if log_of_member_id else 'None'}")
                 booking.set_status("Completed")
-
+        self.__occupancy.record_session(session)
+
+    def get_occupancy(self, year, month = None, room_id = None, staff_id = None, class_id = None):
+        if [room_id, staff_id, class_id].count(None) < 2:
+            raise Exception("Filter by only one of room_id, staff_id or class_id")
+        if room_id:
+            return self.__occupancy.summary(year, month, "room", room_id)
+        if staff_id:
+            return self.__occupancy.summary(year, month, "trainer", staff_id)
+        if class_id:
+            return self.__occupancy.summary(year, month, "class", class_id)
+        return self.__occupancy.summary(year, month)
+
+    @synchronized(touches=("sessions",))
     def write_plan(self, training_plan, session_id=None, member_id=None):
         if session_id:
-            session = self.get_session_by_id(session_id)
+            session = self.get_session_by_id(session_id).materialize()
             session.set_training_plan(training_plan)
         else:
             member = self.get_member_by_id(member_id)
@@ -961,14 +2288,313 @@ class Gym:
                 return order
         raise Exception("item doesn't exist")
 
+    @synchronized(touches=("sessions",))
     def enroll_member_by_id(self, member_id, session_id):
         member = self.get_member_by_id(member_id)
         if member.member_status not in ["Active", "Pending"]:
             raise Exception(f"Can't enroll. Currently status [{member.member_status}]")
-        session = self.get_session_by_id(session_id)
+        session = self.get_session_by_id(session_id).materialize()
         booking = session.enroll_member(member)
+        if booking.status == "Waitlist":
+            return booking
         order = self.get_order_by_member_id(member_id)
         order.add_order_item(booking)
+        self.track_pending(booking, order)
+        return booking
+
+    def get_members_by_ids(self, member_ids):
+        # ids that aren't found are left out
+        members = {}
+        for member_id in set(member_ids):
+            member = self.__member_index.get(member_id)
+            if member is None and self.__registry:
+                # members training at a sister branch
+                try:
+                    member = self.__registry.find_member(member_id)
+                except Exception:
+                    continue
+            if member is not None:
+                members[member_id] = member
+        return members
+
+    def get_sessions_by_ids(self, session_ids):
+        wanted = set(session_ids)
+        sessions = {}
+        session_lists = [gym_class.session_list for gym_class in self.__gym_class_list]
+        session_lists += [user.session_list for user in self.__user_list if isinstance(user, Trainer)]
+        for session_list in session_lists:
+            for session in session_list:
+                if session.session_id in wanted:
+                    sessions[session.session_id] = session
+        for session_id in wanted - sessions.keys():
+            # series occurrences that don't have a Session yet
+            try:
+                sessions[session_id] = self.get_session_by_id(session_id)
+            except Exception:
+                pass
+        return sessions
+
+    def __settle_cash(self, orders):
+        payments = []
+        for order in orders:
+            try:
+                order.set_payment(CashPayment())
+                order.process()
+                if not order.verify_and_update_all_info():
+                    raise Exception("payment was not accepted")
+                payments.append({"order_id": order.order_id, "ok": True, "total": order.payment.amount})
+            except Exception as e:
+                payments.append({"order_id": order.order_id, "ok": False, "error": str(e)})
+        return payments
+
+    def __add_booking_to_order(self, booking, orders):
+        member_id = booking.member.member_id
+        if member_id not in orders:
+            orders[member_id] = self.get_order_by_member_id(member_id)
+        orders[member_id].add_order_item(booking)
+        self.track_pending(booking, orders[member_id])
+
+    @synchronized(touches=("sessions", "products"))
+    def enroll_members_by_id(self, member_ids, session_id, pay_cash = False):
+        session = self.get_session_by_id(session_id).materialize()
+        members = self.get_members_by_ids(member_ids)
+        results = {}
+        enrolling = []
+        member_ids = list(dict.fromkeys(member_ids))
+        for member_id in member_ids:
+            if member_id not in members:
+                results[member_id] = {"member_id": member_id, "ok": False, "error": "member not found"}
+            elif members[member_id].member_status not in ["Active", "Pending"]:
+                results[member_id] = {"member_id": member_id, "ok": False, "error": f"Can't enroll. Currently status [{members[member_id].member_status}]"}
+            else:
+                try:
+                    members[member_id].check_can_enroll(session)
+                except Exception as e:
+                    results[member_id] = {"member_id": member_id, "ok": False, "error": str(e)}
+                    continue
+                enrolling.append(members[member_id])
+
+        bookings = session.enroll_members(enrolling)
+        orders = {}
+        for booking in bookings:
+            if booking.status != "Waitlist":
+                self.__add_booking_to_order(booking, orders)
+        payments = self.__settle_cash(orders.values()) if pay_cash else []
+
+        for booking in bookings:
+            order = orders.get(booking.member.member_id)
+            results[booking.member.member_id] = {
+                "member_id": booking.member.member_id,
+                "ok": True,
+                "booking_id": booking.booking_id,
+                "status": booking.status,
+                "order_id": order.order_id if order else None
+            }
+        return {
+            "session_id": session.session_id,
+            "results": [results[member_id] for member_id in member_ids],
+            "payments": payments
+        }
+
+    @synchronized(touches=("sessions", "products"))
+    def enroll_member_in_sessions(self, member_id, session_ids, pay_cash = False):
+        member = self.get_member_by_id(member_id)
+        if member.member_status not in ["Active", "Pending"]:
+            raise Exception(f"Can't enroll. Currently status [{member.member_status}]")
+        sessions = self.get_sessions_by_ids(session_ids)
+        results = []
+        bookings = []
+        orders = {}
+        for session_id in dict.fromkeys(session_ids):
+            if session_id not in sessions:
+                results.append({"session_id": session_id, "ok": False, "error": "session not found"})
+                continue
+            try:
+                # checked on the occurrence first so a rejected enroll doesn't leave a Session behind
+                member.check_can_enroll(sessions[session_id])
+                booking = sessions[session_id].materialize().enroll_member(member)
+            except Exception as e:
+                results.append({"session_id": session_id, "ok": False, "error": str(e)})
+                continue
+            if booking.status != "Waitlist":
+                self.__add_booking_to_order(booking, orders)
+            bookings.append(booking)
+        payments = self.__settle_cash(orders.values()) if pay_cash else []
+
+        order = orders.get(member.member_id)
+        for booking in bookings:
+            results.append({
+                "session_id": booking.session.session_id,
+                "ok": True,
+                "booking_id": booking.booking_id,
+                "status": booking.status,
+                "order_id": order.order_id if order and booking.status != "Waitlist" else None
+            })
+        return {
+            "member_id": member.member_id,
+            "results": results,
+            "payments": payments
+        }
+
+    @synchronized(touches=("sessions", "products"))
+    def pay_orders_cash(self, order_ids):
+        order_ids = list(dict.fromkeys(order_ids))
+        orders = []
+        payments = {}
+        for order_id in order_ids:
+            try:
+                order = self.get_order_by_id(order_id)
+            except Exception as e:
+                payments[order_id] = {"order_id": order_id, "ok": False, "error": str(e)}
+                continue
+            if order.status != "Pending":
+                payments[order_id] = {"order_id": order_id, "ok": False, "error": f"order is {order.status}"}
+                continue
+            orders.append(order)
+        for payment in self.__settle_cash(orders):
+            payments[payment["order_id"]] = payment
+        return [payments[order_id] for order_id in order_ids]
+
+    def promote_waitlist(self, session):
+        promoted = []
+        if session.status == "Cancelled":
+            return promoted
+        # the session keeps its held seats counted, so this is one lookup and then one pop per seat
+        free_seats = session.max_participants - session.get_held_num()
+        while free_seats > 0:
+            booking = session.waitlist.pop_next()
+            if booking is None:
+                break
+            if booking.member.member_status not in ["Active", "Pending"]:
+                booking.cancel()
+                continue
+            booking.set_status("Pending")
+            free_seats -= 1
+            order = self.get_order_by_member_id(booking.member.member_id)
+            order.add_order_item(booking)
+            self.track_pending(booking, order)
+            promoted.append(booking.booking_id)
+        return promoted
+
+    def release_pending_item(self, item, order):
+        if isinstance(item, TrainingBooking):
+            item.cancel()
+            order.remove_item(item)
+            self.promote_waitlist(item.session)
+        elif isinstance(item, LockerBooking):
+            item.locker.release(item)
+            order.remove_item(item)
+        elif isinstance(item, ProductAmount):
+            item.release()
+            order.remove_item(item)
+        elif isinstance(item, DayPass):
+            self.__daypass_ledger.release(item.date, item.user.citizen_id)
+            order.remove_item(item)
+
+    def __payment_in_flight(self, payment):
+        # started at the gateway and not settled either way yet
+        return payment is not None and payment.status == "Pending" and payment.payment_gateway_transaction_id is not None
+
+    def __expire_order(self, order, now):
+        for order_item in order.order_item_list:
+            self.release_pending_item(order_item, order)
+        order.set_status("Expired")
+        # a lapsed renewal is issued again while the member is still expired, up to RENEWAL_ATTEMPTS orders
+        # in all. after that the membership counts as given up and renewing goes through change_membership
+        attempt = order.renewal_attempt
+        if order.deadline is not None and order.user.member_status == "Expired" and 0 < attempt < Gym.RENEWAL_ATTEMPTS:
+            return self.issue_renewal_order(order.user, now, attempt + 1)
+        return None
+
+    @synchronized(touches=("sessions", "products"))
+    def sweep_expired(self, now = None):
+        now = now or datetime.now()
+        expired = []
+        renewal_orders = []
+        for item, order in self.__expiry_index.pop_due(now):
+            if order.status != "Pending":
+                continue
+            if order.payment is not None:
+                # a payment is in flight (e.g. unvalidated QR), it gets one window from when it was started.
+                # a payment that wasn't validated by then is abandoned and the whole order goes
+                expires_at = order.payment.created_at + self.__payment_window
+            elif item is order:
+                expires_at = order.deadline or order.updated_at + self.__pending_ttl
+            else:
+                if isinstance(item, Booking) and item.status == "Pending" and order.has_item(item):
+                    self.release_pending_item(item, order)
+                    expired.append(item.booking_id)
+                continue
+            if expires_at > now:
+                self.__expiry_index.push(expires_at, item, order)
+                continue
+            if self.__payment_in_flight(order.payment) and order.verify_and_update_all_info():
+                # paid at the gateway but never validated, the items are still held so the order goes through
+                continue
+            renewal = self.__expire_order(order, now)
+            expired.append(order.order_id)
+            if renewal:
+                renewal_orders.append(renewal.order_id)
+        return {
+            "expired": len(expired),
+            "expired_ids": expired,
+            "renewal_orders": renewal_orders,
+            "next_expiry": self.__expiry_index.next_expiry
+        }
+
+    @synchronized(touches=())
+    def sweep_memberships(self, now = None):
+        # only members due by now come off the index. a member whose last term ran out is expired and gets
+        # a renewal order for the same plan, paying it starts a new term
+        now = now or datetime.now()
+        expired = []
+        renewal_orders = []
+        for member, _ in self.__membership_index.pop_due(now):
+            if member.next_check is None or member.next_check > now:
+                # rescheduled since (a freeze or an early renewal), a later entry covers it
+                continue
+            if member.settle_terms(now):
+                order = self.issue_renewal_order(member, now)
+                expired.append(member.member_id)
+                renewal_orders.append(order.order_id)
+        return {
+            "expired": len(expired),
+            "expired_ids": expired,
+            "renewal_orders": renewal_orders,
+            "next_check": self.__membership_index.next_expiry
+        }
+
+    def issue_renewal_order(self, member, now = None, attempt = 1):
+        # a renewal order of its own, open for one term of the plan rather than the pending ttl
+        now = now or datetime.now()
+        term_days = MembershipPlan[member.current_membership.upper()].term_days
+        order = self.create_order(member, deadline=now + timedelta(days=term_days))
+        order.set_renewal_attempt(attempt)
+        order.add_order_item(NewMembership(member.current_membership, member=member))
+        return order
+
+    @synchronized(touches=())
+    def freeze_membership(self, member_id, since = None, until = None):
+        member = self.get_member_by_id(member_id)
+        member.freeze_term(since or datetime.now(), until)
+        return member.term_at(since or datetime.now()).info
+
+    @synchronized(touches=())
+    def unfreeze_membership(self, member_id):
+        member = self.get_member_by_id(member_id)
+        member.unfreeze_term()
+        return member.term_at(datetime.now()).info
+
+    def get_membership_terms(self, member_id):
+        member = self.get_member_by_id(member_id)
+        with self.__lock:
+            return {
+                "member_id": member.member_id,
+                "membership": member.current_membership,
+                "status": member.member_status,
+                "paid_until": member.paid_until,
+                "terms": [term.info for term in member.term_list]
+            }
 
     def refund_booking(self, booking):
         refund_order = self.create_order(booking.member, refund=True)
@@ -983,6 +2609,7 @@ class Gym:
         refund_order.process()
         return refund_order
 
+    @synchronized(touches=("sessions",))
     def cancel_booking(self, booking_id: str, is_system = False):
         booking = self.get_booking_by_id(booking_id)
 
@@ -1001,6 +2628,15 @@ class Gym:
         
         if status in ("Cancelled", "Completed"):
             raise Exception(f"Cannot cancel — current status: {status}")
+        elif status == "Waitlist":
+            booking.cancel()
+            booking.session.waitlist.remove(booking)
+            return {
+                "booking_id": booking.booking_id,
+                "cancelled": True,
+                "refund": 0.0,
+                "message": "Cancelled (Waitlist) — removed from the waitlist"
+            }
         elif status == "Pending":
             booking.cancel()
             self.find_and_remove_item_from_order(booking)
@@ -1008,7 +2644,8 @@ class Gym:
                 "booking_id": booking.booking_id,
                 "cancelled": True,
                 "refund": 0.0,
-                "message": "Cancelled (Pending) — no refund, not yet paid"
+                "message": "Cancelled (Pending) — no refund, not yet paid",
+                "promoted_from_waitlist": self.promote_waitlist(booking.session)
             }
         
         hours_until = (booking.session.start - datetime.now()).total_seconds() / 3600
@@ -1022,7 +2659,8 @@ class Gym:
                 "booking_id": booking.booking_id,
                 "cancelled": True,
                 "refund": 0.0,
-                "message": f"Cancelled — no refund ({hours_until:.1f} hrs notice, need >= 4)"
+                "message": f"Cancelled — no refund ({hours_until:.1f} hrs notice, need >= 4)",
+                "promoted_from_waitlist": self.promote_waitlist(booking.session)
             }
         else:
             self.refund_booking(booking)
@@ -1033,12 +2671,17 @@ class Gym:
                 "booking_id": booking.booking_id,
                 "cancelled": True,
                 "refund": refund_amount,
+                "promoted_from_waitlist": self.promote_waitlist(booking.session)
                 }
     
+    @synchronized(touches=("sessions",))
     def cancel_session(self, session_id):
-        session = self.get_session_by_id(session_id)
+        session = self.get_session_by_id(session_id).materialize()
+        session.cancel()
         cancelled_booking_list = []
         for training_booking in session.training_booking_list:
+            if training_booking.status == "Cancelled":
+                continue
             cancelled_booking = self.cancel_booking(training_booking.booking_id, is_system=True)
             cancelled_booking_list.append(cancelled_booking)
         return {
@@ -1046,9 +2689,12 @@ class Gym:
             "cancelled bookings": cancelled_booking_list
             }
 
+    @instrument("Gym.pay_order_credit_card")
+    @synchronized(touches=("sessions", "products"))
     def pay_order_credit_card(self, card_num, cvv, expiry, order_id):
         order = self.get_order_by_id(order_id)
         order.set_payment(CreditCardPayment(card_num, cvv, expiry))
+        self.track_payment(order)
         order.process()
         result = order.verify_and_update_all_info()
         if result:
@@ -1056,24 +2702,41 @@ class Gym:
                 "success": f"Successfully payed {order.payment.amount} for order_id: {order.order_id}"
             }
         
+    @instrument("Gym.pay_order_qr")
+    @synchronized(touches=("sessions", "products"))
     def pay_order_qr(self, order_id):
         order = self.get_order_by_id(order_id)
         # if isinstance(order, Order): pass
         order.set_payment(QRPayment())
+        self.track_payment(order)
         order.process()
         return {
             "success": f"Created QRcode with amount {order.payment.amount} for order_id: {order.order_id}, Currently waiting on paymennt",
             "qr_string": order.payment.qr_string
         }
 
+    @instrument("Gym.validate_pay_order_qr")
+    @synchronized(touches=("sessions", "products"))
     def validate_pay_order_qr(self, order_id):
         order = self.get_order_by_id(order_id)
+        if order.status == "Expired":
+            # the customer may have paid at the gateway after the window ran out. the items were released
+            # by then, so the money goes back instead of being dropped
+            payment = order.payment
+            if self.__payment_in_flight(payment) and payment.validate():
+                payment.refund()
+                return {
+                    "refunded": f"Order {order.order_id} expired before its QRcode payment came in, the payment of {payment.amount} was refunded, please place a new order"
+                }
+            raise Exception(f"Order {order.order_id} has expired, please place a new one")
         result = order.verify_and_update_all_info()
         if result:
             return {
                 "success": f"QRcode payment of amount {order.payment.amount} verified for order_id: {order.order_id}"
             }
 
+    @instrument("Gym.pay_order_cash")
+    @synchronized(touches=("sessions", "products"))
     def pay_order_cash(self, order_id):
         order = self.get_order_by_id(order_id)
         order.set_payment(CashPayment())
@@ -1084,6 +2747,7 @@ class Gym:
                 "success": f"Successfully payed for order_id: {order.order_id}"
             }
 
+    @synchronized(touches=("sessions",))
     def check_in_member(self, member_id):
         member = self.get_member_by_id(member_id)
 
@@ -1127,17 +2791,72 @@ class Gym:
             raise Exception(f"Invalid status: {status}. Valid: Active, Suspended, Frozen, Expired")
 
     def replace_user_with_member(self, member):
-        citizen_id = member.citizen_id
-        for idx, user in enumerate(self.__user_list):
-            if user.citizen_id == citizen_id:
-                self.__user_list[idx] = member
-                print(f"User with citizen_id: {user.citizen_id} has been replaced by Member with {member.current_membership} membership")
+        # a guest becoming a member, __add_user swaps them in place
+        self.__add_user(member)
+        print(f"User with citizen_id: {member.citizen_id} has been replaced by Member with {member.current_membership} membership")
+
+    @synchronized(touches=("staff",))
+    def merge_duplicate_users(self):
+        # one-shot cleanup for records made before citizen ids were unique (e.g. an old snapshot): every
+        # duplicate member is folded into the oldest one and its member_id keeps pointing there, duplicate
+        # guests are dropped. anything else (two staff records, staff and member) is left for a manager
+        groups = {}
+        for user in self.__user_list:
+            groups.setdefault(user.citizen_id, []).append(user)
+        orders_by_user = {}
+        for order in self.__order_list:
+            orders_by_user.setdefault(id(order.user), []).append(order)
+        merged = []
+        unmerged = []
+        keep = set()
+        for citizen_id, users in groups.items():
+            if len(users) == 1:
+                keep.add(id(users[0]))
+                continue
+            members = [user for user in users if isinstance(user, Member)]
+            staff = [user for user in users if isinstance(user, Staff)]
+            guests = [user for user in users if isinstance(user, Guest)]
+            if len(staff) > 1 or (staff and members):
+                unmerged.append({"citizen_id": citizen_id, "records": [self.__user_label(user) for user in members + staff]})
+                keep.update(id(user) for user in members + staff)
+                kept = (members + staff)[0]
+                duplicates = guests
+            else:
+                kept = (members + staff + guests)[0]
+                keep.add(id(kept))
+                duplicates = [user for user in users if user is not kept]
+            folded = []
+            for duplicate in duplicates:
+                if isinstance(duplicate, Member):
+                    kept.absorb(duplicate)
+                    self.__member_index[duplicate.member_id] = kept
+                    if self.__registry:
+                        self.__registry.index_member_alias(self.__branch_id, duplicate.member_id)
+                else:
+                    for day in duplicate.guest_date_list:
+                        kept.add_guest_date(day)
+                    for order in orders_by_user.get(id(duplicate), []):
+                        order.set_user(kept)
+                        if isinstance(kept, Member):
+                            kept.add_order(order)
+                folded.append(self.__user_label(duplicate))
+            if folded:
+                merged.append({"citizen_id": citizen_id, "kept": self.__user_label(kept), "folded": folded})
+        self.__user_list[:] = [user for user in self.__user_list if id(user) in keep]
+        self.__citizen_index = {}
+        for user in self.__user_list:
+            self.__citizen_index.setdefault(user.citizen_id, user)
+        return {
+            "merged": merged,
+            "unmerged": unmerged
+        }
 
     def change_membership(self, member_id, new_membership_type):
         member = self.get_member_by_id(member_id)
         order = self.get_order_by_member_id(member_id)
         order.add_order_item(NewMembership(new_membership_type, member=member))
 
+    @instrument("Gym.gather_report")
     def gather_report(self, month, year):
         month_now = datetime.now().month
         year_now = datetime.now().year
@@ -1145,77 +2864,101 @@ class Gym:
         if year > year_now or (year == year_now and month > month_now):
             raise Exception("Report for future month/year cannot be generated")
 
-        revenue_data = {
-            "Membership": 0.0,
-            "Daypass": 0.0,
-            "Product": 0.0,
-            "Locker": 0.0,
-            "Training": 0.0
-        }
-
-        membership_type_count = {
-            "Monthly": 0,
-            "Annual": 0,
-            "Student": 0
-        }
-
-        total_revenue = 0.0
-        matched_orders = []
-
-        for order in self.__order_list:
-            payment = order.payment
-            if not payment:
-                continue
-
-            if payment.status not in ["Paid", "Refunded"]:
-                continue
-
-            if payment.timestamp is None:
-                continue
-
-            pay_date = payment.timestamp
-            if pay_date.month != month or pay_date.year != year:
-                continue
-
-            matched_orders.append(order)
-
-            if payment.status == "Paid":
-                multiplier = 1
-            else: multiplier = -1
-
-            for order_item in order.order_item_list:
-                price = order_item.calculate_price(order.user) * multiplier
-                if isinstance(order_item, NewMembership):
-                    revenue_data["Membership"] += price
-                    if multiplier > 0:
-                        membership_type_count[order_item.membership] += 1
-                elif isinstance(order_item, DayPass):
-                    revenue_data["Daypass"] += price
-                elif isinstance(order_item, ProductAmount):
-                    revenue_data["Product"] += price
-                elif isinstance(order_item, LockerBooking):
-                    revenue_data["Locker"] += price
-                elif isinstance(order_item, TrainingBooking):
-                    revenue_data["Training"] += price
-
-                total_revenue += price
+        report = self.__new_report()
+        # a report reads every open order, it waits for writes so it never counts half of one
+        with self.__lock:
+            archived = self.__archived_reports.get((year, month))
+            if archived:
+                self.__merge_report(report, archived)
+            for order in self.__order_list:
+                if self.__report_month(order) == (year, month):
+                    self.__add_to_report(report, order)
 
         return {
             "month": month,
             "year": year,
-            "matched_orders_count": len(matched_orders),
-            "revenue": revenue_data,
-            "total_revenue": round(total_revenue, 2),
-            "membership_distribution": membership_type_count
+            "matched_orders_count": report["matched_orders_count"],
+            "revenue": report["revenue"],
+            "total_revenue": round(report["total_revenue"], 2),
+            "membership_distribution": report["membership_distribution"]
+        }
+
+    def __new_report(self):
+        return {
+            "matched_orders_count": 0,
+            "revenue": {
+                "Membership": 0.0,
+                "Daypass": 0.0,
+                "Product": 0.0,
+                "Locker": 0.0,
+                "Training": 0.0
+            },
+            "total_revenue": 0.0,
+            "membership_distribution": {
+                "Monthly": 0,
+                "Annual": 0,
+                "Student": 0
+            }
         }
 
+    def __merge_report(self, report, other):
+        report["matched_orders_count"] += other["matched_orders_count"]
+        report["total_revenue"] += other["total_revenue"]
+        for key in ("revenue", "membership_distribution"):
+            for name, value in other[key].items():
+                report[key][name] += value
+
+    def __report_month(self, order):
+        # (year, month) of the report an order counts in, None if it doesn't count in any
+        payment = order.payment
+        if not payment:
+            return None
+
+        if order.status == "Expired":
+            # brought nothing in, a payment that came in late was refunded
+            return None
+
+        if payment.status not in ["Paid", "Refunded"]:
+            return None
+
+        if payment.timestamp is None:
+            return None
+
+        return payment.timestamp.year, payment.timestamp.month
+
+    def __add_to_report(self, report, order):
+        revenue_data = report["revenue"]
+        membership_type_count = report["membership_distribution"]
+        report["matched_orders_count"] += 1
+
+        if order.payment.status == "Paid":
+            multiplier = 1
+        else: multiplier = -1
+
+        for order_item in order.order_item_list:
+            price = order_item.calculate_price(order.user) * multiplier
+            if isinstance(order_item, NewMembership):
+                revenue_data["Membership"] += price
+                if multiplier > 0:
+                    membership_type_count[order_item.membership] += 1
+            elif isinstance(order_item, DayPass):
+                revenue_data["Daypass"] += price
+            elif isinstance(order_item, ProductAmount):
+                revenue_data["Product"] += price
+            elif isinstance(order_item, LockerBooking):
+                revenue_data["Locker"] += price
+            elif isinstance(order_item, TrainingBooking):
+                revenue_data["Training"] += price
+
+            report["total_revenue"] += price
 
 class User(ABC):
-    def __init__(self, citizen_id, name, birth_date, guest_date_list = []):
+    def __init__(self, citizen_id, name, birth_date, guest_date_list = None):
         self.__citizen_id = citizen_id
         self.__name = name
         self.__birth_date = birth_date
-        self.__guest_date_list = guest_date_list
+        # paid daypass dates, each user gets their own list
+        self.__guest_date_list = list(guest_date_list) if guest_date_list else []
 
     @property
     def citizen_id(self):
@@ -1240,10 +2983,79 @@ class User(ABC):
     def show_notifications(self, gym=None):
         pass
 
+class MembershipTerm:
+    # one paid stretch of a membership. a term paid ahead starts when the one before it ends, and a freeze
+    # stops the clock: the end moves by however long the freeze lasted (and is unknown while it has no end)
+    def __init__(self, membership, start, previous = None):
+        self.__membership = membership
+        self.__start = start
+        self.__previous = previous
+        self.__length = timedelta(days=MembershipPlan[membership.upper()].term_days)
+        self.__freeze_list = []
+
+    @property
+    def membership(self):
+        return self.__membership
+
+    @property
+    def start(self):
+        if self.__previous is not None and self.__previous.end is not None:
+            return max(self.__start, self.__previous.end)
+        return None if self.__previous is not None else self.__start
+
+    @property
+    def end(self):
+        start = self.start
+        if start is None:
+            return None
+        end = start + self.__length
+        for since, until in self.__freeze_list:
+            if until is None:
+                return None
+            end += until - since
+        return end
+
+    @property
+    def freeze_list(self):
+        return tuple((since, until) for since, until in self.__freeze_list)
+
+    def freeze_at(self, at):
+        # the freeze running at at, as [since, until]
+        for freeze in self.__freeze_list:
+            if freeze[0] <= at and (freeze[1] is None or at < freeze[1]):
+                return freeze
+        return None
+
+    def add_freeze(self, since, until = None):
+        if self.__freeze_list and (self.__freeze_list[-1][1] is None or self.__freeze_list[-1][1] > since):
+            raise Exception("Membership is already frozen then")
+        start = self.start
+        end = self.end
+        if start is None or end is None or since < start or since >= end:
+            raise Exception("Can only freeze a running membership term")
+        if until is not None and until <= since:
+            raise Exception("Freeze has to end after it starts")
+        self.__freeze_list.append([since, until])
+
+    def end_freeze(self, at):
+        freeze = self.freeze_at(at)
+        if freeze is None:
+            raise Exception("Membership is not frozen")
+        freeze[1] = at
+
+    @property
+    def info(self):
+        return {
+            "membership": self.__membership,
+            "start": self.start,
+            "end": self.end,
+            "freezes": [{"since": since, "until": until} for since, until in self.__freeze_list]
+        }
+
 class Member(User):
     __next_id = 1
 
-    def __init__(self, citizen_id, name, birth_date, membership = "Monthly", guest_date_list = [], status = "Pending"): #MEM-2023-001
+    def __init__(self, citizen_id, name, birth_date, membership = "Monthly", guest_date_list = None, status = "Pending"): #MEM-2023-001
         super().__init__(citizen_id, name, birth_date, guest_date_list=guest_date_list)
         self.__member_id = f"MEM-{Member.__next_id:03d}"
         Member.__next_id += 1
@@ -1253,6 +3065,34 @@ class Member(User):
         self.__order_list = []
         self.__training_booking_list = []
         self.__locker_booking_list = []
+        self.__archived_count = 0
+        # active training bookings by session time, and the latest booking per session
+        self.__booking_timeline = Timeline(TrainingBooking.is_active)
+        self.__booking_by_session_id = {}
+        # the branch's booking_id -> booking index, see set_booking_index
+        self.__booking_index = None
+        # paid terms, oldest first. the gym's membership index holds the member at next_check,
+        # the next moment its status can change (a term or a freeze ending)
+        self.__term_list = []
+        self.__term_index = None
+        self.__next_check = None
+
+    def __setstate__(self, state):
+        state.setdefault("_Member__booking_index", None)
+        state.setdefault("_Member__booking_timeline", Timeline(TrainingBooking.is_active))
+        state.setdefault("_Member__booking_by_session_id", {})
+        state.setdefault("_Member__term_list", [])
+        state.setdefault("_Member__term_index", None)
+        state.setdefault("_Member__next_check", None)
+        self.__dict__.update(state)
+
+    def index_bookings(self):
+        # archived bookings are closed, only what's left needs indexing
+        self.__booking_timeline = Timeline(TrainingBooking.is_active)
+        for booking in self.__training_booking_list:
+            if booking.is_active():
+                self.__booking_timeline.add(booking)
+        self.__booking_by_session_id = {booking.session.session_id: booking for booking in self.__training_booking_list}
 
     @property
     def member_id(self):
@@ -1290,6 +3130,95 @@ class Member(User):
     def expire(self):
         self.__status = "Expired"
 
+    @property
+    def term_list(self):
+        return tuple(self.__term_list)
+
+    @property
+    def next_check(self):
+        return self.__next_check
+
+    def set_booking_index(self, booking_index):
+        # the branch's booking_id -> booking index, every booking of this member is in it while it isn't archived
+        self.__booking_index = booking_index
+        for booking in self.__training_booking_list + self.__locker_booking_list:
+            booking_index[booking.booking_id] = booking
+
+    def set_term_index(self, term_index):
+        self.__term_index = term_index
+        if self.__next_check is not None:
+            term_index.push(self.__next_check, self, self)
+
+    def __schedule(self, at):
+        self.__next_check = at
+        if at is not None and self.__term_index is not None:
+            self.__term_index.push(at, self, self)
+
+    def term_at(self, at):
+        # the latest term started by at
+        for term in reversed(self.__term_list):
+            start = term.start
+            if start is not None and start <= at:
+                return term
+        return None
+
+    @property
+    def paid_until(self):
+        return self.__term_list[-1].end if self.__term_list else None
+
+    def start_term(self, membership, at = None):
+        # a term paid while one is still running is queued after it, paying during a freeze ends the freeze
+        at = at or datetime.now()
+        last = self.__term_list[-1] if self.__term_list else None
+        if last is not None and last.freeze_at(at) is not None:
+            last.end_freeze(at)
+        if last is not None and last.end is not None and last.end > at:
+            term = MembershipTerm(membership, at, previous=last)
+        else:
+            term = MembershipTerm(membership, at)
+        self.__term_list.append(term)
+        self.settle_terms(at)
+        return term
+
+    def freeze_term(self, since, until = None):
+        term = self.term_at(since)
+        if term is None:
+            raise Exception(f"{self.__member_id} has no membership term to freeze")
+        term.add_freeze(since, until)
+        self.settle_terms(datetime.now())
+
+    def unfreeze_term(self, at = None):
+        at = at or datetime.now()
+        term = self.term_at(at)
+        if term is None:
+            raise Exception(f"{self.__member_id} has no membership term")
+        term.end_freeze(at)
+        self.settle_terms(at)
+
+    def settle_terms(self, now):
+        # brings the status in line with the terms at now and schedules the next check, returns True when
+        # the membership just ran out. suspended and expired members are left to the manager / a new payment
+        term = self.term_at(now)
+        if term is None or self.__status in ("Suspended", "Expired"):
+            self.__schedule(None)
+            return False
+        freeze = term.freeze_at(now)
+        if freeze is not None:
+            self.__status = "Frozen"
+            self.__schedule(freeze[1])
+            return False
+        end = term.end
+        if end is not None and end <= now:
+            self.__status = "Expired"
+            self.__schedule(None)
+            return True
+        self.__status = "Active"
+        self.__current_membership = term.membership
+        # a freeze booked ahead changes the status before the end does
+        upcoming = [since for since, until in term.freeze_list if since > now]
+        self.__schedule(min(upcoming + ([end] if end else []), default=None))
+        return False
+
     @property
     def order_info(self):
         return [order.info for order in self.__order_list]
@@ -1300,12 +3229,61 @@ class Member(User):
     def add_booking(self, booking):
         if isinstance(booking, TrainingBooking):
             self.__training_booking_list.append(booking)
+            self.__booking_timeline.add(booking)
+            self.__booking_by_session_id[booking.session.session_id] = booking
         elif isinstance(booking, LockerBooking):
             self.__locker_booking_list.append(booking)
+        if self.__booking_index is not None:
+            self.__booking_index[booking.booking_id] = booking
 
     def add_order(self, order):
         self.__order_list.append(order)
 
+    def absorb(self, other):
+        # folds a duplicate record of the same person into this one, other is left empty
+        for order in other.__order_list:
+            order.set_user(self)
+            self.__order_list.append(order)
+        for booking in other.__training_booking_list + other.__locker_booking_list:
+            booking.set_member(self)
+            self.add_booking(booking)
+        for day in other.guest_date_list:
+            self.add_guest_date(day)
+        self.__archived_count += other.__archived_count
+        if not self.__term_list and other.__term_list:
+            self.__term_list = other.__term_list
+            self.__current_membership = other.__current_membership
+            self.__status = other.__status
+            self.settle_terms(datetime.now())
+        other.__order_list = []
+        other.__training_booking_list = []
+        other.__locker_booking_list = []
+        other.__term_list = []
+        other.__next_check = None
+
+    @property
+    def archived_count(self):
+        return self.__archived_count
+
+    def archive_before(self, cutoff):
+        # moves closed records out of the hot lists, the caller writes them to the cold tier
+        archived = {}
+        for kind, records in (("training_booking", self.__training_booking_list), ("locker_booking", self.__locker_booking_list), ("order", self.__order_list)):
+            keep = []
+            archived[kind] = []
+            for record in records:
+                if record.is_archivable(cutoff):
+                    archived[kind].append(record.archive_record)
+                    if kind != "order" and self.__booking_index is not None:
+                        self.__booking_index.pop(record.booking_id, None)
+                else:
+                    keep.append(record)
+            records[:] = keep
+            self.__archived_count += len(archived[kind])
+        if archived["training_booking"]:
+            self.index_bookings()
+        return archived
+
     def print_orders(self):
         for order in self.__order_list:
             print(order)
@@ -1326,16 +3304,28 @@ class Member(User):
     #     gym.enroll_member(self,session_id)
 
     def find_booking_by_session_id(self, session_id: str):
-        for booking in self.__training_booking_list:
-            if booking.session.session_id == session_id:
-                return booking
-        return None
+        return self.__booking_by_session_id.get(session_id)
+
+    def get_booking_conflict(self, session):
+        return self.__booking_timeline.conflict(session.start, session.end)
+
+    def check_can_enroll(self, session):
+        conflict = self.get_booking_conflict(session)
+        if conflict is None:
+            return
+        if conflict.session is session:
+            raise Exception(f"{self.__member_id} is already enrolled in session {session.session_id}")
+        raise Exception(f"{self.__member_id} already has session {conflict.session.session_id} at that time")
+
+    def get_upcoming_bookings(self, until = None):
+        # active bookings whose session hasn't ended yet, soonest first
+        now = datetime.now()
+        return [booking for booking in self.__booking_timeline.window(now.date(), until) if booking.end > now]
     
     def get_confirmed_booking_today(self):
         today = date.today()
-        # today = booking.session.date
-        for booking in self.__training_booking_list:
-            if booking.status == "Confirmed" and booking.session.date == today:
+        for booking in self.__booking_timeline.window(today, today):
+            if booking.status == "Confirmed":
                 return booking
         return None
 
@@ -1359,8 +3349,10 @@ class Member(User):
             "name": self.name,
             "current_membership": self.__current_membership,
             "status": self.__status,
+            "paid_until": self.paid_until,
             "training_plan": self.__training_plan,
-            "training_history": [f"{training_booking.training_log} [{training_booking.session.session_id} {training_booking.session.date}]" for training_booking in self.__training_booking_list if training_booking.training_log]
+            "training_history": [f"{training_booking.training_log} [{training_booking.session.session_id} {training_booking.session.date}]" for training_booking in self.__training_booking_list if training_booking.training_log],
+            "archived_records": self.__archived_count
         }
 
 class Guest(User):
@@ -1396,19 +3388,46 @@ class Trainer(Staff):
         self.__tier = tier
         self.__specialization = specialization
         self.__session_list = []
+        self.__series_list = []
+        # everything this trainer teaches, class sessions included
+        self.__timeline = Timeline()
+
+    def __setstate__(self, state):
+        state.setdefault("_Trainer__series_list", [])
+        state.setdefault("_Trainer__timeline", Timeline())
+        self.__dict__.update(state)
+
+    def reset_timeline(self):
+        self.__timeline = Timeline()
 
     @property
     def tier(self):
         return self.__tier
+
+    @property
+    def timeline(self):
+        return self.__timeline
     
     @property
     def session_list(self):
         return self.__session_list
+
+    @property
+    def series_list(self):
+        return self.__series_list
+
+    def get_sessions(self, since = None, until = None):
+        # every session in the window by start time, series occurrences nobody touched come as SessionOccurrence
+        sessions = [session for session in self.__session_list if session.series is None and (since is None or session.date >= since) and (until is None or session.date <= until)]
+        for series in self.__series_list:
+            sessions.extend(series.occurrences(since, until))
+        sessions.sort(key=lambda session: session.start)
+        return sessions
     
     @property
     def session_info(self):
         sessions = []
-        for session in self.session_list:
+        for session in self.get_sessions(since=date.today()):
             participants = session.get_enrolled_num()
             if session.date >= date.today() and participants < session.max_participants:
                 sessions.append(session.info)
@@ -1430,31 +3449,51 @@ class Trainer(Staff):
         if not trainer: trainer = self
         if max_participants > room.max_people:
             raise Exception(f"Room can only accommodate {room.max_people} people")
+        if not isinstance(trainer, Trainer):
+            raise Exception("Staff is not a trainer")
+        conflict = trainer.get_conflict(start, end, date)
+        if conflict:
+            raise Exception(f"Trainer {trainer.staff_id} is already teaching session {conflict.session_id} at that time")
         if isinstance(self, GymClass):
             gym_class = self
         else:
             gym_class = None
         session = Session(start, end, date, max_participants, room, trainer, gym_class)
-        self.__session_list.append(session)
+        self.add_session(session)
         return session
     
-    def create_repeating_session(self, start, end, start_date, days_interval, times, max_participants, room, trainer = None):
+    def create_repeating_session(self, start, end, start_date, days_interval, times, max_participants, room, trainer = None, until = None):
         if not trainer and not isinstance(self, Trainer):
             raise Exception("Trainer not provided")
         if not trainer: trainer = self
         if max_participants > room.max_people:
             raise Exception(f"Room can only accommodate {room.max_people} people")
-        for time in range(times):
-            date = start_date + timedelta(days=days_interval*time)
-            if not room.is_available(start, end, date):
+        if not isinstance(trainer, Trainer):
+            raise Exception("Staff is not a trainer")
+        if isinstance(self, GymClass):
+            gym_class = self
+            series_id = f"{self.class_id}-S{len(self.__series_list)+1}"
+        else:
+            gym_class = None
+            series_id = f"{self.staff_id}-S{len(self.__series_list)+1}"
+        series = SessionSeries(self, series_id, start, end, start_date, days_interval, max_participants, room, trainer, gym_class, count=times, until=until)
+        for occurrence in series.occurrences():
+            if not room.is_available(start, end, occurrence.date):
                 raise Exception("Session is overlapping another previous session")
-            
-            if isinstance(self, GymClass):
-                gym_class = self
-            else:
-                gym_class = None
-            session = Session(start, end, date, max_participants, room, trainer, gym_class)
-            self.__session_list.append(session)
+            conflict = trainer.get_conflict(start, end, occurrence.date)
+            if conflict:
+                raise Exception(f"Trainer {trainer.staff_id} is already teaching session {conflict.session_id} on {occurrence.date}")
+        self.__series_list.append(series)
+        trainer.assign_series(series)
+        room.assign_series(series)
+        return series
+
+    def add_session(self, session):
+        self.__session_list.append(session)
+        if session.series is None:
+            # occurrences of a series are already on the timelines through the series
+            session.trainer.assign_session(session)
+            session.room.assign_session(session)
 
     def view_session(self):
         pass
@@ -1463,8 +3502,27 @@ class Trainer(Staff):
         for session in self.__session_list:
             if session.session_id == session_id:
                 return session
+        for series in self.__series_list:
+            session = series.get_session_by_id(session_id)
+            if session:
+                return session
         return False
 
+    def get_conflict(self, start, end, date, ignore = None):
+        return self.__timeline.conflict(datetime.combine(date, start), datetime.combine(date, end), ignore)
+
+    def assign_session(self, session):
+        self.__timeline.add(session)
+
+    def assign_series(self, series):
+        self.__timeline.add_series(series)
+
+    def release_session(self, session):
+        self.__timeline.remove(session)
+
+    def get_schedule(self, since = None, until = None):
+        return self.__timeline.window(since, until)
+
     def write_training_plan(self, sched_or_mem: Session | Member, text):
         sched_or_mem.set_training_plan(text)
 
@@ -1472,9 +3530,8 @@ class Trainer(Staff):
         notifications = []
         now = date.today()
         limit = now + timedelta(hours=2)
-        for session in self.__session_list:
-            if limit >= session.date >= now:
-                notifications.append(session.notification)
+        for session in self.get_sessions(since=now, until=limit):
+            notifications.append(session.notification)
         return notifications
     
 class Receptionist(Staff):
@@ -1496,7 +3553,7 @@ class Receptionist(Staff):
         session_bookings = []
         for gym_class in gym.gym_class_list:
             # if isinstance(gym_class, GymClass): pass
-            for session in gym_class.session_list:
+            for session in gym_class.get_sessions(today, today):
                 if session.date == today:
                     session_bookings.append({
                         "session_info" : session.info,
@@ -1517,30 +3574,67 @@ class Manager(Staff):
 
     def remove_stock(self, product_id, amount):
         return self.__gym.remove_stock(product_id, amount)
+
+    def set_reorder_level(self, product_id, level):
+        return self.__gym.set_reorder_level(product_id, level)
+
+    def get_stock_alerts(self):
+        return self.__gym.get_stock_alerts()
+
+    def get_stock_movements(self, product_id = None, since = None, limit = 100):
+        return self.__gym.get_stock_movements(product_id, since, limit)
     
     def get_room_info(self):
-        return self.__gym.get_room_info()
+        return self.__gym.get_catalog("rooms")
 
     def get_report(self, month, year):
         return self.__gym.gather_report(month, year)
+
+    def archive_before(self, cutoff = None):
+        return self.__gym.archive_before(cutoff)
+
+    def get_occupancy(self, year, month = None, room_id = None, staff_id = None, class_id = None):
+        return self.__gym.get_occupancy(year, month, room_id, staff_id, class_id)
+
+    def find_free_slots(self, since, until, duration, capacity = 1, staff_id = None, room_id = None, opens = time(6, 0), closes = time(22, 0), limit = 50):
+        return self.__gym.find_free_slots(since, until, duration, capacity, staff_id, room_id, opens, closes, limit)
+
+    def plan_timetable(self, classes, week_start, availability = None, max_sessions = None, opens = time(6, 0), closes = time(22, 0), step = 30, budget = 2.0, workers = 1):
+        return self.__gym.plan_timetable(classes, week_start, availability, max_sessions, opens, closes, step, budget, workers)
+
+    def commit_timetable(self, sessions, week_start, weeks = None, until = None):
+        return self.__gym.commit_timetable(sessions, week_start, weeks, until)
     
     def show_notifications(self, gym=None):
         return []
     
     def set_membership_status(self, member_id, status):
         return self.__gym.set_membership_status(member_id, status)
+
+    def freeze_membership(self, member_id, since = None, until = None):
+        return self.__gym.freeze_membership(member_id, since, until)
+
+    def set_daypass_limit(self, daily_limit):
+        return self.__gym.set_daypass_limit(daily_limit)
+
+    def merge_duplicate_users(self):
+        return self.__gym.merge_duplicate_users()
+
+    def unfreeze_membership(self, member_id):
+        return self.__gym.unfreeze_membership(member_id)
     
 class MembershipPlan(Enum):
-    # Tuple format: (price, booking_discount, product_discount, locker_discount)
-    MONTHLY = (1500, 0.0, 0.0, 0.0)
-    ANNUAL = (15000, 0.2, 0.1, 0.15)
-    STUDENT = (1200, 0.15, 0.0, 0.10)
+    # Tuple format: (price, booking_discount, product_discount, locker_discount, term_days)
+    MONTHLY = (1500, 0.0, 0.0, 0.0, 30)
+    ANNUAL = (15000, 0.2, 0.1, 0.15, 365)
+    STUDENT = (1200, 0.15, 0.0, 0.10, 30)
 
-    def __init__(self, price, booking_discount, product_discount, locker_discount):
+    def __init__(self, price, booking_discount, product_discount, locker_discount, term_days):
         self.price = price
         self.booking_discount = booking_discount
         self.product_discount = product_discount
         self.locker_discount = locker_discount
+        self.term_days = term_days
 
 class TrainerTier(Enum):
     # Tuple format: (private_price, class_price)
@@ -1566,11 +3660,51 @@ class AbstractOrder(ABC):
         self.__payment = None
         self.__order_item_list = []
         self.__status = "Pending"
+        self.__updated_at = datetime.now()
+        self.__branch_id = None
+        # set on orders that stay open longer than the pending ttl (membership renewals)
+        self.__deadline = None
+        # which renewal order in a row this is for a lapsed membership, 0 for everything else
+        self.__renewal_attempt = 0
+
+    def __setstate__(self, state):
+        state.setdefault("_AbstractOrder__branch_id", None)
+        state.setdefault("_AbstractOrder__deadline", None)
+        state.setdefault("_AbstractOrder__renewal_attempt", 1 if state["_AbstractOrder__deadline"] else 0)
+        self.__dict__.update(state)
 
     @property
     def payment(self):
         return self.__payment
 
+    @property
+    def deadline(self):
+        return self.__deadline
+
+    def set_deadline(self, deadline):
+        self.__deadline = deadline
+
+    @property
+    def renewal_attempt(self):
+        return self.__renewal_attempt
+
+    def set_renewal_attempt(self, attempt):
+        self.__renewal_attempt = attempt
+
+    @property
+    def updated_at(self):
+        return self.__updated_at
+
+    @property
+    def branch_id(self):
+        return self.__branch_id
+
+    def set_branch_id(self, branch_id):
+        self.__branch_id = branch_id
+
+    def set_user(self, user):
+        self.__user = user
+
     @property
     def total_price(self):
         total = 0
@@ -1599,6 +3733,14 @@ class AbstractOrder(ABC):
     
     @property
     def info(self):
+        # paid / refunded / expired orders don't change anymore but their items can (a paid booking gets
+        # cancelled), so the cache is keyed on both and the per item calculate_price walk runs once per change
+        if self.__status in ("Paid", "Refunded", "Expired"):
+            key = (self.__status, tuple(order_item.info_key for order_item in self.__order_item_list))
+            return cached_info(self, key, self.__build_info)
+        return self.__build_info()
+
+    def __build_info(self):
         return {
             "order_id": self.__order_id,
             "status": self.__status,
@@ -1606,6 +3748,29 @@ class AbstractOrder(ABC):
             "order_items": [order_item.item_info(self.__user) for order_item in self.__order_item_list]
         }
     
+    @property
+    def closed_at(self):
+        if self.__payment and self.__payment.timestamp:
+            return self.__payment.timestamp
+        return self.__updated_at
+
+    @property
+    def archive_record(self):
+        return {
+            "order_id": self.__order_id,
+            "date": self.closed_at.date().isoformat(),
+            "status": self.__status,
+            "info": self.info
+        }
+
+    def is_archivable(self, cutoff):
+        if self.__status not in ("Paid", "Refunded", "Expired") or self.closed_at.date() >= cutoff:
+            return False
+        for order_item in self.__order_item_list:
+            if isinstance(order_item, Booking) and not order_item.is_archivable(cutoff):
+                return False
+        return True
+
     @property
     def notification(self):
         text = f"[order_id: {self.__order_id}] : "
@@ -1628,6 +3793,8 @@ class AbstractOrder(ABC):
             print(f"Error: {item} not found in the order.")
     
     def set_payment(self, payment):
+        if self.__status == "Expired":
+            raise Exception(f"Order {self.__order_id} has expired, please place a new one")
         if not isinstance(payment, (CashPayment, CreditCardPayment, QRPayment)):
             raise Exception("Not a valid payment type")
         self.__payment = payment
@@ -1641,6 +3808,7 @@ class AbstractOrder(ABC):
 
     def add_order_item(self, order_item):
         self.__order_item_list.append(order_item)
+        self.__updated_at = datetime.now()
 
     @abstractmethod
     def process(self):
@@ -1648,6 +3816,9 @@ class AbstractOrder(ABC):
 
 class Order(AbstractOrder):
     def process(self):
+        for order_item in self.order_item_list:
+            if isinstance(order_item, ProductAmount) and not order_item.is_reserved:
+                raise Exception(f"{order_item.product.product_id} on order {self.order_id} is no longer held, please place a new order")
         self.payment.set_amount(self.total_price)
         self.payment.process()
 
@@ -1682,6 +3853,12 @@ class Payment(ABC):
         self.__timestamp_payed = None
         self.__amount = None
         self.__status = "NoAmountSet"
+        self.__created_at = datetime.now()
+
+    def __setstate__(self, state):
+        # a payment loaded without a start time gets a fresh window
+        state.setdefault("_Payment__created_at", datetime.now())
+        self.__dict__.update(state)
 
     @property
     def payment_gateway_transaction_id(self):
@@ -1698,6 +3875,10 @@ class Payment(ABC):
     @property
     def timestamp(self):
         return self.__timestamp_payed
+
+    @property
+    def created_at(self):
+        return self.__created_at
     
     def set_payment_gateway_transaction_id(self, id):
         self.__payment_gateway_transaction_id = id
@@ -1707,6 +3888,9 @@ class Payment(ABC):
         if status in ["Paid", "Refunded"]:
             self.__timestamp_payed = datetime.now()
 
+    def set_timestamp(self, timestamp):
+        self.__timestamp_payed = timestamp
+
     def set_amount(self, amount):
         self.__amount = amount
         self.__status = "Pending"
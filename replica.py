@@ -0,0 +1,126 @@
+import gzip, os, threading, time
+from email.utils import formatdate
+
+from serialization import dumps
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def catalog_etag(token, version):
+    return '"' + token + "-" + ".".join(map(str, version)) + '"'
+
+class CatalogEntry:
+    # one built view: the data, its json body ({view: data}, what the route returns) and the http
+    # validators of the version it was built at. compressed bodies are made once per entry, on first ask
+    def __init__(self, name, data, etag, last_modified):
+        self.__data = data
+        self.__body = dumps({name: data})
+        self.__etag = etag
+        self.__last_modified = last_modified
+        self.__gzip_body = None
+        self.__brotli_body = None
+
+    @property
+    def data(self):
+        return self.__data
+
+    @property
+    def body(self):
+        return self.__body
+
+    @property
+    def etag(self):
+        return self.__etag
+
+    @property
+    def last_modified(self):
+        return self.__last_modified
+
+    @property
+    def gzip_body(self):
+        if self.__gzip_body is None:
+            self.__gzip_body = gzip.compress(self.__body, compresslevel=6)
+        return self.__gzip_body
+
+    @property
+    def brotli_body(self):
+        if brotli is None:
+            return None
+        if self.__brotli_body is None:
+            self.__brotli_body = brotli.compress(self.__body, quality=5)
+        return self.__brotli_body
+
+class ReadReplica:
+    # read views of catalog data (classes, sessions, rooms, stock, staff) that readers share without
+    # taking the gym lock. a view is rebuilt once the gym's write version moved on and it is at least
+    # min_refresh seconds old, or once it is max_age seconds old (for writes that don't bump the version,
+    # and for sessions passing). only one reader rebuilds at a time, the rest keep getting the old view.
+    # the etag and last-modified of a view come from the version alone (see validators), so a conditional
+    # GET is answered without building anything
+    def __init__(self, max_age = 5.0, min_refresh = 0.5):
+        self.__max_age = max_age
+        self.__min_refresh = min_refresh
+        self.__snapshots = {}
+        self.__refresh_lock = threading.Lock()
+        # versions start over with a new process, this keeps an old process' etags from matching
+        self.__token = os.urandom(4).hex()
+        # name -> (version, when that version was first seen)
+        self.__modified = {}
+
+    def __getstate__(self):
+        return {"max_age": self.__max_age, "min_refresh": self.__min_refresh}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_age"], state["min_refresh"])
+
+    @property
+    def max_age(self):
+        return self.__max_age
+
+    @property
+    def min_refresh(self):
+        return self.__min_refresh
+
+    def is_stale(self, name, version):
+        snapshot = self.__snapshots.get(name)
+        if snapshot is None:
+            return True
+        built_version, built_at, entry = snapshot
+        age = time.monotonic() - built_at
+        return age >= self.__max_age or (built_version != version and age >= self.__min_refresh)
+
+    def validators(self, name, version):
+        # (etag, last-modified) of the view at version, what entry() answers with once it's built there
+        modified = self.__modified.get(name)
+        if modified is None or modified[0] != version:
+            # last-modified has one second resolution, a new version always gets a later one
+            stamp = time.time() if modified is None else max(time.time(), modified[1] + 1)
+            modified = (version, stamp)
+            self.__modified[name] = modified
+        return catalog_etag(self.__token, version), formatdate(modified[1], usegmt=True)
+
+    def entry(self, name, version, build):
+        if not self.is_stale(name, version):
+            return self.__snapshots[name][2]
+        if not self.__refresh_lock.acquire(blocking=name not in self.__snapshots):
+            # somebody else is rebuilding, the old view is still within bounds
+            return self.__snapshots[name][2]
+        try:
+            if self.is_stale(name, version):
+                built_at = time.monotonic()
+                # snapshots are swapped in whole, a reader holding the old one never sees it change
+                self.__snapshots[name] = (version, built_at, CatalogEntry(name, build(), *self.validators(name, version)))
+            return self.__snapshots[name][2]
+        finally:
+            self.__refresh_lock.release()
+
+    def read(self, name, version, build):
+        return self.entry(name, version, build).data
+
+    def invalidate(self, name = None):
+        if name is None:
+            self.__snapshots = {}
+        else:
+            self.__snapshots.pop(name, None)
@@ -0,0 +1,121 @@
+from fastapi import  APIRouter, Depends, HTTPException, Query
+from database import get_gym
+from serialization import FastJSONResponse
+from pydantic import BaseModel, Field
+from typing import Literal, Optional, List
+
+# bounded, projected versions of the list endpoints plus a batch lookup, made for mcp agents: every
+# response is one page of flat records with only the fields asked for, so tool results stay small
+router = APIRouter(
+    prefix="/agent",
+    tags=["Agent"]
+)
+
+MAX_LIMIT = 100
+
+def project(record, fields):
+    if not fields:
+        return record
+    return {field: record[field] for field in fields if field in record}
+
+def parse_fields(fields):
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+def paginate(records, offset, limit, fields, build = None):
+    # build turns one record into its dict, only records on the page get built
+    items = records[offset:offset + limit]
+    if build:
+        items = [build(item) for item in items]
+    fields = parse_fields(fields)
+    return {
+        "total": len(records),
+        "offset": offset,
+        "next_offset": offset + limit if offset + limit < len(records) else None,
+        "items": [project(item, fields) for item in items]
+    }
+
+FIELDS_DESCRIPTION = "comma separated keys to keep in every item (e.g. 'session id,datetime'), leave empty for all of them"
+
+@router.get("/classes", description="Page through upcoming class sessions that still have seats, one flat item per session. Filter by class_id, pick fields to keep the result short", response_class=FastJSONResponse) ########
+def agent_classes(class_id: Optional[str] = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_LIMIT), fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION), gym = Depends(get_gym)):
+    try:
+        sessions = []
+        for gym_class in gym.get_catalog("classes"):
+            if class_id and gym_class["Class id"] != class_id:
+                continue
+            for session in gym_class["Class session"]:
+                sessions.append({"class id": gym_class["Class id"], "class name": gym_class["Class name"], **session})
+        return FastJSONResponse(paginate(sessions, offset, limit, fields))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/private", description="Page through upcoming private sessions that still have seats, one flat item per session. Filter by staff_id of a trainer, pick fields to keep the result short", response_class=FastJSONResponse) ########
+def agent_private_sessions(staff_id: Optional[str] = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_LIMIT), fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION), gym = Depends(get_gym)):
+    try:
+        sessions = []
+        for trainer in gym.get_catalog("private_sessions"):
+            if staff_id and trainer["Staff id"] != staff_id:
+                continue
+            for session in trainer["Sessions"]:
+                sessions.append({"staff id": trainer["Staff id"], "trainer name": trainer["Name"], **session})
+        return FastJSONResponse(paginate(sessions, offset, limit, fields))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/orders/{member_id}", description="Page through a member's orders, newest first. Filter by status (Pending, Paid, Refunded, Expired). fields defaults to order_id,status,total, add order_items to see the items", response_class=FastJSONResponse) ##########
+def agent_orders(member_id: str, status: Optional[str] = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_LIMIT), fields: Optional[str] = Query("order_id,status,total", description=FIELDS_DESCRIPTION), gym = Depends(get_gym)):
+    try:
+        member = gym.get_member_by_id(member_id)
+        orders = [order for order in reversed(member.order_list) if not status or order.status == status]
+        return FastJSONResponse(paginate(orders, offset, limit, fields, lambda order: order.info))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/bookings/{member_id}", description="Page through a member's training or locker bookings, newest first. Filter by status (e.g. Pending, Confirmed, Waitlist)", response_class=FastJSONResponse) ##########
+def agent_bookings(member_id: str, kind: Literal["training", "locker"] = "training", status: Optional[str] = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_LIMIT), fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION), gym = Depends(get_gym)):
+    try:
+        member = gym.get_member_by_id(member_id)
+        bookings = member.training_booking_list if kind == "training" else member.locker_booking_list
+        bookings = [booking for booking in reversed(bookings) if not status or booking.status == status]
+        return FastJSONResponse(paginate(bookings, offset, limit, fields, lambda booking: {"booking id": booking.booking_id, **booking.info}))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+BATCH_LOOKUPS = {
+    "member": lambda gym, key: gym.get_member_by_id(key).check_self_info(),
+    "notifications": lambda gym, key: gym.get_member_by_id(key).show_notifications(),
+    "order": lambda gym, key: gym.get_order_by_id(key).info,
+    "session": lambda gym, key: gym.get_session_by_id(key).info,
+    "class": lambda gym, key: gym.get_class_by_id(key).info,
+    "booking": lambda gym, key: booking_info(gym, key),
+    "room": lambda gym, key: gym.get_room_by_id(key).info
+}
+
+def booking_info(gym, booking_id):
+    booking = gym.get_booking_by_id(booking_id)
+    if booking is None:
+        raise Exception("booking not found")
+    return booking.info
+
+class BatchLookup(BaseModel):
+    op: Literal["member", "notifications", "order", "session", "class", "booking", "room"]
+    id: str = Field(description="member_id, order_id, session_id, class_id, booking_id or room_id depending on op")
+    fields: Optional[str] = Field(default=None, description=FIELDS_DESCRIPTION)
+
+class BatchRequest(BaseModel):
+    lookups: List[BatchLookup] = Field(min_length=1, max_length=MAX_LIMIT)
+
+@router.post("/batch", description="Run several lookups in one call instead of one tool call each. Every lookup gets its own ok / error, a failing one doesn't fail the rest", response_class=FastJSONResponse) ##########
+def agent_batch(request: BatchRequest, gym = Depends(get_gym)):
+    results = []
+    for lookup in request.lookups:
+        try:
+            result = project(BATCH_LOOKUPS[lookup.op](gym, lookup.id), parse_fields(lookup.fields))
+            results.append({"op": lookup.op, "id": lookup.id, "ok": True, "result": result})
+        except Exception as e:
+            results.append({"op": lookup.op, "id": lookup.id, "ok": False, "error": str(e)})
+    return FastJSONResponse({
+        "results": results
+    })
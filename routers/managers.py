@@ -1,7 +1,8 @@
-from fastapi import  APIRouter, Depends, HTTPException
-from database import get_gym
+from fastapi import  APIRouter, Depends, HTTPException, Request, Query
+from database import get_gym, get_registry
+from serialization import FastJSONResponse, catalog_response
 from pydantic import BaseModel, Field, model_validator
-from typing import Literal, Optional
+from typing import Literal, Optional, List
 from datetime import datetime, date, time, timedelta
 
 router = APIRouter(
@@ -9,44 +10,99 @@ router = APIRouter(
     tags=["Manager"]
 )
 
-@router.get("/getreport", description="Get a report of the gym's performance for a specific month and year") #############
+@router.get("/getreport", description="Get a report of the gym's performance for a specific month and year", response_class=FastJSONResponse) #############
 def get_report(month: int, year: int, gym = Depends(get_gym)):
     try:
         report = gym.gather_report(month, year)
-        return {
+        return FastJSONResponse({
+            "report": report,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/getreport/all", description="Get a report of every branch combined for a specific month and year, with each branch's own report alongside", response_class=FastJSONResponse) #############
+def get_report_all(month: int, year: int, registry = Depends(get_registry)):
+    try:
+        report = registry.gather_report(month, year)
+        return FastJSONResponse({
             "report": report,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/branches", description="List every branch of the gym. Pass a branch_id to any other endpoint to work on that branch") #############
+def get_branches(registry = Depends(get_registry)):
+    try:
+        return {
+            "branches": registry.get_branches()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class AddBranchRequest(BaseModel):
+    staff_id: str
+    branch_id: str
+    name: str
+    location: str
+
+@router.post("/addbranch", description="Open a new, empty branch. Members of any branch can book and buy there. Requires staff_id of a manager of the branch the request is sent to") #############
+def add_branch(request: AddBranchRequest, gym = Depends(get_gym), registry = Depends(get_registry)):
+    try:
+        gym.get_manager_by_id(request.staff_id)
+        registry.create_branch(request.branch_id, request.name, request.location)
+        return {
+            "success": f"succesfully added branch {request.branch_id}"
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-@router.get("/getroominfo",description = "Manager gets info of all the rooms. Requires staff_id as query parameter") #############
+@router.get("/getoccupancy", description="Get session occupancy of the gym for a year (or a month of it): fill rate, no-show rate, late check-in rate and room-hour utilisation. Optionally filter by one of room_id, staff_id (trainer) or class_id (use 'Private' for private sessions). Requires staff_id of a manager as manager_id", response_class=FastJSONResponse) #############
+def get_occupancy(manager_id: str, year: int, month: Optional[int] = None, room_id: Optional[str] = None, staff_id: Optional[str] = None, class_id: Optional[str] = None, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(manager_id)
+        occupancy = manager.get_occupancy(year, month, room_id, staff_id, class_id)
+        return FastJSONResponse({
+            "occupancy": occupancy,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/freeslots", description="Find free windows to schedule a session in: the earliest windows between since and until (dates, both included, at most a year) lasting at least duration minutes, in a room holding at least capacity people, within opens..closes every day. Pass staff_id of a trainer to only get windows the trainer is free too, room_id to search one room. Requires staff_id of a manager as manager_id", response_class=FastJSONResponse) #############
+def find_free_slots(manager_id: str, since: date, until: date, duration: int = Query(ge=1), capacity: int = Query(1, ge=1), staff_id: Optional[str] = None, room_id: Optional[str] = None, opens: time = time(6, 0), closes: time = time(22, 0), limit: int = Query(50, ge=1, le=500), gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(manager_id)
+        slots = manager.find_free_slots(since, until, duration, capacity, staff_id, room_id, opens, closes, limit)
+        return FastJSONResponse({
+            "slots": slots,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/getroominfo",description = "Manager gets info of all the rooms. Requires staff_id as query parameter", response_class=FastJSONResponse) #############
 def get_room_info(staff_id: str, gym = Depends(get_gym)):
     try:
         manager = gym.get_manager_by_id(staff_id)
         result = manager.get_room_info()
-        return {
+        return FastJSONResponse({
             "result": result,
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-@router.get("/getstockinfo", description="Get the current stock of all products in the gym") #############
-def get_stock_info(gym = Depends(get_gym)):
+@router.get("/getstockinfo", description="Get the current stock of all products in the gym, with the reorder level, how much went out over the last 28 days and how many days until each product runs out at that rate", response_class=FastJSONResponse) #############
+def get_stock_info(request: Request, gym = Depends(get_gym)):
     try:
-        stock = gym.get_stock_info()
-        return {
-            "stock": stock,
-        }
+        return catalog_response(request, gym, "stock")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-@router.get("/getstaffinfo", description="Get info of all staff in the gym") #############
+@router.get("/getstaffinfo", description="Get info of all staff in the gym", response_class=FastJSONResponse) #############
 def get_staff_info(gym = Depends(get_gym)):
     try:
-        staff = gym.get_staff_info()
-        return {
+        staff = gym.get_catalog("staff")
+        return FastJSONResponse({
             "staff": staff,
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
@@ -77,6 +133,44 @@ def remove_stock(request: StockRequest, gym = Depends(get_gym)) -> dict:
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+class ReorderLevelRequest(BaseModel):
+    staff_id: str
+    product_id: str
+    level: int = Field(ge=0)
+
+@router.post("/product/reorderlevel", description = "Manager sets the reorder level of a product by product_id (e.g. PRD-001): once the available stock is at or below it the product shows up in /manager/stockalerts. Requires staff_id, product_id, and level") #################
+def set_reorder_level(request: ReorderLevelRequest, gym = Depends(get_gym)) -> dict:
+    try:
+        manager = gym.get_manager_by_id(request.staff_id)
+        level = manager.set_reorder_level(request.product_id, request.level)
+        return {
+            "success": f"succesfully set reorder level of product_id: {request.product_id} to {level}"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/stockalerts", description="Get the products whose available stock is at or below their reorder level, and since when. Requires staff_id of a manager as manager_id", response_class=FastJSONResponse) #############
+def get_stock_alerts(manager_id: str, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(manager_id)
+        alerts = manager.get_stock_alerts()
+        return FastJSONResponse({
+            "alerts": alerts,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/stockmovements", description="Get the stock movements (initial stock, restocks, removals and sales) newest first, optionally of one product_id and only since a datetime. Requires staff_id of a manager as manager_id", response_class=FastJSONResponse) #############
+def get_stock_movements(manager_id: str, product_id: Optional[str] = None, since: Optional[datetime] = None, limit: int = Query(100, ge=1, le=1000), gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(manager_id)
+        movements = manager.get_stock_movements(product_id, since, limit)
+        return FastJSONResponse({
+            "movements": movements,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 class SetMemberStatusRequest(BaseModel):
     staff_id: str
     member_id: str
@@ -91,6 +185,82 @@ def set_member_status(request: SetMemberStatusRequest, gym = Depends(get_gym)) -
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+class FreezeMembershipRequest(BaseModel):
+    staff_id: str
+    member_id: str
+    since: Optional[datetime] = Field(default=None, description="when the freeze starts, now if left empty")
+    until: Optional[datetime] = Field(default=None, description="when it ends, leave empty to freeze until /manager/unfreezemembership")
+
+@router.post("/freezemembership", description="Manager freezes a member's running membership term: the member is Frozen meanwhile and the term ends later by however long the freeze lasts. Require member_id, staff_id", response_class=FastJSONResponse) #############
+def freeze_membership(request: FreezeMembershipRequest, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(request.staff_id)
+        term = manager.freeze_membership(request.member_id, request.since, request.until)
+        return FastJSONResponse({
+            "term": term,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class UnfreezeMembershipRequest(BaseModel):
+    staff_id: str
+    member_id: str
+
+@router.post("/unfreezemembership", description="Manager ends a member's membership freeze now. Require member_id, staff_id", response_class=FastJSONResponse) #############
+def unfreeze_membership(request: UnfreezeMembershipRequest, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(request.staff_id)
+        term = manager.unfreeze_membership(request.member_id)
+        return FastJSONResponse({
+            "term": term,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class DaypassLimitRequest(BaseModel):
+    staff_id: str
+    daily_limit: Optional[int] = Field(default=None, ge=0, description="daypasses a day, leave empty for no limit")
+
+@router.post("/daypasslimit", description="Manager sets how many daypasses can be approved a day. Require staff_id") #############
+def set_daypass_limit(request: DaypassLimitRequest, gym = Depends(get_gym)) -> dict:
+    try:
+        manager = gym.get_manager_by_id(request.staff_id)
+        daily_limit = manager.set_daypass_limit(request.daily_limit)
+        return {"success": f"daypass limit has been succesfully set to {daily_limit if daily_limit is not None else 'no limit'}"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class MergeDuplicatesRequest(BaseModel):
+    staff_id: str
+
+@router.post("/mergeduplicates", description="Fold records that share a citizen_id (left from before citizen ids were unique) into one: duplicate members into the oldest one, whose member_id the others keep pointing to, and duplicate guests into whoever is kept. Two staff records or a staff and a member record are only reported. Require staff_id", response_class=FastJSONResponse) #############
+def merge_duplicate_users(request: MergeDuplicatesRequest, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(request.staff_id)
+        result = manager.merge_duplicate_users()
+        return FastJSONResponse(result)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class ArchiveRequest(BaseModel):
+    staff_id: str
+    cutoff: Optional[date] = Field(
+        default=None,
+        description="closed bookings and orders older than this date get archived, defaults to the gym's archive age (90 days ago)"
+    )
+
+@router.post("/archive", description="Move closed bookings and orders older than the cutoff out of member records into the archive. Requires staff_id of a manager") #############
+def archive_records(request: ArchiveRequest, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(request.staff_id)
+        result = manager.archive_before(request.cutoff)
+        return {
+            "success": f"succesfully archived records older than {result['cutoff']}",
+            "archived": result["archived"]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 class AddReceptionistRequest(BaseModel):
     citizen_id: str
     name: str
@@ -160,34 +330,48 @@ class CreateClassSessionRequest(BaseModel):
     is_repeating: bool
     days_interval: Optional[int] = None
     times: Optional[int] = None
+    until: Optional[date] = Field(
+        default=None,
+        description="last date a repeating session can fall on, instead of (or together with) times"
+    )
 
     @model_validator(mode='after')
     def validate_repeating_logic(self):
         if self.is_repeating:
-            if self.days_interval is None or self.times is None:
-                raise ValueError("If 'is_repeating' is True, you must provide both 'days_interval' and 'times'.")
+            if self.days_interval is None or (self.times is None and self.until is None):
+                raise ValueError("If 'is_repeating' is True, you must provide 'days_interval' and 'times' and/or 'until'.")
         else:
-            if self.days_interval is not None or self.times is not None:
-                raise ValueError("If 'is_repeating' is False, 'days_interval' and 'times' should not be provided.")
+            if self.days_interval is not None or self.times is not None or self.until is not None:
+                raise ValueError("If 'is_repeating' is False, 'days_interval', 'times' and 'until' should not be provided.")
         return self
 
 @router.post("/createsession/class", description="Create a new session for a class") #############
 def create_class_session(request: CreateClassSessionRequest, gym = Depends(get_gym)):
     try:
-        gym_class = gym.get_class_by_id(request.class_id)
-        room = gym.get_room_by_id(request.room_id)
-        staff = gym.get_staff_by_id(request.staff_id)
-        if request.is_repeating:
-            gym_class.create_repeating_session(request.start_time,request.end_time,request.session_date,request.days_interval,request.times,request.max_participants,room,staff)
-        else:
-            new_session = gym_class.create_session(request.start_time,request.end_time,request.session_date,request.max_participants,room,staff)
+        new_session = gym.create_session(request.room_id,request.staff_id,request.start_time,request.end_time,request.session_date,request.max_participants,
+                                         class_id=request.class_id,days_interval=request.days_interval,times=request.times,until=request.until)
         return {
             "success": f"succesfully created a new session",
-            "session(s)_info": new_session.info if not request.is_repeating else gym_class.info
+            "session(s)_info": new_session.info if not request.is_repeating else gym.get_class_by_id(request.class_id).info
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+class SkipSeriesDateRequest(BaseModel):
+    series_id: str
+    skip_date: date
+
+@router.post("/series/skipdate", description="Leave one date out of a repeating session (e.g. a public holiday). Only works while nobody has booked that date, otherwise cancel the session") #############
+def skip_series_date(request: SkipSeriesDateRequest, gym = Depends(get_gym)):
+    try:
+        series = gym.skip_series_date(request.series_id, request.skip_date)
+        return {
+            "success": f"succesfully skipped {request.skip_date} in series {request.series_id}",
+            "series_info": series.info
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 class CreateTrainerSessionRequest(BaseModel):
     room_id: str
     start_time: time
@@ -202,29 +386,101 @@ class CreateTrainerSessionRequest(BaseModel):
     is_repeating: bool
     days_interval: Optional[int] = None
     times: Optional[int] = None
+    until: Optional[date] = Field(
+        default=None,
+        description="last date a repeating session can fall on, instead of (or together with) times"
+    )
 
     @model_validator(mode='after')
     def validate_repeating_logic(self):
         if self.is_repeating:
-            if self.days_interval is None or self.times is None:
-                raise ValueError("If 'is_repeating' is True, you must provide both 'days_interval' and 'times'.")
+            if self.days_interval is None or (self.times is None and self.until is None):
+                raise ValueError("If 'is_repeating' is True, you must provide 'days_interval' and 'times' and/or 'until'.")
         else:
-            if self.days_interval is not None or self.times is not None:
-                raise ValueError("If 'is_repeating' is False, 'days_interval' and 'times' should not be provided.")
+            if self.days_interval is not None or self.times is not None or self.until is not None:
+                raise ValueError("If 'is_repeating' is False, 'days_interval', 'times' and 'until' should not be provided.")
         return self
 
 @router.post("/createsession/trainer", description="Create a new session for a trainer") #############
 def create_trainer_session(request: CreateTrainerSessionRequest, gym = Depends(get_gym)):
     try:
-        room = gym.get_room_by_id(request.room_id)
-        staff = gym.get_staff_by_id(request.staff_id)
-        if request.is_repeating:
-            staff.create_repeating_session(request.start_time,request.end_time,request.session_date,request.days_interval,request.times,request.max_participants,room)
-        else:
-            new_session = staff.create_session(request.start_time,request.end_time,request.session_date,request.max_participants,room)
+        new_session = gym.create_session(request.room_id,request.staff_id,request.start_time,request.end_time,request.session_date,request.max_participants,
+                                         days_interval=request.days_interval,times=request.times,until=request.until)
         return {
             "success": f"succesfully created a new session",
-            "session(s)_info": new_session.info if not request.is_repeating else staff.session_info
+            "session(s)_info": new_session.info if not request.is_repeating else gym.get_staff_by_id(request.staff_id).session_info
         }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+class TimetableClass(BaseModel):
+    class_id: str
+    sessions: int = Field(ge=1, le=50, description="How many sessions of the class a week")
+    duration: int = Field(ge=5, description="Length of one session in minutes")
+    max_participants: int = Field(ge=1)
+    tiers: Optional[List[Literal["Junior", "Senior", "Master"]]] = Field(default=None, description="Only trainers of these tiers can teach it")
+    staff_ids: Optional[List[str]] = Field(default=None, description="Only these trainers can teach it")
+
+class TrainerWindow(BaseModel):
+    day: int = Field(ge=0, le=6, description="Weekday, 0 is monday")
+    start: time
+    end: time
+
+class PlanTimetableRequest(BaseModel):
+    manager_id: str
+    week_start: date = Field(description="First day of the week to plan, what is already booked that week is worked around")
+    classes: List[TimetableClass] = Field(min_length=1)
+    availability: dict[str, List[TrainerWindow]] = Field(default={}, description="staff_id of a trainer -> the windows they can teach in. Trainers left out can teach any time")
+    max_sessions: dict[str, int] = Field(default={}, description="staff_id of a trainer -> most sessions they teach a week")
+    opens: time = time(6, 0)
+    closes: time = time(22, 0)
+    step: int = Field(default=30, ge=5, le=120, description="Sessions start on multiples of this many minutes after opens")
+    budget: float = Field(default=2.0, gt=0, le=60, description="Seconds the search may run")
+    workers: int = Field(default=1, ge=1, le=32, description="Independent searches run side by side on separate cores, the best one wins. The server caps this at its own limit (a few processes)")
+
+@router.post("/timetable/plan", description="Plan a weekly class timetable: places every requested class session in a room big enough with a trainer who is free, avoiding what is already scheduled, and favouring times that filled up well in the last 12 weeks. Nothing is created, send the sessions to /manager/timetable/commit to schedule them", response_class=FastJSONResponse) #############
+def plan_timetable(request: PlanTimetableRequest, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(request.manager_id)
+        availability = {staff_id: [(window.day, window.start, window.end) for window in windows] for staff_id, windows in request.availability.items()}
+        plan = manager.plan_timetable([gym_class.model_dump() for gym_class in request.classes], request.week_start, availability, request.max_sessions,
+                                      request.opens, request.closes, request.step, request.budget, request.workers)
+        return FastJSONResponse({
+            "plan": plan,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class TimetableSession(BaseModel):
+    class_id: str
+    day: int = Field(ge=0, le=6, description="Weekday, 0 is monday")
+    start: time
+    end: time
+    room_id: str
+    staff_id: str
+    max_participants: int = Field(ge=1)
+
+class CommitTimetableRequest(BaseModel):
+    manager_id: str
+    week_start: date = Field(description="Every session repeats weekly from its weekday in this week")
+    sessions: List[TimetableSession] = Field(min_length=1)
+    weeks: Optional[int] = Field(default=None, ge=1)
+    until: Optional[date] = None
+
+    @model_validator(mode='after')
+    def check_weeks_or_until(self):
+        if self.weeks is None and self.until is None:
+            raise ValueError("Provide 'weeks' and/or 'until'.")
+        return self
+
+@router.post("/timetable/commit", description="Schedule a planned timetable: every session becomes a weekly repeating session. Either all of them are created or none (if one clashes with something booked meanwhile)", response_class=FastJSONResponse) #############
+def commit_timetable(request: CommitTimetableRequest, gym = Depends(get_gym)):
+    try:
+        manager = gym.get_manager_by_id(request.manager_id)
+        series = manager.commit_timetable([session.model_dump() for session in request.sessions], request.week_start, request.weeks, request.until)
+        return FastJSONResponse({
+            "success": f"succesfully scheduled {len(series)} weekly sessions",
+            "series": series
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,26 +1,22 @@
-from fastapi import  APIRouter, Depends, HTTPException
+from fastapi import  APIRouter, Depends, HTTPException, Request
 from database import get_gym
+from serialization import FastJSONResponse, catalog_response
 from pydantic import BaseModel
 from typing import Literal, Optional
+from datetime import date
 
 router = APIRouter(
     prefix="/member",
     tags=["Member"],
 )
 
-@router.get("/showclass", description="Show all available classes and their sessions that is not full and has not passed yet") ########
-def show_available_classes(gym = Depends(get_gym)):
-    classes = gym.get_available_classes()
-    return {
-        "classes": classes,
-    }
+@router.get("/showclass", description="Show all available classes and their sessions that is not full and has not passed yet", response_class=FastJSONResponse) ########
+def show_available_classes(request: Request, gym = Depends(get_gym)):
+    return catalog_response(request, gym, "classes")
 
-@router.get("/showprivate", description="Show all available trainers and their sessions that is not full and has not passed yet") #########
-def show_available_private_sessions(gym = Depends(get_gym)):
-    private_sessions = gym.get_available_private_sessions()
-    return {
-        "private_sessions": private_sessions,
-    }
+@router.get("/showprivate", description="Show all available trainers and their sessions that is not full and has not passed yet", response_class=FastJSONResponse) #########
+def show_available_private_sessions(request: Request, gym = Depends(get_gym)):
+    return catalog_response(request, gym, "private_sessions")
 
 @router.get("/notifications/{member_id}", description="Show notifications for a specific member") #########
 def show_notifications(member_id: str, gym = Depends(get_gym)):
@@ -33,34 +29,53 @@ def show_notifications(member_id: str, gym = Depends(get_gym)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-@router.get("/showbooking/{member_id}", description="Show current bookings for a specific member") ###########
+@router.get("/showbooking/{member_id}", description="Show current bookings for a specific member", response_class=FastJSONResponse) ###########
 def show_current_bookings(member_id: str, gym = Depends(get_gym)):
     try:
         member = gym.get_member_by_id(member_id)
         bookings = member.get_current_bookings()
-        return {
+        return FastJSONResponse({
             "bookings": bookings,
-        }
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+@router.get("/upcoming/{member_id}", description="Show a member's upcoming training bookings (waitlisted, pending or confirmed) soonest first, optionally only up to a date", response_class=FastJSONResponse) ###########
+def show_upcoming_bookings(member_id: str, until: Optional[date] = None, gym = Depends(get_gym)):
+    try:
+        member = gym.get_member_by_id(member_id)
+        return FastJSONResponse({
+            "upcoming": [booking.info for booking in member.get_upcoming_bookings(until)],
+        })
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-@router.get("/showorder/{member_id}", description="Show current orders for a specific member") ##########
+@router.get("/membership/{member_id}", description="Show a member's membership terms (start, end and freezes of every paid term) and until when it is paid", response_class=FastJSONResponse) ##########
+def show_membership_terms(member_id: str, gym = Depends(get_gym)):
+    try:
+        return FastJSONResponse({
+            "membership": gym.get_membership_terms(member_id)
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/showorder/{member_id}", description="Show current orders for a specific member", response_class=FastJSONResponse) ##########
 def show_current_orders(member_id: str, gym = Depends(get_gym)):
     try:
         member = gym.get_member_by_id(member_id)
-        return {
+        return FastJSONResponse({
             "orders": member.order_info
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-@router.get("/showspecificorder/{order_id}", description="Show order of the order_id") ##########
+@router.get("/showspecificorder/{order_id}", description="Show order of the order_id", response_class=FastJSONResponse) ##########
 def show_specific_order(order_id: str, gym = Depends(get_gym)):
     try:
         order = gym.get_order_by_id(order_id)
-        return {
+        return FastJSONResponse({
             "order": order.info
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -73,6 +88,16 @@ def check_self_info(member_id: str, gym = Depends(get_gym)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+@router.get("/history/{member_id}", description="Show archived (older, already closed) bookings and orders of a member. kind can be training_booking, locker_booking or order, since/until filter by date", response_class=FastJSONResponse) ##########
+def show_history(member_id: str, kind: Optional[Literal["training_booking", "locker_booking", "order"]] = None, since: Optional[date] = None, until: Optional[date] = None, gym = Depends(get_gym)):
+    try:
+        records = gym.get_archived_records(member_id, kind, since, until)
+        return FastJSONResponse({
+            "history": records
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
 class ChangeMembershipRequest(BaseModel):
     member_id: str
     new_membership_type: Literal["Monthly", "Annual", "Student"]
@@ -94,7 +119,9 @@ class EnrollSessionRequest(BaseModel):
 @router.post("/enrollsession", description="Enroll member into a session") ############
 def enroll_session(request: EnrollSessionRequest, gym = Depends(get_gym)) -> dict:
     try:
-        gym.enroll_member_by_id(request.member_id, request.session_id)
+        booking = gym.enroll_member_by_id(request.member_id, request.session_id)
+        if booking.status == "Waitlist":
+            return {"success": f"session with session_id: {request.session_id} is full. {request.member_id} has been added to the waitlist with booking_id: {booking.booking_id} and will be moved to pending when a seat frees up"}
         return {"success": f"{request.member_id} has been succesfully enrolled into session with session_id: {request.session_id}. please confirm booking by paying"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
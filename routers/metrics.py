@@ -0,0 +1,46 @@
+from fastapi import  APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from typing import Optional
+from metrics import registry, profiler
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["Metrics"]
+)
+
+@router.get("", response_class=PlainTextResponse, description="Per-route latency histograms and instrumented Gym method timings in Prometheus text format")
+def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+class InstrumentationRequest(BaseModel):
+    enabled: bool
+
+@router.post("/instrumentation", description="Turn the Gym method timing decorators on or off without restarting")
+def set_instrumentation(request: InstrumentationRequest) -> dict:
+    registry.set_enabled(request.enabled)
+    return {
+        "success": f"Gym method instrumentation is now {'on' if request.enabled else 'off'}"
+    }
+
+class StartProfileRequest(BaseModel):
+    seconds: Optional[float] = 30.0
+    interval: Optional[float] = None
+
+@router.post("/profile/start", description="Start the sampling profiler for a time window (seconds), use /metrics/profile to dump the stacks")
+def start_profile(request: StartProfileRequest) -> dict:
+    try:
+        profiler.start(request.seconds, request.interval)
+        return {
+            "success": f"profiler started for {request.seconds} seconds"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/profile/stop", response_class=PlainTextResponse, description="Stop the sampling profiler and dump the collapsed stacks (flamegraph.pl / speedscope compatible)")
+def stop_profile():
+    return PlainTextResponse(profiler.stop())
+
+@router.get("/profile", response_class=PlainTextResponse, description="Dump the collapsed stacks sampled so far (flamegraph.pl / speedscope compatible)")
+def get_profile():
+    return PlainTextResponse(profiler.collapsed())
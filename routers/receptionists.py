@@ -1,7 +1,7 @@
 from fastapi import  APIRouter, Depends, HTTPException
 from database import get_gym
-from pydantic import BaseModel, Field
-from typing import Literal, Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import Literal, Optional, List
 from datetime import datetime, date, time, timedelta
 
 router = APIRouter(
@@ -31,7 +31,7 @@ def approve_daypass(request: ApproveDayPassRequest, gym = Depends(get_gym)) -> d
         name = request.name
         citizen_id = request.citizen_id
         birth_date = request.birth_date
-        order_id = gym.approve_daypass(name, citizen_id, birth_date) # NOTE: in reality this is like giving the receptionist your card in exchange for the gym card
+        order_id = gym.approve_daypass(citizen_id, name, birth_date) # NOTE: in reality this is like giving the receptionist your card in exchange for the gym card
         return {
             "success": f"Daypass for {name} has been approved. Please pay to receive your daypass",
             "order_id": order_id
@@ -39,6 +39,13 @@ def approve_daypass(request: ApproveDayPassRequest, gym = Depends(get_gym)) -> d
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+@router.get("/daypasses", description="How many daypasses went out on a day (today if left empty) and the daily limit, pending ones included") ############
+def get_daypass_count(day: Optional[date] = None, gym = Depends(get_gym)) -> dict:
+    try:
+        return gym.get_daypass_count(day)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
 class MemberCheckInRequest(BaseModel):
     member_id: str
 
@@ -116,6 +123,25 @@ def sell_product(request: SellProductRequest, gym = Depends(get_gym)) -> dict:
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+class SellProductItem(BaseModel):
+    product_id: str
+    amount: int = Field(ge=1)
+
+class SellProductsRequest(BaseModel):
+    items: List[SellProductItem] = Field(min_length=1)
+    member_id: str = None
+
+@router.post("/sellproducts", description="Sell several products on one order. Stock for all of them is held until the order is paid or expires, if one is out of stock none get added [ONSITE ACTION by receptionist: in person at reception]") ###########
+def sell_products(request: SellProductsRequest, gym = Depends(get_gym)) -> dict:
+    try:
+        order = gym.sell_products([(item.product_id, item.amount) for item in request.items], request.member_id)
+        return {
+            "success": f"added {len(request.items)} products to order list",
+            "order_id": order.order_id
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
 class ReserveLockerRequest(BaseModel):
     member_id: str
     is_vip: bool
@@ -132,6 +158,49 @@ def reserve_locker(request: ReserveLockerRequest, gym = Depends(get_gym)) -> dic
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+class EnrollGroupRequest(BaseModel):
+    session_id: str
+    member_ids: List[str] = Field(min_length=1)
+    pay_cash: bool = Field(
+        default=False,
+        description="settle every new booking's order in cash straight away"
+    )
+
+@router.post("/enrollgroup", description="Enroll many members (e.g. a corporate group) into one session in one go. Whoever doesn't fit goes on the waitlist. Returns a result per member [ONSITE ACTION by receptionist: in person at reception]") ############
+def enroll_group(request: EnrollGroupRequest, gym = Depends(get_gym)):
+    try:
+        return gym.enroll_members_by_id(request.member_ids, request.session_id, request.pay_cash)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class EnrollSeriesRequest(BaseModel):
+    member_id: str
+    session_ids: Optional[List[str]] = None
+    class_id: Optional[str] = Field(
+        default=None,
+        description="enroll into every upcoming session of this class instead of listing session_ids"
+    )
+    pay_cash: bool = Field(
+        default=False,
+        description="settle the order in cash straight away"
+    )
+
+    @model_validator(mode='after')
+    def validate_sessions(self):
+        if (self.session_ids is None) == (self.class_id is None):
+            raise ValueError("Provide either 'session_ids' or 'class_id'.")
+        return self
+
+@router.post("/enrollseries", description="Enroll one member into a whole series of sessions (listed, or every upcoming session of a class) on one order. Returns a result per session [ONSITE ACTION by receptionist: in person at reception]") ############
+def enroll_series(request: EnrollSeriesRequest, gym = Depends(get_gym)):
+    try:
+        session_ids = request.session_ids
+        if request.class_id:
+            session_ids = [session.session_id for session in gym.get_class_by_id(request.class_id).get_sessions(since=date.today())]
+        return gym.enroll_member_in_sessions(request.member_id, session_ids, request.pay_cash)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # NOTE: a lot of the above function will result in something that is pending > can be paid/confirmed by paying
 # onsite payments (cash, creditcard, qr)
 
@@ -147,6 +216,18 @@ def pay_order_cash(request: PayOrderCashRequest, gym = Depends(get_gym)) -> dict
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+class PayOrdersCashRequest(BaseModel):
+    order_ids: List[str] = Field(min_length=1)
+
+@router.post("/pay_orders/cash", description="Pay for several orders using cash in one go, returns a result per order [ONSITE ACTION by receptionist: in person at reception]") ###########
+def pay_orders_cash(request: PayOrdersCashRequest, gym = Depends(get_gym)):
+    try:
+        return {
+            "payments": gym.pay_orders_cash(request.order_ids)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 class PayOrderCreditCardRequest(BaseModel):
     order_id: str
     card_num: int
@@ -1,7 +1,9 @@
 from fastapi import  APIRouter, Depends, HTTPException
 from database import get_gym
+from serialization import FastJSONResponse
 from pydantic import BaseModel, Field, model_validator
 from typing import Literal, Optional
+from datetime import date
 
 router = APIRouter(
     prefix="/trainer",
@@ -19,6 +21,15 @@ def show_notifications(staff_id: str, gym = Depends(get_gym)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
+@router.get("/schedule/{staff_id}", description="Show every class and private session a trainer teaches from since to until (dates, both included). Defaults to the 7 days from today", response_class=FastJSONResponse) #############
+def show_schedule(staff_id: str, since: Optional[date] = None, until: Optional[date] = None, gym = Depends(get_gym)):
+    try:
+        return FastJSONResponse({
+            "schedule": gym.get_trainer_schedule(staff_id, since, until)
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 class CancelSessionRequest(BaseModel):
     session_id: str
 
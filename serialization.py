@@ -0,0 +1,164 @@
+import json, weakref
+from datetime import datetime, date, time, timedelta
+from email.utils import parsedate_to_datetime
+from enum import Enum
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# one serializer per type, resolved through the mro the first time the type shows up
+_serializers = {}
+# info dicts of records that can't change anymore (paid orders, finished bookings), keyed by the record
+_info_cache = weakref.WeakKeyDictionary()
+
+def register(cls):
+    def decorator(function):
+        _serializers[cls] = function
+        return function
+    return decorator
+
+register(Enum)(lambda value: value.value)
+register(timedelta)(lambda value: value.total_seconds())
+register(set)(list)
+register(frozenset)(list)
+
+def serializer_for(cls):
+    if cls in _serializers:
+        return _serializers[cls]
+    for base in cls.__mro__[1:]:
+        if base in _serializers:
+            _serializers[cls] = _serializers[base]
+            return _serializers[cls]
+    if isinstance(getattr(cls, "info", None), property):
+        # domain objects serialize to their info dict
+        _serializers[cls] = lambda obj: obj.info
+        return _serializers[cls]
+    return None
+
+def default(obj):
+    serializer = serializer_for(type(obj))
+    if serializer is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return serializer(obj)
+
+def cached_info(record, key, build):
+    # key is whatever could still change the record (its status), the cached dict is shared so treat it as read only
+    cached = _info_cache.get(record)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    info = build()
+    _info_cache[record] = (key, info)
+    return info
+
+def _json_default(obj):
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    return default(obj)
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    # return one of these straight from a route to skip jsonable_encoder, orjson walks the dicts once in C
+    def render(self, content):
+        return dumps(content)
+
+# below this compressing costs more than it saves
+COMPRESS_MIN_SIZE = 1024
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+def _not_modified_since(if_modified_since, last_modified):
+    try:
+        return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+def _accepted_encodings(accept_encoding):
+    # coding -> q value from an Accept-Encoding header, a coding without a q is 1
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights
+
+def negotiate_encoding(accept_encoding, offered):
+    # the coding out of offered (most preferred first) the client weighs highest, q=0 means never.
+    # None means send it as is
+    weights = _accepted_encodings(accept_encoding)
+    best, best_weight = None, 0.0
+    for coding in offered:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    if weights.get("identity", 0.0) > best_weight:
+        return None
+    return best
+
+def _catalog_headers(etag, last_modified):
+    return {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    return bool(if_modified_since) and _not_modified_since(if_modified_since, last_modified)
+
+def catalog_response(request, gym, view):
+    # conditional GET over a prebuilt catalog view (see Gym.get_catalog_entry): the validators come from the
+    # view's collection versions, so a 304 is answered before the view is looked at, let alone rebuilt. a 200
+    # sends bytes that were serialized (and compressed) once per view version
+    validators = gym.get_catalog_validators(view)
+    if _not_modified(request, *validators):
+        return Response(status_code=304, headers=_catalog_headers(*validators))
+    entry = gym.get_catalog_entry(view)
+    # the view handed out can be a little behind the versions (see ReadReplica), it answers with its own
+    headers = _catalog_headers(entry.etag, entry.last_modified)
+    if _not_modified(request, entry.etag, entry.last_modified):
+        return Response(status_code=304, headers=headers)
+
+    body = entry.body
+    if len(body) >= COMPRESS_MIN_SIZE:
+        offered = ("br", "gzip") if entry.brotli_body is not None else ("gzip",)
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), offered)
+        if encoding == "br":
+            body = entry.brotli_body
+        elif encoding == "gzip":
+            body = entry.gzip_body
+        if encoding:
+            headers["Content-Encoding"] = encoding
+    # NegotiatedGZipMiddleware passes responses that already carry a Content-Encoding through untouched
+    return Response(body, media_type="application/json", headers=headers)
+
+class NegotiatedGZipMiddleware(GZipMiddleware):
+    # starlette only looks for "gzip" somewhere in Accept-Encoding, so "gzip;q=0" still got compressed
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+            if negotiate_encoding(accept_encoding, ("gzip",)) != "gzip":
+                await self.app(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,60 @@
+import contextlib, json, pickle, time
+
+import project
+
+PROFILES = ("empty", "demo", "snapshot", "fixture")
+
+def id_counters():
+    # every class keeps its own __next_id, these have to travel with a snapshot or new ids would collide
+    counters = {}
+    for name in dir(project):
+        cls = getattr(project, name)
+        attribute = f"_{name}__next_id"
+        if isinstance(cls, type) and cls.__module__ == "project" and attribute in cls.__dict__:
+            counters[name] = cls.__dict__[attribute]
+    return counters
+
+def restore_id_counters(counters):
+    for name, value in counters.items():
+        setattr(getattr(project, name), f"_{name}__next_id", value)
+
+def save_snapshot(gym, path):
+    # gym can also be a GymRegistry, then every branch goes into the one snapshot
+    branches = [gym.get_gym(branch_id) for branch_id in gym.branch_ids] if hasattr(gym, "branch_ids") else []
+    with contextlib.ExitStack() as stack:
+        for locked in [gym] + branches:
+            stack.enter_context(locked.lock)
+        data = pickle.dumps({"gym": gym, "counters": id_counters()}, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(path, "wb") as file:
+        file.write(data)
+
+def load_snapshot(path):
+    with open(path, "rb") as file:
+        state = pickle.load(file)
+    restore_id_counters(state["counters"])
+    gym = state["gym"]
+    for branch in [gym.get_gym(branch_id) for branch_id in gym.branch_ids] if hasattr(gym, "branch_ids") else [gym]:
+        branch.restore_reservations()
+    return gym
+
+def load_fixture(gym, path):
+    with open(path) as file:
+        gym.load_fixture(json.load(file))
+    return gym
+
+def boot(profile = "demo", path = None, seed = None, name = "my gym", location = "1/45 bangkok thailand"):
+    if profile not in PROFILES:
+        raise Exception(f"Invalid startup profile: {profile}. Valid: {', '.join(PROFILES)}")
+    if profile in ("snapshot", "fixture") and not path:
+        raise Exception(f"Startup profile '{profile}' needs a path")
+
+    start = time.perf_counter()
+    if profile == "snapshot":
+        gym = load_snapshot(path)
+    else:
+        gym = project.Gym(name, location)
+        if profile == "fixture":
+            load_fixture(gym, path)
+        elif profile == "demo":
+            seed(gym)
+    return gym, time.perf_counter() - start
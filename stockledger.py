@@ -0,0 +1,198 @@
+from array import array
+from datetime import datetime
+from operator import sub
+
+MOVEMENT_KINDS = ("Initial", "Restock", "Removal", "Sale")
+
+class StockMovement:
+    def __init__(self, product_id, kind, delta, balance, at):
+        self.__product_id = product_id
+        self.__kind = kind
+        self.__delta = delta
+        self.__balance = balance
+        self.__at = at
+
+    @property
+    def product_id(self):
+        return self.__product_id
+
+    @property
+    def kind(self):
+        return self.__kind
+
+    @property
+    def delta(self):
+        return self.__delta
+
+    @property
+    def balance(self):
+        return self.__balance
+
+    @property
+    def at(self):
+        return self.__at
+
+    @property
+    def info(self):
+        return {
+            "product id": self.__product_id,
+            "kind": self.__kind,
+            "delta": self.__delta,
+            "balance": self.__balance,
+            "at": self.__at
+        }
+
+class StockLedger:
+    # every stock movement is appended once and never rewritten. the figures the stock view needs are kept
+    # next to it, one array per figure with one slot per product, and updated as movements come in: on hand,
+    # reserved, units out per day over the last window_days (a ring of day rows) and their running sum.
+    # so the view and the forecast are a pass over a few columns, never over the movements
+    def __init__(self, window_days = 28):
+        self.__window_days = window_days
+        self.__movements = []
+        self.__slots = {}
+        self.__product_ids = []
+        self.__on_hand = array("q")
+        self.__reserved = array("q")
+        self.__reorder_level = array("q")
+        self.__first_day = array("q")
+        self.__window_out = array("q")
+        self.__total_in = array("q")
+        self.__total_out = array("q")
+        self.__day_rows = [array("q") for _ in range(window_days)]
+        # the newest day the ring has seen, set by the first movement
+        self.__day = None
+        # product_id -> open alert, raised when available drops to the reorder level, cleared once it's back above
+        self.__alerts = {}
+
+    @property
+    def window_days(self):
+        return self.__window_days
+
+    def __len__(self):
+        return len(self.__movements)
+
+    def register(self, product_id, amount, reorder_level = 0, at = None):
+        at = at or datetime.now()
+        self.__slots[product_id] = len(self.__product_ids)
+        self.__product_ids.append(product_id)
+        for column in (self.__on_hand, self.__reserved, self.__window_out, self.__total_in, self.__total_out):
+            column.append(0)
+        self.__reorder_level.append(reorder_level)
+        self.__first_day.append(at.toordinal())
+        for row in self.__day_rows:
+            row.append(0)
+        if amount:
+            self.record(product_id, "Initial", amount, at)
+        else:
+            self.__check_alert(self.__slots[product_id], at)
+
+    def __slot(self, product_id):
+        slot = self.__slots.get(product_id)
+        if slot is None:
+            raise Exception(f"Product '{product_id}' has no stock ledger")
+        return slot
+
+    def __advance(self, day):
+        # rows of days that fell out of the window come off the running sums and get reused
+        if self.__day is None:
+            self.__day = day
+        if day <= self.__day:
+            return
+        steps = min(day - self.__day, self.__window_days)
+        for offset in range(1, steps + 1):
+            row = self.__day_rows[(self.__day + offset) % self.__window_days]
+            self.__window_out = array("q", map(sub, self.__window_out, row))
+            self.__day_rows[(self.__day + offset) % self.__window_days] = array("q", bytes(len(row) * row.itemsize))
+        self.__day = day
+
+    def record(self, product_id, kind, delta, at = None):
+        if kind not in MOVEMENT_KINDS:
+            raise Exception(f"Invalid stock movement: {kind}. Valid: {', '.join(MOVEMENT_KINDS)}")
+        at = at or datetime.now()
+        slot = self.__slot(product_id)
+        day = at.toordinal()
+        self.__advance(day)
+        self.__on_hand[slot] += delta
+        if delta > 0:
+            self.__total_in[slot] += delta
+        else:
+            self.__total_out[slot] -= delta
+            if day > self.__day - self.__window_days:
+                self.__day_rows[day % self.__window_days][slot] -= delta
+                self.__window_out[slot] -= delta
+        movement = StockMovement(product_id, kind, delta, self.__on_hand[slot], at)
+        self.__movements.append(movement)
+        self.__check_alert(slot, at)
+        return movement
+
+    def hold(self, product_id, delta):
+        # reservations don't move stock, they only change what's still available
+        slot = self.__slot(product_id)
+        self.__reserved[slot] += delta
+        self.__check_alert(slot, datetime.now())
+
+    def set_reorder_level(self, product_id, level):
+        if level < 0:
+            raise Exception("Reorder level can't be negative")
+        slot = self.__slot(product_id)
+        self.__reorder_level[slot] = level
+        self.__check_alert(slot, datetime.now())
+
+    def __check_alert(self, slot, at):
+        product_id = self.__product_ids[slot]
+        available = self.__on_hand[slot] - self.__reserved[slot]
+        if available <= self.__reorder_level[slot]:
+            if product_id not in self.__alerts:
+                self.__alerts[product_id] = {
+                    "product id": product_id,
+                    "available": available,
+                    "reorder level": self.__reorder_level[slot],
+                    "since": at
+                }
+            else:
+                self.__alerts[product_id]["available"] = available
+                self.__alerts[product_id]["reorder level"] = self.__reorder_level[slot]
+        else:
+            self.__alerts.pop(product_id, None)
+
+    def alerts(self):
+        return [dict(alert) for alert in self.__alerts.values()]
+
+    def forecast(self, today = None):
+        # product_id -> figures for the whole catalog in one pass over the columns. the daily rate is the
+        # units out over the window, or over the days since the product came in if that's shorter
+        today = (today or datetime.now()).toordinal()
+        self.__advance(today)
+        window_days = self.__window_days
+        figures = {}
+        for product_id, on_hand, reserved, level, first_day, window_out, total_in, total_out in zip(
+                self.__product_ids, self.__on_hand, self.__reserved, self.__reorder_level, self.__first_day,
+                self.__window_out, self.__total_in, self.__total_out):
+            available = on_hand - reserved
+            daily_rate = window_out / max(1, min(window_days, today - first_day + 1))
+            figures[product_id] = {
+                "available": available,
+                "reorder level": level,
+                "low stock": available <= level,
+                "total in": total_in,
+                "total out": total_out,
+                "out last window": window_out,
+                "daily rate": round(daily_rate, 2),
+                "days until stockout": round(max(available, 0) / daily_rate, 1) if daily_rate else None,
+                "days until reorder": round(max(available - level, 0) / daily_rate, 1) if daily_rate else None
+            }
+        return figures
+
+    def movements(self, product_id = None, since = None, limit = 100):
+        # newest first, this one does walk the ledger (from the end) so it's for the history view only
+        result = []
+        for movement in reversed(self.__movements):
+            if since and movement.at < since:
+                break
+            if product_id and movement.product_id != product_id:
+                continue
+            result.append(movement.info)
+            if len(result) >= limit:
+                break
+        return result
@@ -0,0 +1,74 @@
+import heapq, threading, time
+from datetime import datetime
+
+class ExpiryIndex:
+    # min-heap ordered by expiry time, so a sweep only touches the entries that are due
+    def __init__(self):
+        self.__heap = []
+        self.__counter = 0
+
+    def __len__(self):
+        return len(self.__heap)
+
+    @property
+    def next_expiry(self):
+        return self.__heap[0][0] if self.__heap else None
+
+    def push(self, expires_at, item, order):
+        self.__counter += 1
+        heapq.heappush(self.__heap, (expires_at, self.__counter, item, order))
+
+    def pop_due(self, now):
+        due = []
+        while self.__heap and self.__heap[0][0] <= now:
+            expires_at, _, item, order = heapq.heappop(self.__heap)
+            due.append((item, order))
+        return due
+
+class PendingSweeper:
+    def __init__(self, gym, interval = 30, archive_interval = 24 * 3600):
+        self.__gym = gym
+        self.__interval = interval
+        self.__archive_interval = archive_interval
+        self.__last_archive = None
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+    @property
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, name="pending-sweeper", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__thread:
+            self.__thread.join()
+        self.__thread = None
+
+    def __run(self):
+        while not self.__stop_event.wait(self.__interval):
+            try:
+                result = self.__gym.sweep_expired(datetime.now())
+                if result["expired"]:
+                    print(f"Pending sweeper expired {result['expired']} item(s)")
+            except Exception as e:
+                print(f"Pending sweeper failed: {e}")
+            try:
+                result = self.__gym.sweep_memberships(datetime.now())
+                if result["expired"]:
+                    print(f"Pending sweeper expired {result['expired']} membership(s), renewal orders: {', '.join(result['renewal_orders'])}")
+            except Exception as e:
+                print(f"Membership sweep failed: {e}")
+            if self.__last_archive is None or time.monotonic() - self.__last_archive >= self.__archive_interval:
+                self.__last_archive = time.monotonic()
+                try:
+                    result = self.__gym.archive_before()
+                    print(f"Archived records older than {result['cutoff']}: {result['archived']}")
+                except Exception as e:
+                    print(f"Archiving failed: {e}")
@@ -0,0 +1,98 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+
+class Timeline:
+    # one person's (or room's) sessions or bookings sorted by start, anything with a start and end datetime.
+    # single entries sit in a sorted list, repeating sessions stay as their series rule and are asked for the
+    # one date in question, so an overlap check is a bisect plus one lookup per series instead of a walk over
+    # everything. active entries are kept from overlapping (see conflict), which is what lets the bisect stop
+    # at the first active neighbour before the new end
+    def __init__(self, active = None):
+        # active: whether an entry still holds its time (e.g. a booking that wasn't cancelled). entries
+        # that stopped holding it are dropped from the list whenever a lookup runs into them
+        self.__active = active
+        self.__starts = []
+        self.__entries = []
+        self.__series_list = []
+
+    @property
+    def series_list(self):
+        return tuple(self.__series_list)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def add(self, entry):
+        index = bisect_right(self.__starts, entry.start)
+        self.__starts.insert(index, entry.start)
+        self.__entries.insert(index, entry)
+
+    def remove(self, entry):
+        index = bisect_left(self.__starts, entry.start)
+        while index < len(self.__entries) and self.__starts[index] == entry.start:
+            if self.__entries[index] is entry:
+                del self.__starts[index]
+                del self.__entries[index]
+                return True
+            index += 1
+        return False
+
+    def add_series(self, series):
+        self.__series_list.append(series)
+
+    def remove_series(self, series):
+        if series in self.__series_list:
+            self.__series_list.remove(series)
+
+    def conflict(self, start, end, ignore = None):
+        # first entry overlapping [start, end), or None. cancelled series occurrences don't count,
+        # cancelled single sessions are taken out with remove
+        index = bisect_left(self.__starts, end) - 1
+        while index >= 0:
+            entry = self.__entries[index]
+            if self.__active and not self.__active(entry):
+                del self.__starts[index]
+                del self.__entries[index]
+            elif entry.end <= start:
+                break
+            elif entry is not ignore:
+                return entry
+            index -= 1
+        for series in self.__series_list:
+            for occurrence in series.occurrences(start.date(), end.date()):
+                if occurrence is ignore or occurrence.status == "Cancelled":
+                    continue
+                if occurrence.start < end and occurrence.end > start:
+                    return occurrence
+        return None
+
+    def window(self, since = None, until = None):
+        # every active entry with a date in [since, until], by start time
+        first = 0 if since is None else bisect_left(self.__starts, datetime.combine(since, time.min))
+        last = len(self.__starts) if until is None else bisect_right(self.__starts, datetime.combine(until, time.max))
+        entries = self.__entries[first:last]
+        if self.__active:
+            entries = [entry for entry in entries if self.__active(entry)]
+        for series in self.__series_list:
+            entries.extend(series.occurrences(since, until))
+        entries.sort(key=lambda entry: entry.start)
+        return entries
+
+def free_windows(busy, since, until, opens, closes, duration):
+    # sweep line: busy is anything with start/end sorted by start (overlaps are fine), yields the (start, end)
+    # gaps of at least duration inside opens..closes of every day from since to until, in order
+    busy = iter(busy)
+    pending = next(busy, None)
+    day = since
+    while day <= until:
+        cursor = datetime.combine(day, opens)
+        close = datetime.combine(day, closes)
+        while pending is not None and pending.start < close:
+            if pending.end > cursor:
+                if pending.start - cursor >= duration:
+                    yield cursor, pending.start
+                cursor = pending.end
+            pending = next(busy, None)
+        if close - cursor >= duration:
+            yield cursor, close
+        day += timedelta(days=1)
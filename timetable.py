@@ -0,0 +1,388 @@
+import math, multiprocessing, os, random, threading
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
+from datetime import time
+
+# searches never run in more processes than this at once, whatever a request asks for
+MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# one double booked cell (room or trainer) or one session over a trainer's weekly max. any timetable
+# without conflicts beats any timetable with one
+CONFLICT_COST = 1000.0
+# per session of a class on a day that already has one of that class
+SAME_DAY_COST = 3.0
+# per seat a room has beyond what the class needs, keeps the big rooms for the big classes
+ROOM_WASTE_COST = 0.02
+# starts tried per session while building the first timetable, the search takes it from there
+GREEDY_SAMPLE = 48
+
+class TimetableProblem:
+    # one week to fill. times are minutes from midnight, days are weekdays (0 is monday), the day from
+    # opens to closes is cut into step minute cells and sessions start on a cell.
+    # rooms: dicts with room_id, max_people and optionally busy [(day, start, end)]
+    # trainers: dicts with staff_id, tier and optionally available [(day, start, end)] (anytime if missing),
+    #   busy [(day, start, end)] and max_sessions (a week)
+    # classes: dicts with class_id, sessions (a week), duration (minutes), max_participants and optionally
+    #   tiers / staff_ids to pick the trainer from
+    # demand: expected bookings by (class_id, day, hour), falling back to (class_id, None, None) and then
+    #   to (None, day, hour) for the whole gym
+    def __init__(self, rooms, trainers, classes, demand = None, days = tuple(range(7)), opens = 6 * 60, closes = 22 * 60, step = 30):
+        if closes <= opens or (closes - opens) % step:
+            raise Exception("Opening hours have to be a whole number of steps")
+        self.rooms = list(rooms)
+        self.trainers = list(trainers)
+        self.classes = list(classes)
+        self.demand = demand or {}
+        self.days = tuple(days)
+        self.opens = opens
+        self.closes = closes
+        self.step = step
+        self.cells_per_day = (closes - opens) // step
+        for gym_class in self.classes:
+            if gym_class["duration"] > closes - opens:
+                raise Exception(f"Class {gym_class['class_id']} is longer than the opening hours")
+            if not self.rooms_for(gym_class):
+                raise Exception(f"No room fits {gym_class['max_participants']} people for class {gym_class['class_id']}")
+            if not self.trainers_for(gym_class):
+                raise Exception(f"No trainer can teach class {gym_class['class_id']}")
+
+    def rooms_for(self, gym_class):
+        # smallest room first
+        rooms = [index for index, room in enumerate(self.rooms) if room["max_people"] >= gym_class["max_participants"]]
+        return sorted(rooms, key=lambda index: self.rooms[index]["max_people"])
+
+    def trainers_for(self, gym_class):
+        tiers = gym_class.get("tiers")
+        staff_ids = gym_class.get("staff_ids")
+        return [index for index, trainer in enumerate(self.trainers)
+                if (not tiers or trainer["tier"] in tiers) and (not staff_ids or trainer["staff_id"] in staff_ids)]
+
+    def units(self, gym_class):
+        return -(-gym_class["duration"] // self.step)
+
+    def expected(self, class_id, day, hour):
+        for key in ((class_id, day, hour), (class_id, None, None), (None, day, hour)):
+            if key in self.demand:
+                return self.demand[key]
+        return 0.0
+
+    def window_mask(self, windows):
+        # cells touched by any of the (day, start, end) windows
+        mask = 0
+        for day, start, end in windows:
+            if day not in self.days:
+                continue
+            first = max(0, (start - self.opens) // self.step)
+            last = min(self.cells_per_day, -(-(end - self.opens) // self.step))
+            if last > first:
+                base = self.days.index(day) * self.cells_per_day
+                mask |= ((1 << (last - first)) - 1) << (base + first)
+        return mask
+
+    def to_time(self, cell):
+        return time(*divmod(self.opens + cell * self.step, 60))
+
+class TimetableSearch:
+    # greedy first timetable, then simulated annealing over moves of one session (new start, room or
+    # trainer) and swaps of two sessions' starts until the time budget runs out. cell occupancy is kept
+    # as counts for the cost and as int bitmasks so "is this room free then" is one and
+    def __init__(self, problem, seed = 0):
+        self.__problem = problem
+        self.__rng = random.Random(seed)
+        per_day = problem.cells_per_day
+        cells = per_day * len(problem.days)
+        all_cells = (1 << cells) - 1
+
+        self.__room_count = [[0] * cells for _ in problem.rooms]
+        self.__room_mask = [0] * len(problem.rooms)
+        for index, room in enumerate(problem.rooms):
+            self.__block(self.__room_count, self.__room_mask, index, problem.window_mask(room.get("busy", ())))
+        self.__trainer_count = [[0] * cells for _ in problem.trainers]
+        self.__trainer_mask = [0] * len(problem.trainers)
+        self.__trainer_load = [0] * len(problem.trainers)
+        self.__trainer_max = [trainer.get("max_sessions") or math.inf for trainer in problem.trainers]
+        for index, trainer in enumerate(problem.trainers):
+            blocked = problem.window_mask(trainer.get("busy", ()))
+            if trainer.get("available") is not None:
+                blocked |= all_cells & ~problem.window_mask(trainer["available"])
+            self.__block(self.__trainer_count, self.__trainer_mask, index, blocked)
+
+        # one entry per session to place
+        self.__lesson_class = [index for index, gym_class in enumerate(problem.classes) for _ in range(gym_class["sessions"])]
+        self.__units = [problem.units(gym_class) for gym_class in problem.classes]
+        self.__starts = [[(day, cell) for day in range(len(problem.days)) for cell in range(per_day - units + 1)] for units in self.__units]
+        self.__rooms_ok = [problem.rooms_for(gym_class) for gym_class in problem.classes]
+        self.__trainers_ok = [problem.trainers_for(gym_class) for gym_class in problem.classes]
+        self.__score = []
+        for gym_class in problem.classes:
+            score = {}
+            for day, cell in self.__starts[len(self.__score)]:
+                hour = (problem.opens + cell * problem.step) // 60
+                score[(day, cell)] = min(problem.expected(gym_class["class_id"], problem.days[day], hour), gym_class["max_participants"])
+            self.__score.append(score)
+        self.__waste = [{room: ROOM_WASTE_COST * (problem.rooms[room]["max_people"] - gym_class["max_participants"]) for room in rooms}
+                        for gym_class, rooms in zip(problem.classes, self.__rooms_ok)]
+        self.__class_day = [[0] * len(problem.days) for _ in problem.classes]
+
+        self.__placement = [None] * len(self.__lesson_class)
+        self.__conflicts = 0
+        self.__cost = 0.0
+
+    @staticmethod
+    def __block(counts, masks, index, mask):
+        masks[index] |= mask
+        cell = 0
+        while mask:
+            if mask & 1:
+                counts[index][cell] = 1
+            mask >>= 1
+            cell += 1
+
+    def __cells(self, lesson, day, cell):
+        units = self.__units[self.__lesson_class[lesson]]
+        base = day * self.__problem.cells_per_day + cell
+        return base, units, ((1 << units) - 1) << base
+
+    def __place(self, lesson, placement):
+        day, cell, room, trainer = placement
+        gym_class = self.__lesson_class[lesson]
+        base, units, mask = self.__cells(lesson, day, cell)
+        room_count = self.__room_count[room]
+        trainer_count = self.__trainer_count[trainer]
+        conflicts = 0
+        for index in range(base, base + units):
+            if room_count[index]:
+                conflicts += 1
+            room_count[index] += 1
+            if trainer_count[index]:
+                conflicts += 1
+            trainer_count[index] += 1
+        self.__room_mask[room] |= mask
+        self.__trainer_mask[trainer] |= mask
+        if self.__trainer_load[trainer] >= self.__trainer_max[trainer]:
+            conflicts += 1
+        self.__trainer_load[trainer] += 1
+        cost = SAME_DAY_COST * self.__class_day[gym_class][day] - self.__score[gym_class][(day, cell)] + self.__waste[gym_class][room]
+        self.__class_day[gym_class][day] += 1
+        self.__placement[lesson] = placement
+        self.__conflicts += conflicts
+        self.__cost += cost
+        return conflicts * CONFLICT_COST + cost
+
+    def __remove(self, lesson):
+        day, cell, room, trainer = self.__placement[lesson]
+        gym_class = self.__lesson_class[lesson]
+        base, units, mask = self.__cells(lesson, day, cell)
+        room_count = self.__room_count[room]
+        trainer_count = self.__trainer_count[trainer]
+        conflicts = 0
+        for index in range(base, base + units):
+            room_count[index] -= 1
+            if room_count[index]:
+                conflicts += 1
+            else:
+                self.__room_mask[room] &= ~(1 << index)
+            trainer_count[index] -= 1
+            if trainer_count[index]:
+                conflicts += 1
+            else:
+                self.__trainer_mask[trainer] &= ~(1 << index)
+        self.__trainer_load[trainer] -= 1
+        if self.__trainer_load[trainer] >= self.__trainer_max[trainer]:
+            conflicts += 1
+        self.__class_day[gym_class][day] -= 1
+        cost = SAME_DAY_COST * self.__class_day[gym_class][day] - self.__score[gym_class][(day, cell)] + self.__waste[gym_class][room]
+        self.__placement[lesson] = None
+        self.__conflicts -= conflicts
+        self.__cost -= cost
+        return -(conflicts * CONFLICT_COST + cost)
+
+    def __free_room(self, gym_class, mask, keep = None, shuffle = False):
+        if keep is not None and not self.__room_mask[keep] & mask:
+            return keep
+        rooms = self.__rooms_ok[gym_class]
+        if shuffle:
+            rooms = self.__rng.sample(rooms, len(rooms))
+        for room in rooms:
+            if not self.__room_mask[room] & mask:
+                return room
+        return None
+
+    def __free_trainer(self, gym_class, mask, keep = None):
+        if keep is not None and not self.__trainer_mask[keep] & mask and self.__trainer_load[keep] < self.__trainer_max[keep]:
+            return keep
+        best = None
+        for trainer in self.__trainers_ok[gym_class]:
+            if self.__trainer_mask[trainer] & mask or self.__trainer_load[trainer] >= self.__trainer_max[trainer]:
+                continue
+            if best is None or self.__trainer_load[trainer] < self.__trainer_load[best]:
+                best = trainer
+        return best
+
+    def __build(self):
+        # hardest sessions first: fewest rooms and trainers to pick from, longest
+        order = sorted(range(len(self.__lesson_class)), key=lambda lesson: (
+            len(self.__rooms_ok[self.__lesson_class[lesson]]) * len(self.__trainers_ok[self.__lesson_class[lesson]]),
+            -self.__units[self.__lesson_class[lesson]],
+            self.__rng.random()))
+        for lesson in order:
+            gym_class = self.__lesson_class[lesson]
+            starts = self.__starts[gym_class]
+            best = None
+            for candidates in (self.__rng.sample(starts, min(GREEDY_SAMPLE, len(starts))), starts):
+                for day, cell in candidates:
+                    mask = self.__cells(lesson, day, cell)[2]
+                    room = self.__free_room(gym_class, mask)
+                    if room is None:
+                        continue
+                    trainer = self.__free_trainer(gym_class, mask)
+                    if trainer is None:
+                        continue
+                    cost = SAME_DAY_COST * self.__class_day[gym_class][day] - self.__score[gym_class][(day, cell)] + self.__waste[gym_class][room]
+                    if best is None or cost < best[0]:
+                        best = (cost, (day, cell, room, trainer))
+                if best:
+                    break
+            if best is None:
+                # nothing free anywhere, the search has to make room
+                day, cell = self.__rng.choice(starts)
+                best = (None, (day, cell, self.__rng.choice(self.__rooms_ok[gym_class]), self.__rng.choice(self.__trainers_ok[gym_class])))
+            self.__place(lesson, best[1])
+
+    def __conflicted(self, lesson):
+        day, cell, room, trainer = self.__placement[lesson]
+        base, units, mask = self.__cells(lesson, day, cell)
+        room_count = self.__room_count[room]
+        trainer_count = self.__trainer_count[trainer]
+        if self.__trainer_load[trainer] > self.__trainer_max[trainer]:
+            return True
+        return any(room_count[index] > 1 or trainer_count[index] > 1 for index in range(base, base + units))
+
+    def __pick(self):
+        lessons = len(self.__placement)
+        if self.__conflicts:
+            for _ in range(16):
+                lesson = self.__rng.randrange(lessons)
+                if self.__conflicted(lesson):
+                    return lesson
+        return self.__rng.randrange(lessons)
+
+    def __propose(self, lesson):
+        # moves the lesson and returns (cost delta, undo)
+        rng = self.__rng
+        old = self.__placement[lesson]
+        gym_class = self.__lesson_class[lesson]
+        delta = self.__remove(lesson)
+        roll = rng.random()
+        if roll < 0.6:
+            day, cell = rng.choice(self.__starts[gym_class])
+            mask = self.__cells(lesson, day, cell)[2]
+            room = self.__free_room(gym_class, mask, keep=old[2], shuffle=True)
+            trainer = self.__free_trainer(gym_class, mask, keep=old[3])
+            new = (day, cell,
+                   rng.choice(self.__rooms_ok[gym_class]) if room is None else room,
+                   rng.choice(self.__trainers_ok[gym_class]) if trainer is None else trainer)
+        elif roll < 0.8:
+            new = (old[0], old[1], rng.choice(self.__rooms_ok[gym_class]), old[3])
+        else:
+            new = (old[0], old[1], old[2], rng.choice(self.__trainers_ok[gym_class]))
+        delta += self.__place(lesson, new)
+
+        def undo():
+            self.__remove(lesson)
+            self.__place(lesson, old)
+        return delta, undo
+
+    def __propose_swap(self, lesson):
+        # two sessions of the same length trade starts, keeping their rooms and trainers
+        rng = self.__rng
+        other = rng.randrange(len(self.__placement))
+        if other == lesson or self.__units[self.__lesson_class[other]] != self.__units[self.__lesson_class[lesson]]:
+            return None
+        first = self.__placement[lesson]
+        second = self.__placement[other]
+        delta = self.__remove(lesson) + self.__remove(other)
+        delta += self.__place(lesson, (second[0], second[1], first[2], first[3]))
+        delta += self.__place(other, (first[0], first[1], second[2], second[3]))
+
+        def undo():
+            self.__remove(lesson)
+            self.__remove(other)
+            self.__place(lesson, first)
+            self.__place(other, second)
+        return delta, undo
+
+    def run(self, budget = 2.0, start_temperature = 5.0, end_temperature = 0.05):
+        started = timer.perf_counter()
+        self.__build()
+        best = (self.__conflicts, self.__cost, list(self.__placement))
+        iterations = 0
+        temperature = start_temperature
+        if self.__placement:
+            while True:
+                if iterations % 256 == 0:
+                    elapsed = timer.perf_counter() - started
+                    if elapsed >= budget:
+                        break
+                    temperature = start_temperature * (end_temperature / start_temperature) ** (elapsed / budget)
+                iterations += 1
+                lesson = self.__pick()
+                move = self.__propose_swap(lesson) if self.__rng.random() < 0.2 else None
+                delta, undo = move or self.__propose(lesson)
+                if delta > 0 and self.__rng.random() >= math.exp(-delta / temperature):
+                    undo()
+                elif (self.__conflicts, self.__cost) < best[:2]:
+                    best = (self.__conflicts, self.__cost, list(self.__placement))
+        return self.__result(best, iterations, timer.perf_counter() - started)
+
+    def __result(self, best, iterations, seconds):
+        problem = self.__problem
+        conflicts, cost, placement = best
+        sessions = []
+        for lesson, (day, cell, room, trainer) in enumerate(placement):
+            gym_class = problem.classes[self.__lesson_class[lesson]]
+            sessions.append({
+                "class_id": gym_class["class_id"],
+                "day": problem.days[day],
+                "start": problem.to_time(cell),
+                "end": time(*divmod(problem.opens + cell * problem.step + gym_class["duration"], 60)),
+                "room_id": problem.rooms[room]["room_id"],
+                "staff_id": problem.trainers[trainer]["staff_id"],
+                "max_participants": gym_class["max_participants"]
+            })
+        sessions.sort(key=lambda session: (session["day"], session["start"], session["room_id"]))
+        return {
+            "sessions": sessions,
+            "conflicts": conflicts,
+            "cost": round(cost, 3),
+            "iterations": iterations,
+            "seconds": round(seconds, 3)
+        }
+
+def _search(problem, budget, seed):
+    return TimetableSearch(problem, seed).run(budget)
+
+def _get_pool():
+    # one pool for the whole process, made on first use. spawn rather than fork: the server forks from a
+    # request thread while other threads may hold locks, and a forked child would inherit them held forever
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def solve(problem, budget = 2.0, seed = 0, workers = 1):
+    # workers > 1 runs that many independent searches (different seeds) in the shared pool and keeps
+    # the best, each one gets the whole budget. capped at MAX_WORKERS
+    workers = max(1, min(workers, MAX_WORKERS))
+    if workers == 1:
+        result = _search(problem, budget, seed)
+    else:
+        results = list(_get_pool().map(_search, [problem] * workers, [budget] * workers, [seed + index for index in range(workers)]))
+        result = min(results, key=lambda result: (result["conflicts"], result["cost"]))
+        result["iterations"] = sum(result["iterations"] for result in results)
+    result["restarts"] = workers
+    return result